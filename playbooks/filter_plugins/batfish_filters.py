@@ -0,0 +1,60 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Filters to aggregate the results of the Batfish modules across playbooks in a single pass.
+
+Accumulating a list with set_fact in a loop re-templates the whole list on every iteration, and
+combine(recursive=True) copies every nested value, including all the rows under result_verbose.  These
+filters visit each key once and only copy the dictionaries that are merged, keeping references to
+everything else, so their cost grows with the number of checks rather than the number of rows.
+"""
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+def merge_results(results, new):
+    """
+    Return results with new merged into it, like combine(new, recursive=True): dictionaries in both are
+    merged, and other values from new replace those in results.  Neither argument is modified.
+    """
+    if results is None:
+        return new
+    merged = dict(results)
+    for key, value in new.items():
+        if isinstance(value, Mapping) and isinstance(merged.get(key), Mapping):
+            merged[key] = merge_results(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def merge_tests(tests, result):
+    """
+    Return the list of test names tests followed by the names of the checks in result, the result of a
+    Batfish module, in order.
+    """
+    return list(tests or []) + list(result)
+
+
+class FilterModule(object):
+
+    def filters(self):
+        return dict(
+            merge_results=merge_results,
+            merge_tests=merge_tests,
+        )
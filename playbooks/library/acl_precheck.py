@@ -0,0 +1,271 @@
+#!/usr/bin/python
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: acl_precheck
+
+short_description: Checks ACL changes locally, before a candidate snapshot is uploaded to Batfish
+
+version_added: "2.7"
+
+description:
+    - "Answers searchfilters-style checks on the ACLs in the device configs of two local snapshot directories, without the C(Batfish) service.  ACL lines are modelled exactly as ranges of header fields, so a check that fails here also fails in C(Batfish).  ACLs using syntax that is not modelled are reported as C(UNKNOWN) and never fail a check, so C(batfish_searchfilters) should still be run as the final gate."
+
+options:
+    base_path:
+        description:
+            - Path to the directory containing the base snapshot's files.
+        required: true
+    checks:
+        description:
+            - List of checks, each a dictionary with a C(description) and the options C(snapshot), C(reference_snapshot), C(action) and C(invert_search), which work like the C(batfish_searchfilters) options of the same names with snapshots named C(base) or C(candidate).  A check passes if no matching flows are found.
+        required: true
+    destination_ips:
+        description:
+            - Comma-separated destination prefixes or addresses of the flows to check.  All if not specified.
+        required: false
+    destination_ports:
+        description:
+            - Comma-separated destination ports or port ranges (C(low-high)) of the flows to check.  All if not specified.
+        required: false
+    filters:
+        description:
+            - Regex matching the names of the ACLs to check, case-insensitively as in Batfish.
+        required: false
+        default: .*
+    ip_protocols:
+        description:
+            - List of IP protocols of the flows to check.  All if not specified.
+        required: false
+    nodes:
+        description:
+            - Regex matching the names of the nodes whose ACLs to check, case-insensitively as in Batfish.
+        required: false
+        default: .*
+    path:
+        description:
+            - Path to the directory containing the candidate snapshot's files.  Only device configs in C(configs/) are read.
+        required: true
+    source_ips:
+        description:
+            - Comma-separated source prefixes or addresses of the flows to check.  All if not specified.
+        required: false
+    source_ports:
+        description:
+            - Comma-separated source ports or port ranges of the flows to check.  All if not specified.
+        required: false
+
+author:
+    - Spencer Fraint (`@sfraint <https://github.com/sfraint>`_)
+'''
+
+EXAMPLES = '''
+- name: Check an ACL change before uploading the candidate snapshot
+  acl_precheck:
+    base_path: /path/to/base_snapshot_dir/
+    path: /path/to/candidate_snapshot_dir/
+    filters: "acl_in"
+    nodes: "nodeA|nodeB"
+    source_ips: "10.10.10.0/24"
+    destination_ips: "18.18.18.0/27"
+    ip_protocols: "tcp"
+    destination_ports: "80,8080"
+    checks:
+      - description: Intended traffic is not already permitted
+        snapshot: base
+        action: permit
+      - description: Intended traffic is permitted after change
+        action: deny
+      - description: No collateral damage caused by change
+        snapshot: base
+        reference_snapshot: candidate
+        invert_search: yes
+  register: precheck
+'''
+
+RETURN = '''
+flows:
+    description: Dictionary of check description to a list of example flows that failed the check, each with the node and filter it was found on
+    type: dict
+result:
+    description: Dictionary of check description to C(PASS), C(FAIL) with the number of failing ACLs, or C(UNKNOWN) with the reason it could not be checked locally
+    type: dict
+summary:
+    description: C(FAIL) if any check failed, otherwise C(PASS)
+    type: str
+'''
+
+from ansible.module_utils.acl_headerspace import (UnsupportedAclError, complement, differences, example_flow,
+                                                  header_space, parse_config_acls)
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.batfish_snapshots import config_node, is_config
+
+import os
+import re
+
+PASS = 'PASS'
+FAIL = 'FAIL'
+UNKNOWN = 'UNKNOWN'
+
+SNAPSHOTS = ['base', 'candidate']
+
+
+def run_module():
+    # define the available arguments/parameters that a user can pass to
+    # the module
+    module_args = dict(
+        base_path=dict(type='path', required=True),
+        checks=dict(type='list', required=True),
+        destination_ips=dict(type='str', required=False, default=None),
+        destination_ports=dict(type='str', required=False, default=None),
+        filters=dict(type='str', required=False, default='.*'),
+        ip_protocols=dict(type='list', required=False, default=None),
+        nodes=dict(type='str', required=False, default='.*'),
+        path=dict(type='path', required=True),
+        source_ips=dict(type='str', required=False, default=None),
+        source_ports=dict(type='str', required=False, default=None)
+    )
+
+    # seed the result dict in the object
+    # we primarily care about changed and state
+    # change is if this module effectively modified the target
+    # state will include any data that you want your module to pass back
+    # for consumption, for example, in a subsequent task
+    result = dict(
+        changed=False,
+        flows={},
+        result={},
+        summary=PASS,
+    )
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    checks = []
+    for check in module.params['checks']:
+        check = dict(dict(snapshot='candidate', reference_snapshot=None, action='permit', invert_search=False),
+                     **check)
+        if 'description' not in check:
+            module.fail_json(msg='Every check requires a description', **result)
+        if check['snapshot'] not in SNAPSHOTS or check['reference_snapshot'] not in SNAPSHOTS + [None]:
+            module.fail_json(msg="Check '{}': snapshots must be one of {}".format(check['description'], SNAPSHOTS),
+                             **result)
+        checks.append(check)
+
+    try:
+        headers = header_space(module.params['source_ips'], module.params['destination_ips'],
+                               module.params['ip_protocols'], module.params['source_ports'],
+                               module.params['destination_ports'])
+    except (UnsupportedAclError, ValueError) as e:
+        module.fail_json(msg='Failed to parse header constraints: {}'.format(e), **result)
+
+    try:
+        acls = dict(base=_load_acls(module.params['base_path'], module.params['nodes'], module.params['filters']),
+                    candidate=_load_acls(module.params['path'], module.params['nodes'], module.params['filters']))
+    except Exception as e:
+        module.fail_json(msg='Failed to read snapshot configs: {}'.format(e), **result)
+
+    for check in checks:
+        description = check['description']
+        space = complement(headers) if check['invert_search'] else headers
+        flows, unknown = _run_check(check, acls, space)
+        if flows:
+            result['result'][description] = '{}, found flows on {} ACLs'.format(FAIL, len(flows))
+            result['flows'][description] = flows
+            result['summary'] = FAIL
+        elif unknown:
+            result['result'][description] = '{}, {}'.format(UNKNOWN, '; '.join(unknown))
+        else:
+            result['result'][description] = PASS
+
+    module.exit_json(**result)
+
+
+def _load_acls(path, nodes, filters):
+    """
+    Return the ACLs matching filters on the nodes matching nodes in a snapshot directory, as a
+    dictionary of (node, ACL name) to Acl, or to the UnsupportedAclError raised when parsing it.
+    """
+    acls = {}
+    configs_dir = os.path.join(path, 'configs')
+    for file_name in sorted(os.listdir(configs_dir)):
+        node = config_node(file_name)
+        if not is_config('configs/' + file_name) or not _matches(nodes, node):
+            continue
+        with open(os.path.join(configs_dir, file_name)) as f:
+            for name, acl in parse_config_acls(f.read()).items():
+                if _matches(filters, name):
+                    acls[(node, name)] = acl
+    return acls
+
+
+def _run_check(check, acls, space):
+    """
+    Run a check on every matching ACL.  Returns a tuple of (flows, unknown): an example failing flow
+    for each ACL that fails the check, and the reasons any ACLs could not be checked.
+    """
+    flows = []
+    unknown = []
+    snapshot = acls[check['snapshot']]
+    reference = acls[check['reference_snapshot']] if check['reference_snapshot'] else None
+    keys = sorted(set(snapshot) | set(reference or {}))
+    if not keys:
+        return flows, ['no matching ACLs found locally']
+
+    for node, name in keys:
+        acl = snapshot.get((node, name))
+        other = reference.get((node, name)) if reference is not None else None
+        if acl is None or (reference is not None and other is None):
+            unknown.append("ACL '{}' is missing on '{}' in one snapshot".format(name, node))
+            continue
+        errors = [a for a in (acl, other) if isinstance(a, UnsupportedAclError)]
+        if errors:
+            unknown.append("{} on '{}'".format(errors[0], node))
+            continue
+
+        if other is None:
+            permitted, denied = acl.partition(space)
+            found = permitted if check['action'] == 'permit' else denied
+        else:
+            found = differences(acl, other, space)
+        if found:
+            flows.append(dict(example_flow(found[0]), node=node, filter=name))
+    return flows, unknown
+
+
+def _matches(regex, name):
+    # Batfish matches node and filter names case-insensitively, so the same checks select the same ACLs
+    return re.match('(?:{})$'.format(regex), name, re.IGNORECASE) is not None
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
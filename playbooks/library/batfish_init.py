@@ -31,14 +31,42 @@ description:
     - "Initializes new network snapshot in Batfish, using Pybatfish"
 
 options:
+    answer_cache_dir:
+        description:
+            - Directory of the answer cache shared by C(batfish_policy) and C(batfish_searchfilters).  The answers cached for the snapshot are removed from it when the snapshot is overwritten.
+        required: false
+        default: ~/.batfish/answers
     base_name:
         description:
             - Name of the base snapshot to fork from.  If no name is provided, a new snapshot is created from scratch.
         required: false
+    base_path:
+        description:
+            - Path to a local copy of the base snapshot's files, used by C(delta) when the base snapshot is not in the local snapshot index.
+        required: false
+    deactivate_missing:
+        description:
+            - If C(yes) when forking with C(delta), C(path) is treated as a complete snapshot, and the nodes whose config files are in the base snapshot but not in C(path) are deactivated in the new snapshot.
+        required: false
+        default: no
+    delta:
+        description:
+            - If C(yes) when forking, only files in C(path) that are new or differ from the base snapshot are uploaded.  The base snapshot's files are looked up in the local snapshot index or read from C(base_path), and all files are uploaded if neither is available.
+        required: false
+        default: no
     host:
         description:
             - Host running the C(Batfish) service.
         required: false
+    index_path:
+        description:
+            - Path of the local index mapping snapshot contents to snapshots already created in the C(Batfish) service.
+        required: false
+        default: ~/.batfish/snapshot_index.json
+    metrics_path:
+        description:
+            - Path of a file to write the C(timings) to in OpenMetrics text format when the module exits, for a local scraper such as the node exporter's textfile collector.  Implies C(timings).  Use a different file for each task.
+        required: false
     name:
         description:
             - Name of the new snapshot to create.
@@ -51,6 +79,25 @@ options:
         description:
             - Path to the directory containing snapshot files.
         required: true
+    persistent_session:
+        description:
+            - If C(yes), Batfish requests are made through a long-lived local session helper, which is started on first use and keeps the network and connections to C(Batfish) between module runs.
+        required: false
+        default: yes
+    profile_path:
+        description:
+            - Path of a file to write a cProfile profile of the module run to, readable with C(pstats).  Only the module's main thread is profiled, not the session helper.
+        required: false
+    reuse_existing:
+        description:
+            - If C(yes) and an existing snapshot was created from identical files (and the same base snapshot, if forking), that snapshot is returned instead of creating a new one, which avoids re-parsing the configs and recomputing the data plane.
+        required: false
+        default: no
+    timings:
+        description:
+            - If C(yes), the seconds spent in each phase of the module run, the number of files and bytes uploaded and the bytes exchanged with the session helper are returned in C(timings).
+        required: false
+        default: no
 
 author:
     - Spencer Fraint (`@sfraint <https://github.com/sfraint>`_)
@@ -74,11 +121,37 @@ EXAMPLES = '''
     name: new_snapshot
     network: test_network
     path: /path/to/additional_files/
+
+# Fork from base snapshot, unless an identical fork already exists
+- name: Fork from base snapshot, reusing identical snapshots
+  batfish_init:
+    base_name: base_snapshot
+    name: new_snapshot
+    network: test_network
+    path: /path/to/additional_files/
+    reuse_existing: yes
+  register: snapshot
+
+# Fork from base snapshot, uploading only the configs that changed
+- name: Fork from base snapshot with a complete directory of configs
+  batfish_init:
+    base_name: base_snapshot
+    name: new_snapshot
+    network: test_network
+    path: /path/to/full_snapshot_dir/
+    delta: yes
+    deactivate_missing: yes
 '''
 
 RETURN = '''
+content_hash:
+    description: Hash of the files in the snapshot directory
+    type: str
+deactivated_nodes:
+    description: Nodes deactivated because their config files were missing from C(path)
+    type: list
 name:
-    description: Name of the snapshot created
+    description: Name of the snapshot created, or of the existing snapshot reused
     type: str
 network:
     description: Name of the network containing the new snapshot
@@ -86,32 +159,49 @@ network:
 result:
     description: Result of the action performed
     type: str
+reused:
+    description: Whether an existing snapshot with identical contents was reused
+    type: bool
+timings:
+    description: Seconds spent in each phase and counters of data handled, if C(timings) is enabled
+    type: dictionary
+uploaded_files:
+    description: Paths, relative to C(path), of the files uploaded
+    type: list
 '''
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.batfish_session import connect
+from ansible.module_utils.batfish_snapshots import (config_node, diff_manifests, find_snapshot,
+                                                    forget_snapshot, hash_snapshot_dir, is_config,
+                                                    load_index, record_snapshot, save_index, snapshot_key,
+                                                    snapshot_manifest, snapshot_sections)
+from ansible.module_utils.batfish_timings import Timings, instrument
 
-try:
-    import logging
-    from pybatfish.client.commands import (bf_fork_snapshot, bf_init_snapshot,
-                                           bf_session, bf_set_network)
-    from pybatfish.datamodel.flow import HeaderConstraints
-    # noinspection PyUnresolvedReferences
-    from pybatfish.question import bfq, list_questions, load_questions  # noqa F401
-except Exception as e:
-    pybatfish_found = False
-else:
-    pybatfish_found = True
+import os
+import shutil
+import tempfile
 
 
 def run_module():
     # define the available arguments/parameters that a user can pass to
     # the module
     module_args = dict(
+        answer_cache_dir=dict(type='path', required=False, default='~/.batfish/answers'),
         base_name=dict(type='str', required=False, default=None),
+        base_path=dict(type='path', required=False, default=None),
+        deactivate_missing=dict(type='bool', required=False, default=False),
+        delta=dict(type='bool', required=False, default=False),
         host=dict(type='str', required=False, default='localhost'),
+        index_path=dict(type='path', required=False, default='~/.batfish/snapshot_index.json'),
+        metrics_path=dict(type='path', required=False, default=None),
         name=dict(type='str', required=True),
         network=dict(type='str', required=True),
-        path=dict(type='str', required=True)
+        path=dict(type='str', required=True),
+        persistent_session=dict(type='bool', required=False, default=True),
+        profile_path=dict(type='path', required=False, default=None),
+        reuse_existing=dict(type='bool', required=False, default=False),
+        timings=dict(type='bool', required=False, default=False)
     )
 
     # seed the result dict in the object
@@ -121,9 +211,14 @@ def run_module():
     # for consumption, for example, in a subsequent task
     result = dict(
         changed=False,
+        content_hash='',
+        deactivated_nodes=[],
         name='',
         network='',
         result='',
+        reused=False,
+        timings={},
+        uploaded_files=[],
     )
 
     # the AnsibleModule object will be our abstraction working with Ansible
@@ -135,40 +230,141 @@ def run_module():
         supports_check_mode=True
     )
 
-    if not pybatfish_found:
-        module.fail_json(msg='Python module Pybatfish is required')
-
     if module.check_mode:
         return result
 
     base_name = module.params['base_name']
     name = module.params['name']
     path = module.params['path']
+    index_path = module.params['index_path']
+
+    timings = Timings(result['timings'], enabled=module.params['timings'] or bool(module.params['metrics_path']))
+    instrument(timings, 'batfish_init', dict(network=module.params['network']), module.params['profile_path'],
+               module.params['metrics_path'])
 
     try:
-        bf_session.coordinatorHost = module.params['host']
-        network = bf_set_network(module.params['network'])
+        with timings.phase('hash_snapshot'):
+            content_hash, manifest = hash_snapshot_dir(path)
+    except Exception as e:
+        module.fail_json(msg='Failed to read snapshot files: {}'.format(e), **result)
+    result['content_hash'] = content_hash
+    key = snapshot_key(content_hash, base_name, module.params['delta'] and module.params['deactivate_missing'])
+
+    try:
+        with timings.phase('set_network'):
+            session = connect(module.params['host'], module.params['network'], module.params['persistent_session'],
+                              timings)
+        network = session.network
     except Exception as e:
         module.fail_json(msg='Failed to set network: {}'.format(e), **result)
     result['network'] = network
 
+    index = load_index(index_path)
+    if module.params['reuse_existing']:
+        existing = find_snapshot(index, network, key)
+        try:
+            # The service may have lost the snapshot since it was indexed
+            with timings.phase('list_snapshots'):
+                snapshots = session.call('list_snapshots') if existing is not None else []
+            if existing in snapshots:
+                result['name'] = existing
+                result['reused'] = True
+                result['result'] = "Reused snapshot '{}' with files identical to '{}'".format(existing, path)
+                module.exit_json(**result)
+        except Exception as e:
+            module.warn('Failed to check for existing snapshot: {}'.format(e))
+
+    upload_files = sorted(manifest)
+    deactivate_nodes = []
+    if base_name is not None and module.params['delta']:
+        base_manifest = snapshot_manifest(index, network, base_name)
+        if base_manifest is None and module.params['base_path'] is not None:
+            try:
+                with timings.phase('hash_base_snapshot'):
+                    base_manifest = hash_snapshot_dir(module.params['base_path'])[1]
+            except Exception as e:
+                module.fail_json(msg='Failed to read base snapshot files: {}'.format(e), **result)
+        if base_manifest is None:
+            module.warn("Base snapshot '{}' is not indexed, uploading all files".format(base_name))
+            # Nothing is deactivated without the base snapshot's files
+            key = snapshot_key(content_hash, base_name)
+        else:
+            upload_files, missing = diff_manifests(base_manifest, manifest)
+            if module.params['deactivate_missing']:
+                deactivate_nodes = sorted(config_node(p) for p in missing if is_config(p))
+
+    if timings.enabled:
+        timings.count('files_uploaded', len(upload_files))
+        timings.count('bytes_uploaded', sum(os.path.getsize(os.path.join(path, f)) for f in upload_files))
+    # Answers about the snapshot being overwritten no longer hold, even if this run fails
+    try:
+        from ansible.module_utils.batfish_cache import AnswerCache
+        AnswerCache(module.params['answer_cache_dir'], module.params['host'], network).invalidate_snapshot(name)
+    except Exception as e:
+        module.warn('Failed to invalidate cached answers: {}'.format(e))
+
+    upload_dir = None
     try:
         if base_name is not None:
-            name = bf_fork_snapshot(add_files=path, base_name=base_name, name=name, overwrite=True)
-            result['result'] = "Forked snapshot '{}' from '{}' adding files at '{}'".format(name, base_name, path)
+            if upload_files == sorted(manifest):
+                add_files = path
+            elif upload_files:
+                with timings.phase('copy_files'):
+                    add_files = upload_dir = _copy_files(path, upload_files)
+            else:
+                add_files = None
+            # Includes uploading the files and parsing them in the service
+            with timings.phase('fork_snapshot'):
+                name = session.call('fork_snapshot', add_files=add_files, base_name=base_name, name=name,
+                                    overwrite=True, deactivate_nodes=deactivate_nodes or None)
+            result['result'] = "Forked snapshot '{}' from '{}' adding {} of the files at '{}'".format(
+                name, base_name, len(upload_files), path)
         else:
-            name = bf_init_snapshot(path, name, overwrite=True)
+            with timings.phase('init_snapshot'):
+                name = session.call('init_snapshot', path=path, name=name, overwrite=True)
             result['result'] = "Created snapshot '{}' from files at '{}'".format(name, path)
     except Exception as e:
+        # The snapshot may have been partly overwritten, so its indexed contents no longer hold
+        forget_snapshot(index, network, name)
+        try:
+            save_index(index_path, index)
+        except Exception:
+            pass
         module.fail_json(msg='Failed to init snapshot: {}'.format(e), **result)
+    finally:
+        if upload_dir is not None:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+    result['deactivated_nodes'] = deactivate_nodes
+    result['uploaded_files'] = upload_files
     result['name'] = name
 
+    try:
+        with timings.phase('update_index'):
+            record_snapshot(index, network, key, name, base_name, manifest, snapshot_sections(path, manifest),
+                            deactivate_nodes)
+            save_index(index_path, index)
+    except Exception as e:
+        module.warn('Failed to update snapshot index: {}'.format(e))
+
     # manipulate or modify the state as needed (this is going to be the
     # part where your module will do what it needs to do)
     result['changed'] = True
 
     module.exit_json(**result)
 
+def _copy_files(path, rel_paths):
+    """
+    Copy the given files, relative to path, into a new temporary directory with the same layout.
+    Returns the temporary directory, which the caller must remove.
+    """
+    upload_dir = tempfile.mkdtemp()
+    for rel_path in rel_paths:
+        dest = os.path.join(upload_dir, rel_path)
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        shutil.copy2(os.path.join(path, rel_path), dest)
+    return upload_dir
+
 def main():
     run_module()
 
@@ -31,14 +31,64 @@ description:
     - "Runs (and optionally initializes) policy in Batfish, using Pybatfish"
 
 options:
+    answer_cache_dir:
+        description:
+            - Directory in which to cache answers, shared with C(batfish_searchfilters).  Only the answers of policies whose checks are known, from C(policy_paths) or C(path), are cached, for snapshots whose contents are known, from the local snapshot index written by C(batfish_init) or from C(base_path); they are never reused once either changes.  Answers of policies written to C(rows_dir) are not cached.  Set to an empty string to disable the cache.
+        required: false
+        default: ~/.batfish/answers
+    answer_cache_size:
+        description:
+            - Maximum size of C(answer_cache_dir) in megabytes.  The least recently used answers are removed once it grows past this.
+        required: false
+        default: 256
+    base_name:
+        description:
+            - Name of the base snapshot the snapshot was forked from, required if C(incremental) is C(yes).
+        required: false
+    base_path:
+        description:
+            - Path to a local copy of the base snapshot's files, used by C(incremental) and C(answer_cache_dir) when the base snapshot is not in the local snapshot index.
+        required: false
     policy_name:
         description:
             - Name of the policy to run.  If not specified, all analyses will be run.
         required: false
+    timeout:
+        description:
+            - Maximum number of seconds to wait for each policy.  A policy that takes longer is reported in C(errors) and does not hold up the others.  No limit if not specified.
+        required: false
+    timings:
+        description:
+            - If C(yes), the seconds spent in each phase of the module run, the number of checks run and rows answered, answer cache hits and misses and the bytes exchanged with the session helper are returned in C(timings).  The time of policies run concurrently is summed in C(run_policy).
+        required: false
+        default: no
+    workers:
+        description:
+            - Maximum number of policies to run concurrently when running all analyses.
+        required: false
+        default: 1
     host:
         description:
             - Host running the C(Batfish) service.
         required: false
+    incremental:
+        description:
+            - If C(yes), only checks that the changes from C(base_name) can affect are run on the snapshot, and the base snapshot's answers are reused for the rest.  Changes are found from the local snapshot index written by C(batfish_init), and narrowed down by each check's tags and C(nodes)/C(filters) scope.  All checks are run if the changes are not known, or if C(rows_dir) is specified.
+        required: false
+        default: no
+    index_path:
+        description:
+            - Path of the local snapshot index written by C(batfish_init).
+        required: false
+        default: ~/.batfish/snapshot_index.json
+    max_rows:
+        description:
+            - Maximum number of rows to return in C(result_verbose) for each check.  All rows are returned if not specified.  This bounds the size of the module result, not the memory used to get it: Batfish has no way to return only some rows of an analysis, so the answer text of each check is fetched whole, though its rows are parsed one at a time rather than all at once.
+        required: false
+    metrics_path:
+        description:
+            - Path of a file to write the C(timings) to in OpenMetrics text format when the module exits, for a local scraper such as the node exporter's textfile collector.  Implies C(timings).  Use a different file for each task.
+        required: false
     name:
         description:
             - Name of the snapshot to run the policy on.
@@ -55,6 +105,34 @@ options:
         description:
             - Path to the checks to add to the new policy.
         required: if new is C(yes)
+    persistent_session:
+        description:
+            - If C(yes), Batfish requests are made through a long-lived local session helper, which is started on first use and keeps the network and connections to C(Batfish) between module runs.
+        required: false
+        default: yes
+    policy_paths:
+        description:
+            - Dictionary of policy name to the directory holding its checks, as given to C(path) when the policy was created.  The checks of a policy must be known to run only its affected checks in C(incremental) runs, and to cache its answers in C(answer_cache_dir); policies not listed here are run in full and not cached, except the one at C(path) if C(new) is C(yes).
+        required: false
+        default: {}
+    profile_path:
+        description:
+            - Path of a file to write a cProfile profile of the module run to, readable with C(pstats).  Only the module's main thread is profiled, not the policy workers or the session helper.
+        required: false
+    rows_dir:
+        description:
+            - Directory in which to write all rows of each policy, to a JSON lines file named after the policy with each row tagged with its check, for C(write_results) to read.  Rows are written as each check's answer is parsed, so C(max_rows) does not limit them.  Policies are run in full when specified, even in C(incremental) runs, and their answers are not cached.
+        required: false
+    scope_reachability:
+        description:
+            - If C(yes) in C(incremental) runs, affected reachability checks from and to every interface of a reference book group are narrowed down to the flows from and to the changed nodes' interfaces in the group, plus those of C(scope_sample) other nodes, so their cost grows with the number of nodes rather than its square.  This needs a group per node in the reference book, named C(<group>_<node>), as made by C(python/demo-setup.py --inputs-dir); checks are run in full if a change is not on a node with such a group, or if C(rows_dir) is specified.
+        required: false
+        default: no
+    scope_sample:
+        description:
+            - Number of unchanged nodes to also check the flows from and to, picked at random for each snapshot, when C(scope_reachability) narrows a check down.
+        required: false
+        default: 2
 
 author:
     - Spencer Fraint (`@sfraint <https://github.com/sfraint>`_)
@@ -78,49 +156,117 @@ EXAMPLES = '''
     name: base_snapshot
     network: test_network
     policy_name: policy_name
+
+# Run all existing policies, four at a time
+- name: Run all policies
+  batfish_policy:
+    name: base_snapshot
+    network: test_network
+    timeout: 600
+    workers: 4
+
+# Run all policies, keeping at most 10 rows per check in the result and writing all rows to files
+- name: Run all policies, writing rows to files
+  batfish_policy:
+    name: base_snapshot
+    network: test_network
+    max_rows: 10
+    rows_dir: /path/to/logs/
+
+# Run only the checks affected by the changes in a forked snapshot
+- name: Run affected checks of all policies
+  batfish_policy:
+    name: candidate_snapshot
+    network: test_network
+    incremental: yes
+    base_name: base_snapshot
+    policy_paths:
+      policy_name: /path/to/policy_dir/
+
+# Run only the affected checks, with reachability checks narrowed down to the changed nodes
+- name: Run affected checks of all policies, narrowing reachability checks
+  batfish_policy:
+    name: candidate_snapshot
+    network: test_network
+    incremental: yes
+    base_name: base_snapshot
+    policy_paths:
+      policy_name: /path/to/policy_dir/
+    scope_reachability: yes
 '''
 
 RETURN = '''
+errors:
+    description: Error message for each policy that failed or timed out; the remaining policies are still reported
+    type: dict
 result:
     description: Pass/Fail result of each check in the policy
     type: str
 result_verbose:
-    description: Detailed result of each check in the policy
+    description: Detailed result of each check in the policy, limited to C(max_rows) rows per check
     type: str
+row_counts:
+    description: Total number of rows of each check in the policy
+    type: dict
+rows_files:
+    description: Path of the JSON lines file holding all rows of each policy, if C(rows_dir) is specified
+    type: dict
+scoped:
+    description: Checks of each policy narrowed down by C(scope_reachability), with the nodes they were narrowed down to
+    type: dict
+skipped:
+    description: Checks of each policy that were not run because the changes cannot affect them, whose base snapshot results were reused
+    type: dict
 summary:
     description: Pass/Fail result of the policy overall
     type: str
+timings:
+    description: Seconds spent in each phase and counters of data handled, if C(timings) is enabled
+    type: dict
 '''
 
 PASS = 'PASS'
 FAIL = 'FAIL'
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.batfish_session import connect
+from ansible.module_utils.batfish_timings import Timings, instrument
 
-try:
-    import json
-    from pybatfish.client.commands import (bf_get_analysis_answers, bf_init_analysis,
-                                           bf_list_analyses, bf_run_analysis,
-                                           bf_set_network, bf_session)
-    from pybatfish.datamodel.flow import HeaderConstraints
-    # noinspection PyUnresolvedReferences
-    from pybatfish.question import bfq, list_questions, load_questions  # noqa F401
-except Exception as e:
-    pybatfish_found = False
-else:
-    pybatfish_found = True
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 
 
 def run_module():
     # define the available arguments/parameters that a user can pass to
     # the module
     module_args = dict(
+        answer_cache_dir=dict(type='path', required=False, default='~/.batfish/answers'),
+        answer_cache_size=dict(type='int', required=False, default=256),
+        base_name=dict(type='str', required=False, default=None),
+        base_path=dict(type='path', required=False, default=None),
         policy_name=dict(type='str', required=False, default=None),
         host=dict(type='str', required=False, default='localhost'),
+        incremental=dict(type='bool', required=False, default=False),
+        index_path=dict(type='path', required=False, default='~/.batfish/snapshot_index.json'),
+        max_rows=dict(type='int', required=False, default=None),
+        metrics_path=dict(type='path', required=False, default=None),
         name=dict(type='str', required=True),
         network=dict(type='str', required=True),
         new=dict(type='bool', required=False, default=False),
-        path=dict(type='str', required=False)
+        path=dict(type='str', required=False),
+        persistent_session=dict(type='bool', required=False, default=True),
+        policy_paths=dict(type='dict', required=False, default={}),
+        profile_path=dict(type='path', required=False, default=None),
+        rows_dir=dict(type='path', required=False, default=None),
+        scope_reachability=dict(type='bool', required=False, default=False),
+        scope_sample=dict(type='int', required=False, default=2),
+        timeout=dict(type='int', required=False, default=None),
+        timings=dict(type='bool', required=False, default=False),
+        workers=dict(type='int', required=False, default=1)
     )
 
     # seed the result dict in the object
@@ -130,9 +276,15 @@ def run_module():
     # for consumption, for example, in a subsequent task
     result = dict(
         changed=False,
+        errors={},
         result='',
         result_verbose='',
-        summary=''
+        row_counts={},
+        rows_files={},
+        scoped={},
+        skipped={},
+        summary='',
+        timings={}
     )
 
     # the AnsibleModule object will be our abstraction working with Ansible
@@ -143,42 +295,104 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=True,
         required_if=[
-            [ "new", True, [ "path", "policy_name" ] ] # path and name are required if adding a new policy
+            [ "new", True, [ "path", "policy_name" ] ], # path and name are required if adding a new policy
+            [ "incremental", True, [ "base_name" ] ]
         ]
     )
 
-    if not pybatfish_found:
-        module.fail_json(msg='Python module Pybatfish is required')
-
     if module.check_mode:
         return result
 
     snapshot_name = module.params['name']
     policy_name = module.params['policy_name']
 
+    timings = Timings(result['timings'], enabled=module.params['timings'] or bool(module.params['metrics_path']))
+    instrument(timings, 'batfish_policy', dict(network=module.params['network']), module.params['profile_path'],
+               module.params['metrics_path'])
+
     try:
-        bf_session.coordinatorHost = module.params['host']
-        network = bf_set_network(module.params['network'])
+        with timings.phase('set_network'):
+            session = connect(module.params['host'], module.params['network'], module.params['persistent_session'],
+                              timings)
     except Exception as e:
         module.fail_json(msg='Failed to set network: {}'.format(e), **result)
 
     try:
         if module.params['new']:
-            bf_init_analysis(policy_name, module.params['path'])
+            with timings.phase('init_policy'):
+                session.call('init_analysis', name=policy_name, path=module.params['path'])
     except Exception as e:
         module.fail_json(msg='Failed to initialize policy: {}'.format(e), **result)
 
     try:
-        if policy_name is not None:
-            policy_results = {policy_name: _run_policy(policy_name, snapshot_name)}
-        else:
-            policy_results = {a: _run_policy(a, snapshot_name) for a in bf_list_analyses()}
+        with timings.phase('list_policies'):
+            policy_names = [policy_name] if policy_name is not None else session.call('list_analyses')
     except Exception as e:
-        module.fail_json(msg='Failed to answer policy: {}'.format(e), **result)
+        module.fail_json(msg='Failed to list policies: {}'.format(e), **result)
+
+    max_rows = module.params['max_rows']
+    rows_dir = module.params['rows_dir']
+    index = None
+    if module.params['incremental'] or module.params['answer_cache_dir']:
+        # Only incremental runs and the answer cache need the snapshot index
+        from ansible.module_utils.batfish_snapshots import load_index
+        index = load_index(module.params['index_path'])
+
+    cache = None
+    if module.params['answer_cache_dir']:
+        from ansible.module_utils.batfish_cache import AnswerCache
+        base_paths = {module.params['base_name']: module.params['base_path']} if module.params['base_name'] else {}
+        cache = AnswerCache(module.params['answer_cache_dir'], module.params['host'], session.network, index,
+                            base_paths, module.params['answer_cache_size'] * 1024 * 1024, timings)
+
+    scope_sample = module.params['scope_sample'] if module.params['scope_reachability'] else None
+
+    changes = None
+    # A rows file holds all rows of a policy, which only a full run of the policy gives
+    if module.params['incremental'] and rows_dir is not None:
+        module.warn('Running all checks, as rows_dir is specified')
+    elif module.params['incremental']:
+        try:
+            with timings.phase('snapshot_changes'):
+                changes = _snapshot_changes(index, session.network, module.params['base_name'], snapshot_name,
+                                            module.params['base_path'])
+        except Exception as e:
+            module.fail_json(msg='Failed to find snapshot changes: {}'.format(e), **result)
+        if changes is None:
+            module.warn("Changes from '{}' to '{}' are not known, running all checks".format(
+                module.params['base_name'], snapshot_name))
+
+    def run(name):
+        checks_path = module.params['policy_paths'].get(name)
+        if checks_path is None and module.params['new'] and name == policy_name:
+            checks_path = module.params['path']
+        with timings.phase('run_policy'):
+            if changes is None or checks_path is None:
+                policy_result = _run_policy(session, name, snapshot_name, max_rows, rows_dir, cache, checks_path)
+                # Only report the rows files this run wrote
+                if rows_dir is not None:
+                    result['rows_files'][name] = _rows_file(rows_dir, name)
+                return policy_result
+            policy_result, result['skipped'][name], scoped = _run_policy_incremental(
+                session, name, snapshot_name, checks_path, changes, module.params['base_name'], cache,
+                max_rows, scope_sample)
+            if scoped:
+                result['scoped'][name] = scoped
+            return policy_result
+
+    with timings.phase('run_policies'):
+        policy_results, errors = _run_policies(policy_names, run, module.params['workers'],
+                                               module.params['timeout'])
+    # Only give up if nothing could be answered, otherwise report what we have
+    if errors and not policy_results:
+        module.fail_json(msg='Failed to answer policy: {}'.format(
+            '; '.join('{}: {}'.format(k, v) for k, v in sorted(errors.items()))), **result)
+    result['errors'] = errors
 
     result['result'] = {}
     result['result_verbose'] = {}
-    failure = False
+    result['row_counts'] = {}
+    failure = bool(errors)
     # If a check's summary.numFailed is 0, we assume the check PASSed
     for policy in policy_results:
         policy_result = policy_results[policy]
@@ -187,21 +401,242 @@ def run_module():
         }
         failure |= FAIL in result['result'][policy].values()
 
-        result['result_verbose'][policy] = {
-            k: policy_result[k]['answerElements'][0]['rows'] if 'rows' in policy_result[k]['answerElements'][0] else [] for k in policy_result
-        }
+        result['result_verbose'][policy] = {k: policy_result[k]['rows'] for k in policy_result}
+        result['row_counts'][policy] = {k: policy_result[k]['row_count'] for k in policy_result}
+        timings.count('checks', len(policy_result))
+        timings.count('rows', sum(result['row_counts'][policy].values()))
 
     result['summary'] = FAIL if failure else PASS
+    timings.count('checks_skipped', sum(len(v) for v in result['skipped'].values()))
+    timings.count('checks_scoped', sum(len(v) for v in result['scoped'].values()))
 
     module.exit_json(**result)
 
 
-def _run_policy(name, snapshot):
+def _run_policy(session, name, snapshot, max_rows=None, rows_dir=None, cache=None, checks_path=None):
     """
     Run a policy and return a dictionary containing its checks and their results.
-    Converts check results from strings into dictionaries.
+    Each check result has the answer summary, the number of rows and at most max_rows of the rows.
+    If rows_dir is given, all rows of the policy are written to a JSON lines file in it.
+    Otherwise, if the policy's checks are in checks_path, its results are reused from cache if given.
+    """
+    rows_file = _rows_file(rows_dir, name) if rows_dir is not None else None
+    if rows_file is not None or checks_path is None:
+        cache = None
+
+    cache_params = None
+    if cache is not None:
+        from ansible.module_utils.batfish_cache import policy_params
+        cache_params = policy_params(checks_path, max_rows)
+        results = cache.get('run_analysis', name, [snapshot], cache_params)
+        if results is not None:
+            return results
+
+    results = session.call('run_analysis', name=name, snapshot=snapshot, max_rows=max_rows, rows_file=rows_file)
+    if cache is not None:
+        cache.put('run_analysis', name, [snapshot], cache_params, results)
+    return results
+
+def _rows_file(rows_dir, name):
+    from ansible.module_utils.batfish_answers import rows_file_name
+    return os.path.join(os.path.abspath(rows_dir), rows_file_name(name))
+
+def _snapshot_changes(index, network, base_name, snapshot, base_path):
+    """
+    Find the changes from base snapshot base_name to snapshot, which must have been forked from it.
+    Nodes deactivated when forking count as changed in every way.
+    Returns None if either snapshot's contents are not known.
+    """
+    from ansible.module_utils.batfish_impact import OTHER, snapshot_changes
+    from ansible.module_utils.batfish_snapshots import (find_entry, hash_snapshot_dir, snapshot_manifest,
+                                                        snapshot_sections)
+    _, entry = find_entry(index, network, snapshot)
+    if entry is None or entry.get('base_name') != base_name:
+        return None
+
+    base_key, _ = find_entry(index, network, base_name)
+    if base_key is not None:
+        base_manifest = snapshot_manifest(index, network, base_name)
+        base_sections = snapshot_manifest(index, network, base_name, 'sections')
+    elif base_path is not None:
+        base_manifest = hash_snapshot_dir(base_path)[1]
+        base_sections = snapshot_sections(base_path, base_manifest)
+    else:
+        return None
+    if base_manifest is None or base_sections is None:
+        return None
+    changes = snapshot_changes(base_manifest, base_sections, entry['manifest'], entry.get('sections', {}))
+    for node in entry.get('deactivated_nodes', []):
+        changes.setdefault(node, set()).add(OTHER)
+    return changes
+
+def _run_policy_incremental(session, name, snapshot, checks_path, changes, base_name, cache=None,
+                            max_rows=None, scope_sample=None):
+    """
+    Run the checks of a policy that changes can affect, reusing the base snapshot's results for the rest.
+    The base snapshot's results are themselves reused from cache if given.  If scope_sample is given,
+    affected reachability checks between all members of a group are narrowed down to the changed nodes
+    and scope_sample others.  Returns a tuple of the policy results, as for _run_policy, the sorted names
+    of the checks skipped and the nodes each narrowed down check was narrowed down to.
+    """
+    from ansible.module_utils.batfish_impact import check_affected, load_checks
+    checks = load_checks(checks_path)
+    affected = [k for k in sorted(checks) if check_affected(checks[k], changes)]
+    scoped = {}
+    if scope_sample is not None:
+        scoped = _scope_checks(session, dict((k, checks[k]) for k in affected), changes, scope_sample, snapshot)
+    if len(affected) == len(checks) and not scoped:
+        return _run_policy(session, name, snapshot, max_rows, cache=cache, checks_path=checks_path), [], {}
+
+    results = {}
+    if len(affected) < len(checks):
+        base_results = _run_policy(session, name, base_name, max_rows, cache=cache, checks_path=checks_path)
+        # Answers are named by the checks' instanceName, as the checks are
+        results = {k: v for k, v in base_results.items() if k not in affected}
+    skipped = sorted(results)
+    if affected:
+        run_checks = [checks[k] for k in affected if k not in scoped]
+        run_checks.extend(check for k in sorted(scoped) for _, check in sorted(scoped[k][1].items()))
+        answers = _run_checks(session, name, snapshot, run_checks, max_rows)
+        for k in scoped:
+            answers[k] = _merge_results([answers.pop(check['instance']['instanceName'])
+                                         for _, check in sorted(scoped[k][1].items())], max_rows)
+        results.update(answers)
+    return results, skipped, dict((k, scoped[k][0]) for k in scoped)
+
+def _scope_checks(session, checks, changes, sample, seed):
+    """
+    Narrow down the reachability checks between all members of a reference book group to the flows
+    from and to the changed nodes and sample others, picked at random from seed.
+    Returns a dictionary of the name of each check narrowed down to a tuple of the nodes it was narrowed
+    down to and its narrowed down checks, by name suffix.
+    """
+    from ansible.module_utils.batfish_impact import group_reachability, scope_nodes, scope_reachability
+    groups = {}
+    scoped = {}
+    for k in sorted(checks):
+        scope = group_reachability(checks[k])
+        if scope is None:
+            continue
+        group, book = scope
+        if book not in groups:
+            try:
+                groups[book] = session.call('reference_book_groups', name=book)
+            except Exception:
+                # No such book, or a service that cannot list its groups: run the check in full
+                groups[book] = []
+        nodes = scope_nodes(changes, group, groups[book], sample, seed)
+        if nodes is not None:
+            scoped[k] = (nodes, scope_reachability(checks[k], group, book, nodes))
+    return scoped
+
+def _merge_results(check_results, max_rows=None):
+    """
+    Merge the results of the narrowed down parts of a check, as for one check.  Rows found by several
+    parts, such as flows between two of the nodes, are only kept once.
+    """
+    summary = {}
+    rows = []
+    seen = set()
+    row_count = 0
+    for check_result in check_results:
+        for k, v in check_result['summary'].items():
+            if isinstance(v, int) and not isinstance(v, bool):
+                summary[k] = summary.get(k, 0) + v
+            else:
+                summary.setdefault(k, v)
+        row_count += check_result['row_count']
+        for row in check_result['rows']:
+            key = json.dumps(row, sort_keys=True)
+            if key in seen:
+                row_count -= 1
+                continue
+            seen.add(key)
+            if max_rows is None or len(rows) < max_rows:
+                rows.append(row)
+    return dict(summary=summary, row_count=row_count, rows=rows)
+
+def _run_checks(session, name, snapshot, checks, max_rows=None):
+    """
+    Run some of the checks of a policy, through a temporary policy holding only those checks.
+    Their answers are named by the checks' instanceName, which must be unique.
+    """
+    import uuid
+    tmp_name = '{}-{}'.format(name, uuid.uuid4().hex[:8])
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for i, check in enumerate(checks):
+            with open(os.path.join(tmp_dir, 'check{}.json'.format(i)), 'w') as f:
+                json.dump(check, f, indent=2)
+        session.call('init_analysis', name=tmp_name, path=tmp_dir)
+        try:
+            return session.call('run_analysis', name=tmp_name, snapshot=snapshot, max_rows=max_rows)
+        finally:
+            session.call('delete_analysis', name=tmp_name)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def _run_policies(names, run, workers, timeout):
+    """
+    Run policies by calling run with each policy name, at most workers at a time.
+    Returns a tuple of (results, errors), each keyed by policy name.  A policy that raises,
+    or is still running after timeout seconds, is recorded in errors and does not stop the
+    remaining policies from being run.
     """
-    return {k: json.loads(v) for k, v in bf_run_analysis(name=name, snapshot=snapshot).items()}
+    todo = list(reversed(names))
+    started = {}
+    outcomes = {}
+    abandoned = set()
+    cond = threading.Condition()
+
+    def worker():
+        while True:
+            with cond:
+                if not todo:
+                    return
+                name = todo.pop()
+                started[name] = time.time()
+            try:
+                outcome = (True, run(name))
+            except Exception as e:
+                outcome = (False, '{}'.format(e))
+            with cond:
+                outcomes[name] = outcome
+                cond.notify()
+                # A replacement worker was started when this policy timed out
+                if name in abandoned:
+                    return
+
+    def start_worker():
+        # Daemon threads, so a hung policy cannot keep the module from exiting
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+
+    for _ in range(min(max(workers, 1), len(names))):
+        start_worker()
+
+    results = {}
+    errors = {}
+    pending = set(names)
+    with cond:
+        while pending:
+            for name in list(pending):
+                if name in outcomes:
+                    ok, value = outcomes[name]
+                    if ok:
+                        results[name] = value
+                    else:
+                        errors[name] = value
+                    pending.remove(name)
+                elif timeout and name in started and time.time() - started[name] > timeout:
+                    errors[name] = 'Timed out after {} seconds'.format(timeout)
+                    abandoned.add(name)
+                    pending.remove(name)
+                    start_worker()
+            if pending:
+                cond.wait(1)
+    return results, errors
 
 def main():
     run_module()
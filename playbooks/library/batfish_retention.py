@@ -0,0 +1,292 @@
+#!/usr/bin/python
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: batfish_retention
+
+short_description: Deletes candidate snapshots past their retention from Batfish
+
+version_added: "2.7"
+
+description:
+    - "Deletes the snapshots named C(<prefix>_<time>), as made by create_candidate_snapshot.yml, whose retention has expired, so that they and their data planes do not build up in the C(Batfish) service.  For each prefix, the C(keep_last) most recent snapshots are kept, unless they are older than C(max_age).  Snapshots not named after a prefix, pinned snapshots and snapshots other indexed snapshots were forked from are never deleted."
+    - "Expired snapshots are deleted concurrently, and removed from the local snapshot index and answer cache.  The C(Batfish) service does not report the space its snapshots take, so the space reclaimed is reported as the number of snapshots deleted and the bytes freed in the answer cache."
+
+options:
+    answer_cache_dir:
+        description:
+            - Directory of the answer cache shared by C(batfish_policy) and C(batfish_searchfilters), from which the answers cached for deleted snapshots are removed.
+        required: false
+        default: ~/.batfish/answers
+    host:
+        description:
+            - Host running the C(Batfish) service.
+        required: false
+    index_path:
+        description:
+            - Path of the local index mapping snapshot contents to snapshots already created in the C(Batfish) service.  Snapshots indexed as the base of another snapshot are never deleted.
+        required: false
+        default: ~/.batfish/snapshot_index.json
+    keep_last:
+        description:
+            - Number of most recent snapshots to keep for each prefix, not counting pinned snapshots.
+        required: false
+        default: 10
+    max_age:
+        description:
+            - Number of hours after which snapshots are deleted, even if among the C(keep_last) most recent.  By default, snapshots are only deleted by C(keep_last).
+        required: false
+    metrics_path:
+        description:
+            - Path of a file to write the C(timings) to in OpenMetrics text format when the module exits, for a local scraper such as the node exporter's textfile collector.  Implies C(timings).  Use a different file for each task.
+        required: false
+    network:
+        description:
+            - Name of the network to delete snapshots from.
+        required: true
+    persistent_session:
+        description:
+            - If C(yes), Batfish requests are made through a long-lived local session helper, which is started on first use and keeps the network and connections to C(Batfish) between module runs.
+        required: false
+        default: yes
+    pinned:
+        description:
+            - Names of snapshots never to delete, such as the base snapshot and the snapshot just validated.
+        required: false
+        default: []
+    prefixes:
+        description:
+            - Prefixes of the names of the snapshots to delete, such as the C(bf_candidate_snapshot_prefix) of create_candidate_snapshot.yml.
+        required: true
+    profile_path:
+        description:
+            - Path of a file to write a cProfile profile of the module run to, readable with C(pstats).  Only the module's main thread is profiled, not the session helper.
+        required: false
+    timings:
+        description:
+            - If C(yes), the seconds spent in each phase of the module run, the number of snapshots deleted and the bytes exchanged with the session helper are returned in C(timings).
+        required: false
+        default: no
+    workers:
+        description:
+            - Maximum number of snapshots to delete concurrently.
+        required: false
+        default: 4
+
+author:
+    - Spencer Fraint (`@sfraint <https://github.com/sfraint>`_)
+
+requirements:
+    - "pybatfish"
+'''
+
+EXAMPLES = '''
+# Keep the 10 most recent candidate snapshots
+- name: Delete old candidate snapshots
+  batfish_retention:
+    network: test_network
+    prefixes:
+      - candidate_snapshot
+    pinned:
+      - base_snapshot
+
+# Keep at most a week of candidate snapshots, and at most 20 of them
+- name: Delete candidate snapshots older than a week
+  batfish_retention:
+    network: test_network
+    prefixes:
+      - candidate_snapshot
+    keep_last: 20
+    max_age: 168
+    pinned:
+      - base_snapshot
+      - "{{ candidate_snapshot }}"
+  register: retention
+'''
+
+RETURN = '''
+cache_bytes_freed:
+    description: Number of bytes of cached answers about the deleted snapshots removed from C(answer_cache_dir)
+    type: int
+deleted:
+    description: Names of the snapshots deleted, or that would be deleted in check mode
+    type: list
+errors:
+    description: Error deleting each snapshot that could not be deleted, keyed by snapshot name
+    type: dict
+kept:
+    description: Names of the snapshots named after a prefix that were kept
+    type: list
+timings:
+    description: Seconds spent in each phase and counters of data handled, if C(timings) is enabled
+    type: dictionary
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.batfish_session import connect
+from ansible.module_utils.batfish_snapshots import (expired_snapshots, forget_snapshot, load_index, save_index,
+                                                    snapshot_bases, snapshot_time)
+from ansible.module_utils.batfish_timings import Timings, instrument
+
+import threading
+
+
+def run_module():
+    # define the available arguments/parameters that a user can pass to
+    # the module
+    module_args = dict(
+        answer_cache_dir=dict(type='path', required=False, default='~/.batfish/answers'),
+        host=dict(type='str', required=False, default='localhost'),
+        index_path=dict(type='path', required=False, default='~/.batfish/snapshot_index.json'),
+        keep_last=dict(type='int', required=False, default=10),
+        max_age=dict(type='float', required=False, default=None),
+        metrics_path=dict(type='path', required=False, default=None),
+        network=dict(type='str', required=True),
+        persistent_session=dict(type='bool', required=False, default=True),
+        pinned=dict(type='list', required=False, default=[]),
+        prefixes=dict(type='list', required=True),
+        profile_path=dict(type='path', required=False, default=None),
+        timings=dict(type='bool', required=False, default=False),
+        workers=dict(type='int', required=False, default=4)
+    )
+
+    # seed the result dict in the object
+    # we primarily care about changed and state
+    # change is if this module effectively modified the target
+    # state will include any data that you want your module to pass back
+    # for consumption, for example, in a subsequent task
+    result = dict(
+        cache_bytes_freed=0,
+        changed=False,
+        deleted=[],
+        errors={},
+        kept=[],
+        timings={},
+    )
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    timings = Timings(result['timings'], enabled=module.params['timings'] or bool(module.params['metrics_path']))
+    instrument(timings, 'batfish_retention', dict(network=module.params['network']), module.params['profile_path'],
+               module.params['metrics_path'])
+
+    try:
+        with timings.phase('set_network'):
+            session = connect(module.params['host'], module.params['network'], module.params['persistent_session'],
+                              timings)
+        network = session.network
+    except Exception as e:
+        module.fail_json(msg='Failed to set network: {}'.format(e), **result)
+
+    try:
+        with timings.phase('list_snapshots'):
+            snapshots = session.call('list_snapshots')
+    except Exception as e:
+        module.fail_json(msg='Failed to list snapshots: {}'.format(e), **result)
+
+    index_path = module.params['index_path']
+    index = load_index(index_path)
+    # Snapshots forked from others are identified and compared through their base snapshot
+    pinned = set(module.params['pinned']) | snapshot_bases(index, network)
+    prefixes = module.params['prefixes']
+    max_age = module.params['max_age'] * 3600 if module.params['max_age'] is not None else None
+    expired = expired_snapshots(snapshots, prefixes, module.params['keep_last'], max_age, pinned)
+    result['kept'] = sorted(n for n in snapshots if n not in expired and
+                            any(snapshot_time(n, p) is not None for p in prefixes))
+
+    if module.check_mode:
+        result['deleted'] = expired
+        result['changed'] = bool(expired)
+        module.exit_json(**result)
+
+    with timings.phase('delete_snapshots'):
+        result['deleted'], result['errors'] = _delete_snapshots(session, expired, module.params['workers'])
+    timings.count('snapshots_deleted', len(result['deleted']))
+    result['changed'] = bool(result['deleted'])
+    if not result['deleted']:
+        module.exit_json(**result)
+
+    try:
+        with timings.phase('update_index'):
+            for name in result['deleted']:
+                forget_snapshot(index, network, name)
+            save_index(index_path, index)
+    except Exception as e:
+        module.warn('Failed to update snapshot index: {}'.format(e))
+
+    try:
+        from ansible.module_utils.batfish_cache import AnswerCache
+        cache = AnswerCache(module.params['answer_cache_dir'], module.params['host'], network)
+        with timings.phase('invalidate_cache'):
+            result['cache_bytes_freed'] = sum(cache.invalidate_snapshot(n) for n in result['deleted'])
+    except Exception as e:
+        module.warn('Failed to invalidate cached answers: {}'.format(e))
+
+    module.exit_json(**result)
+
+
+def _delete_snapshots(session, names, workers):
+    """
+    Delete snapshots, at most workers at a time.  Returns a tuple of the sorted names of the snapshots
+    deleted and a dictionary of the error deleting each of the others, keyed by snapshot name.
+    """
+    todo = list(reversed(names))
+    deleted = []
+    errors = {}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not todo:
+                    return
+                name = todo.pop()
+            try:
+                session.call('delete_snapshot', name=name)
+            except Exception as e:
+                with lock:
+                    errors[name] = '{}'.format(e)
+                continue
+            with lock:
+                deleted.append(name)
+
+    threads = [threading.Thread(target=worker) for _ in range(min(max(workers, 1), len(names)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sorted(deleted), errors
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -36,6 +36,20 @@ options:
             - The behavior that you want evaluated. Only one option should be selected.
         required: if C(reference_snapshot) is not specified
         choices: [ "permit", "deny", "matchLine <line number>" ]
+    answer_cache_dir:
+        description:
+            - Directory in which to cache answers, shared with C(batfish_policy).  Answers are only cached for snapshots whose contents are known, from the local snapshot index written by C(batfish_init) or from C(snapshot_paths), and are never reused once those contents change.  Answers of checks written to C(rows_dir) are not cached.  Set to an empty string to disable the cache.
+        required: false
+        default: ~/.batfish/answers
+    answer_cache_size:
+        description:
+            - Maximum size of C(answer_cache_dir) in megabytes.  The least recently used answers are removed once it grows past this.
+        required: false
+        default: 256
+    checks:
+        description:
+            - List of checks to answer concurrently in one module run.  Each check is a dictionary of the options of this module, plus an optional C(description) to label it; options not set in a check are taken from the module-level options.  A check passes if it returns no results.
+        required: false
     destination_ips:
         description:
             - Evaluate flows destined for the specified IPs.
@@ -48,10 +62,24 @@ options:
         description:
             - Only evaluate filters that match this regex.
         required: false
+    flows_batch_size:
+        description:
+            - Maximum number of flows from C(flows_file) to test with a single question.
+        required: false
+        default: 1000
+    flows_file:
+        description:
+            - Path to a JSON or CSV file of flows to test, each with any of the header options of this module (C(source_ips), C(destination_ips), C(ip_protocols), C(source_ports), C(destination_ports)), falling back to the module-level options, an optional C(id) and an optional C(action) it is expected to get, C(permit) or C(deny), which defaults to C(action).  A JSON file holds a list of flow dictionaries; a CSV file has a header row naming its columns.  Flows that differ in a single header option are merged and tested together, so the number of questions asked grows with the number of such batches, not the number of flows.  A batch with a violating flow is split in half and retested until each violating flow is found.  A flow passes if no filter matching C(filters) on a node matching C(nodes) treats any of its packets other than as expected.
+        required: false
     host:
         description:
             - Host running the C(Batfish) service.
         required: false
+    index_path:
+        description:
+            - Path of the local snapshot index written by C(batfish_init), used to identify snapshots in C(answer_cache_dir).
+        required: false
+        default: ~/.batfish/snapshot_index.json
     invert_search:
         description:
             - Search for packet headers outside the specified headerspace, rather than inside the space.
@@ -60,6 +88,14 @@ options:
         description:
             - Evaluate flows of the specified IP protocols.
         required: false
+    max_rows:
+        description:
+            - Maximum number of rows to return in C(result_verbose), for each check if C(checks) is specified.  All rows are returned if not specified.  This bounds the size of the module result, not the memory used to get it: Batfish has no way to return only some rows of a question, so each answer is fetched whole.
+        required: false
+    metrics_path:
+        description:
+            - Path of a file to write the C(timings) to in OpenMetrics text format when the module exits, for a local scraper such as the node exporter's textfile collector.  Implies C(timings).  Use a different file for each task.
+        required: false
     network:
         description:
             - Name of the network containing the specified snapshot.
@@ -68,10 +104,32 @@ options:
         description:
             - Only evaluate filters present on nodes matching this regex.
         required: false
+    persistent_session:
+        description:
+            - If C(yes), Batfish requests are made through a long-lived local session helper, which is started on first use and keeps the network, question templates and connections to C(Batfish) between module runs.
+        required: false
+        default: yes
+    profile_path:
+        description:
+            - Path of a file to write a cProfile profile of the module run to, readable with C(pstats).  Only the module's main thread is profiled, not the threads answering checks or the session helper.
+        required: false
+    question_cache_dir:
+        description:
+            - Directory in which to cache question templates fetched from the C(Batfish) service, keyed by service version.  Set to an empty string to always fetch templates from the service.
+        required: false
+        default: ~/.batfish/question_cache
     reference_snapshot:
         description:
             - Name of the reference snapshot to run against, only needed if running differentially.
         required: if C(action) is not specified
+    rows_dir:
+        description:
+            - Directory in which to write all rows as a JSON lines file, named after the check description if C(checks) is specified or the snapshot otherwise.
+        required: false
+    snapshot_paths:
+        description:
+            - Dictionary of snapshot name to a local copy of its files, used to identify snapshots that are not in the local snapshot index, such as a base snapshot created outside of C(batfish_init), in C(answer_cache_dir).
+        required: false
     source_ips:
         description:
             - Evaluate flows starting at the specified source IPs.
@@ -80,6 +138,11 @@ options:
         description:
             - Evaluate flows starting at the specified source ports.
         required: false
+    timings:
+        description:
+            - If C(yes), the seconds spent in each phase of the module run, the number of rows answered, answer cache hits and misses and the bytes exchanged with the session helper are returned in C(timings).
+        required: false
+        default: yes
     name:
         description:
             - Name of snapshot to run the question on.
@@ -117,27 +180,92 @@ EXAMPLES = '''
     ip_protocols: "tcp"
     destination_ports: "80,8080"
     invert_search: yes
+
+- name: Run several checks against the C(acl_in) ACL together, each one passes if it has no results
+  batfish_searchfilters:
+    name: "candidate_snapshot"
+    network: "test_network"
+    filters: "acl_in"
+    nodes: "nodeA|nodeB"
+    source_ips: "10.10.10.0/24"
+    destination_ips: "18.18.18.0/27"
+    ip_protocols: "tcp"
+    destination_ports: "80,8080"
+    checks:
+      - description: "Traffic is not already permitted"
+        name: "base_snapshot"
+        action: "permit"
+      - description: "Traffic is permitted after change"
+        action: "deny"
+      - description: "No other traffic is affected"
+        name: "base_snapshot"
+        reference_snapshot: "candidate_snapshot"
+        invert_search: yes
+
+- name: Test every flow listed in a change ticket against the C(acl_in) ACL, in as few questions as possible
+  batfish_searchfilters:
+    name: "candidate_snapshot"
+    network: "test_network"
+    filters: "acl_in"
+    nodes: "nodeA|nodeB"
+    flows_file: "/path/to/ticket_flows.csv"
+  register: flow_tests
 '''
 
 RETURN = '''
+flows:
+    description: Verdict table of the flows in C(flows_file), in file order, each with its header options, C(id), expected C(action), C(verdict), the number of C(rows) showing a violation and at most C(max_rows) of those rows; only returned when C(flows_file) is specified
+    type: list
+questions:
+    description: Number of questions asked to test the flows in C(flows_file)
+    type: int
+result:
+    description: Pass/Fail result of each check, only returned when C(checks) is specified
+    type: dictionary
 result_verbose:
-    description: Detailed result of searchfilters
+    description: Detailed result of searchfilters, keyed by check description when C(checks) is specified, limited to C(max_rows) rows
+    type: dictionary
+row_count:
+    description: Total number of rows, only returned when C(checks) is not specified
+    type: int
+row_counts:
+    description: Total number of rows of each check, only returned when C(checks) is specified
+    type: dictionary
+rows_files:
+    description: Path of the JSON lines file holding all rows, keyed by check description or snapshot, if C(rows_dir) is specified
+    type: dictionary
+summary:
+    description: Pass/Fail result of all checks or flows overall, only returned when C(checks) or C(flows_file) is specified
+    type: str
+timings:
+    description: Seconds spent in each phase of the module, whether question templates came from the cache and counters of data handled, if C(timings) is enabled
     type: dictionary
 '''
 
+PASS = 'PASS'
+FAIL = 'FAIL'
+
+# Action to search for to find flows that do not get the expected action
+OPPOSITE_ACTIONS = {'permit': 'deny', 'deny': 'permit'}
+
+# How a flow that does not get the expected action is treated instead
+VIOLATIONS = {'permit': 'denied', 'deny': 'permitted'}
+
+# Maximum number of flow batches to answer concurrently
+MAX_CONCURRENT_BATCHES = 16
+
+# Options that can be set per check, any not set fall back to the module-level option
+CHECK_KEYS = ['action', 'description', 'destination_ips', 'destination_ports', 'filters', 'invert_search',
+              'ip_protocols', 'name', 'nodes', 'reference_snapshot', 'source_ips', 'source_ports']
+
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.batfish_session import CACHE_FAILED, connect
+from ansible.module_utils.batfish_timings import Timings, instrument
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.module_utils.six import string_types
 
-try:
-    import json
-    from pybatfish.client.commands import (bf_get_analysis_answers, bf_get_answer, bf_init_analysis,
-                                           bf_run_analysis, bf_set_network, bf_session)
-    from pybatfish.datamodel.flow import HeaderConstraints
-    # noinspection PyUnresolvedReferences
-    from pybatfish.question import bfq, list_questions, load_questions  # noqa F401
-except Exception as e:
-    pybatfish_found = False
-else:
-    pybatfish_found = True
+import os
+import threading
 
 
 def run_module():
@@ -145,17 +273,31 @@ def run_module():
     # the module
     module_args = dict(
         action=dict(type='str', required=False, default='permit'),
+        answer_cache_dir=dict(type='path', required=False, default='~/.batfish/answers'),
+        answer_cache_size=dict(type='int', required=False, default=256),
+        checks=dict(type='list', required=False, default=None),
         destination_ips=dict(type='str', required=False, default=None),
         destination_ports=dict(type='str', required=False, default=None),
         filters=dict(type='str', required=False, default=".*"),
+        flows_batch_size=dict(type='int', required=False, default=1000),
+        flows_file=dict(type='path', required=False, default=None),
         host=dict(type='str', required=False, default='localhost'),
+        index_path=dict(type='path', required=False, default='~/.batfish/snapshot_index.json'),
         invert_search=dict(type='bool', required=False, default=False),
         ip_protocols=dict(type='list', required=False, default=None),
+        max_rows=dict(type='int', required=False, default=None),
+        metrics_path=dict(type='path', required=False, default=None),
         network=dict(type='str', required=True),
         nodes=dict(type='str', required=False, default=".*"),
+        persistent_session=dict(type='bool', required=False, default=True),
+        profile_path=dict(type='path', required=False, default=None),
+        question_cache_dir=dict(type='path', required=False, default='~/.batfish/question_cache'),
         reference_snapshot=dict(type='str', required=False, default=None),
+        rows_dir=dict(type='path', required=False, default=None),
+        snapshot_paths=dict(type='dict', required=False, default={}),
         source_ips=dict(type='str', required=False, default=None),
         source_ports=dict(type='str', required=False, default=None),
+        timings=dict(type='bool', required=False, default=True),
         name=dict(type='str', required=True)
     )
 
@@ -167,6 +309,8 @@ def run_module():
     result = dict(
         changed=False,
         result_verbose='',
+        rows_files={},
+        timings={},
     )
 
     # the AnsibleModule object will be our abstraction working with Ansible
@@ -177,63 +321,241 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=True,
         mutually_exclusive=[
-            ['action', 'reference_snapshot']
+            ['action', 'reference_snapshot'],
+            ['checks', 'flows_file'],
+            ['flows_file', 'reference_snapshot']
         ]
     )
 
-    if not pybatfish_found:
-        module.fail_json(msg='Python module Pybatfish is required')
-
     if module.check_mode:
         return result
 
-    snapshot = module.params['name']
-    reference_snapshot = module.params['reference_snapshot']
+    timings = Timings(result['timings'], enabled=module.params['timings'] or bool(module.params['metrics_path']))
+    instrument(timings, 'batfish_searchfilters', dict(network=module.params['network']),
+               module.params['profile_path'], module.params['metrics_path'])
+
+    flows = None
+    if module.params['flows_file'] is not None:
+        # Only flow testing needs the flow helpers, so other runs do not pay for importing them
+        from ansible.module_utils.batfish_flows import FLOW_FIELDS, load_flows
+        try:
+            with timings.phase('load_flows'):
+                flows = load_flows(module.params['flows_file'])
+        except Exception as e:
+            module.fail_json(msg='Failed to load flows: {}'.format(e), **result)
+        for flow in flows:
+            # Header options not set for a flow fall back to the module-level option
+            for k in FLOW_FIELDS:
+                if flow[k] is None and module.params[k]:
+                    flow[k] = ','.join(module.params[k]) if k == 'ip_protocols' else module.params[k]
+        bad = [i + 1 for i, f in enumerate(flows) if (f['action'] or module.params['action']) not in OPPOSITE_ACTIONS]
+        if bad:
+            module.fail_json(msg='Flows must be expected to be permitted or denied, see flows: {}'.format(
+                ', '.join('{}'.format(i) for i in bad)), **result)
 
     try:
-        bf_session.coordinatorHost = module.params['host']
-        network = bf_set_network(module.params['network'])
+        with timings.phase('set_network'):
+            session = connect(module.params['host'], module.params['network'], module.params['persistent_session'],
+                              timings)
     except Exception as e:
         module.fail_json(msg='Failed to set network: {}'.format(e), **result)
 
     try:
-        load_questions()
+        with timings.phase('load_questions'):
+            question_cache = session.call('load_questions', cache_dir=module.params['question_cache_dir'])
     except Exception as e:
         module.fail_json(msg='Failed to load questions: {}'.format(e), **result)
+    if question_cache.startswith(CACHE_FAILED):
+        module.warn('Failed to cache question templates, loading them from the service on every run; '
+                    'check that the Pybatfish version pinned in the README is installed: {}'.format(
+                        question_cache[len(CACHE_FAILED):]))
+        question_cache = 'failed'
+    timings.set('question_cache', question_cache)
 
-    try:
-        headers = HeaderConstraints(srcIps=module.params['source_ips'],
-                                    dstIps=module.params['destination_ips'],
-                                    ipProtocols=module.params['ip_protocols'],
-                                    srcPorts=module.params['source_ports'],
-                                    dstPorts=module.params['destination_ports'])
-    except Exception as e:
-        module.fail_json(msg='Failed to create header constraint: {}'.format(e), **result)
+    cache = None
+    if module.params['answer_cache_dir']:
+        # Only the cache needs the snapshot index
+        from ansible.module_utils.batfish_cache import AnswerCache
+        from ansible.module_utils.batfish_snapshots import load_index
+        cache = AnswerCache(module.params['answer_cache_dir'], module.params['host'], session.network,
+                            load_index(module.params['index_path']), module.params['snapshot_paths'],
+                            module.params['answer_cache_size'] * 1024 * 1024, timings)
 
-    try:
-        filters = module.params['filters']
-        nodes = module.params['nodes']
-        action = module.params['action']
-        invert_search = module.params['invert_search']
-        q = bfq.searchfilters(headers=headers,
-                              filters=filters,
-                              nodes=nodes,
-                              action=action,
-                              invertSearch=invert_search)
-        q_name = q.get_name()
-        answer_obj = q.answer(snapshot=snapshot,
-                              reference_snapshot=reference_snapshot)
-        answer_dict = bf_get_answer(questionName=q_name,
-                                    snapshot=snapshot,
-                                    reference_snapshot=reference_snapshot)
-    except Exception as e:
-        module.fail_json(msg='Failed to answer question: {}'.format(e), **result)
-
-    answer_element = answer_dict["answerElements"][0]
-    result['result_verbose'] = answer_element["rows"] if "rows" in answer_element else []
+    with timings.phase('answer'):
+        _answer(module, session, flows, result, timings, cache)
 
     module.exit_json(**result)
 
+def _answer(module, session, flows, result, timings, cache=None):
+    """
+    Answer the flows, the checks or the single question described by the module params into result,
+    reusing answers from cache if given.
+    """
+    checks = module.params['checks']
+    if flows is not None:
+        try:
+            answers, result['questions'] = _test_flows(session, module.params, flows, cache)
+        except Exception as e:
+            module.fail_json(msg='Failed to answer question: {}'.format(e), **result)
+        result['flows'] = []
+        for flow, answer in zip(flows, answers):
+            action = flow['action'] or module.params['action']
+            verdict = PASS if not answer['row_count'] else '{}, {} by {} filters'.format(
+                FAIL, VIOLATIONS[action], answer['row_count'])
+            result['flows'].append(dict(flow, action=action, verdict=verdict, row_count=answer['row_count'],
+                                        rows=answer['rows']))
+        result['summary'] = FAIL if any(a['row_count'] for a in answers) else PASS
+        timings.count('rows', sum(a['row_count'] for a in answers))
+    elif checks is None:
+        try:
+            answer = _answer_check(session, module.params, cache)
+        except Exception as e:
+            module.fail_json(msg='Failed to answer question: {}'.format(e), **result)
+        result['result_verbose'] = answer['rows']
+        result['row_count'] = answer['row_count']
+        timings.count('rows', answer['row_count'])
+        if answer['rows_file'] is not None:
+            result['rows_files'] = {module.params['name']: answer['rows_file']}
+    else:
+        unknown = set(k for c in checks for k in c) - set(CHECK_KEYS)
+        if unknown:
+            module.fail_json(msg='Unsupported check options: {}'.format(', '.join(sorted(unknown))), **result)
+        descriptions = [c.get('description', 'Check {}'.format(i + 1)) for i, c in enumerate(checks)]
+        check_params = [dict(module.params, **dict(c, description=d)) for d, c in zip(descriptions, checks)]
+        answers, errors = _answer_checks(session, check_params, cache)
+        if errors:
+            module.fail_json(msg='Failed to answer question: {}'.format(
+                '; '.join('{}: {}'.format(descriptions[i], errors[i]) for i in sorted(errors))), **result)
+
+        result['result'] = {}
+        result['result_verbose'] = {}
+        result['row_counts'] = {}
+        for description, answer in zip(descriptions, answers):
+            result['result'][description] = PASS if not answer['row_count'] else \
+                '{}, expected 0 results but got {}'.format(FAIL, answer['row_count'])
+            result['result_verbose'][description] = answer['rows']
+            result['row_counts'][description] = answer['row_count']
+            if answer['rows_file'] is not None:
+                result['rows_files'][description] = answer['rows_file']
+        result['summary'] = FAIL if any(a['row_count'] for a in answers) else PASS
+        timings.count('rows', sum(a['row_count'] for a in answers))
+
+def _answer_check(session, params, cache=None):
+    """
+    Run a single searchfilters question described by module-style params, unless its answer is in cache.
+    Returns a dictionary with the number of rows, at most max_rows of the rows, and the path of the
+    file holding all rows if rows_dir is set.
+    """
+    ip_protocols = params['ip_protocols']
+    if isinstance(ip_protocols, string_types):
+        ip_protocols = ip_protocols.split(',')
+    headers = dict(srcIps=params['source_ips'],
+                   dstIps=params['destination_ips'],
+                   ipProtocols=ip_protocols,
+                   srcPorts=params['source_ports'],
+                   dstPorts=params['destination_ports'])
+    rows_file = None
+    if params['rows_dir'] is not None:
+        from ansible.module_utils.batfish_answers import rows_file_name
+        rows_file = os.path.join(os.path.abspath(params['rows_dir']),
+                                 rows_file_name(params.get('description') or params['name']))
+        # A cached answer has no rows file to show for it
+        cache = None
+
+    snapshots = [params['name']]
+    if params['reference_snapshot'] is not None:
+        snapshots.append(params['reference_snapshot'])
+    cache_params = None
+    if cache is not None:
+        from ansible.module_utils.batfish_cache import normalize_list
+        cache_params = dict({k: normalize_list(v) for k, v in headers.items()},
+                            action=params['action'],
+                            filters=params['filters'],
+                            invert_search=boolean(params['invert_search']),
+                            max_rows=params['max_rows'],
+                            nodes=params['nodes'])
+        answer = cache.get('searchfilters', None, snapshots, cache_params)
+        if answer is not None:
+            return dict(answer, rows_file=None)
+
+    answer = session.call('searchfilters',
+                          snapshot=params['name'],
+                          reference_snapshot=params['reference_snapshot'],
+                          headers=headers,
+                          filters=params['filters'],
+                          nodes=params['nodes'],
+                          action=params['action'],
+                          invert_search=boolean(params['invert_search']),
+                          cache_dir=params['question_cache_dir'],
+                          max_rows=params['max_rows'],
+                          rows_file=rows_file)
+    if cache is not None:
+        cache.put('searchfilters', None, snapshots, cache_params, answer)
+    answer['rows_file'] = rows_file
+    return answer
+
+def _answer_checks(session, check_params, cache=None):
+    """
+    Answer several checks concurrently, one thread per check, reusing answers from cache if given.
+    Returns a tuple of (rows, errors): rows is in the same order as check_params and errors maps the
+    index of each check that could not be answered to its error message.
+    """
+    answers = [None] * len(check_params)
+    errors = {}
+
+    def worker(i):
+        try:
+            answers[i] = _answer_check(session, check_params[i], cache)
+        except Exception as e:
+            errors[i] = '{}'.format(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(check_params))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return answers, errors
+
+def _test_flows(session, params, flows, cache=None):
+    """
+    Test each flow against its expected action, merging flows into as few questions as possible.
+    Each batch of flows is searched for packets that get the opposite action.  Batches with results
+    are split in half and retested, so the flows that get the wrong action are identified.
+    Returns a tuple of (answers, questions): the answer for each flow, in order, and the number of
+    questions asked.
+    """
+    from ansible.module_utils.batfish_flows import batch_flows
+    answers = [None] * len(flows)
+    pending = []
+    for action in sorted(OPPOSITE_ACTIONS):
+        indices = [i for i, f in enumerate(flows) if (f['action'] or params['action']) == action]
+        pending.extend(dict(b, action=action) for b in batch_flows(flows, indices, params['flows_batch_size']))
+
+    questions = 0
+    while pending:
+        batches = pending[:MAX_CONCURRENT_BATCHES]
+        pending = pending[MAX_CONCURRENT_BATCHES:]
+        check_params = [dict(params, **dict(b['headers'], action=OPPOSITE_ACTIONS[b['action']], rows_dir=None))
+                        for b in batches]
+        batch_answers, errors = _answer_checks(session, check_params, cache)
+        if errors:
+            raise Exception(errors[min(errors)])
+        questions += len(batches)
+
+        for batch, answer in zip(batches, batch_answers):
+            indices = batch['indices']
+            if len(indices) == 1:
+                answers[indices[0]] = answer
+            elif not answer['row_count']:
+                for i in indices:
+                    answers[i] = dict(row_count=0, rows=[])
+            else:
+                half = len(indices) // 2
+                for part in (indices[:half], indices[half:]):
+                    pending.extend(dict(b, action=batch['action'])
+                                   for b in batch_flows(flows, part, params['flows_batch_size']))
+    return answers, questions
+
 def main():
     run_module()
 
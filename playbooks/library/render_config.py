@@ -0,0 +1,381 @@
+#!/usr/bin/python
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: render_config
+
+short_description: Renders device configs from the SOT and jinja2 config section templates
+
+version_added: "2.7"
+
+description:
+    - "Renders the config of each device from its attributes in the SOT (C(inputs_dir)/<hostname>.json) and the ACL definitions (C(inputs_dir)/acls.json), using one jinja2 template per config section.  The templates are loaded once for all devices, sections are rendered and joined in memory, and each config is written atomically, only if its contents changed."
+    - "If C(sot_dir) is given, the SOT is read from an indexed store of C(inputs_dir) kept there instead of from its files.  Only the files changed since the store was last used are reloaded, so each device is then looked up by hostname rather than read from its own file."
+
+options:
+    dest_dir:
+        description:
+            - Directory to write the configs to, as <hostname>.cfg.  It is created if it does not exist.
+        required: true
+    hostnames:
+        description:
+            - Hostnames of the devices to render configs for.
+        required: true
+    inputs_dir:
+        description:
+            - Directory containing the SOT files.
+        required: true
+    sections:
+        description:
+            - Names of the templates, without the .j2 extension, to render in order for each device.
+        required: false
+        default: [system_start, loopback, eth_interface, ospf, bgp, acl, system_end]
+    sot_dir:
+        description:
+            - Directory of the indexed SOT stores, such as C(~/.batfish/sot).  If not specified, the SOT files are read directly.
+        required: false
+    skip_empty_acls:
+        description:
+            - If C(yes), the C(acl) section is not rendered for devices with no ACLs in the SOT.
+        required: false
+        default: no
+    templates_dir:
+        description:
+            - Directory containing the config section templates.
+        required: true
+    vars:
+        description:
+            - Variables that override the device attributes from the SOT, for every device.
+        required: false
+        default: {}
+    workers:
+        description:
+            - Number of processes to render configs in, or 0 for one per CPU core.  Each process renders and writes whole configs, so devices never share scratch files.
+        required: false
+        default: 1
+
+author:
+    - Spencer Fraint (`@sfraint <https://github.com/sfraint>`_)
+
+requirements:
+    - "jinja2"
+'''
+
+EXAMPLES = '''
+# Render a new leaf config, with a BGP AS other than the one in the SOT
+- name: Render leaf config
+  render_config:
+    hostnames:
+      - lhr-leaf-03
+    inputs_dir: /path/to/inputs
+    templates_dir: /path/to/templates
+    dest_dir: /path/to/snapshot/configs
+    skip_empty_acls: yes
+    vars:
+      bgp_as: 65003
+
+# Render the configs of several firewalls in one task
+- name: Render firewall configs
+  render_config:
+    hostnames: "{{ hostnames.split('|') }}"
+    inputs_dir: /path/to/inputs
+    templates_dir: /path/to/templates
+    dest_dir: /path/to/snapshot/configs
+    workers: 0
+  register: rendered
+
+# Render from the indexed SOT store, refreshed from the files that changed
+- name: Render firewall configs from the SOT store
+  render_config:
+    hostnames: "{{ hostnames.split('|') }}"
+    inputs_dir: /path/to/inputs
+    templates_dir: /path/to/templates
+    dest_dir: /path/to/snapshot/configs
+    sot_dir: ~/.batfish/sot
+'''
+
+RETURN = '''
+acl_names:
+    description: Names of the ACLs of the rendered devices in the SOT, in order of first appearance
+    type: list
+changed_files:
+    description: Paths of the configs whose contents changed
+    type: list
+configs:
+    description: Dictionary of hostname to the path of its config
+    type: dict
+sot_changes:
+    description: Names of the SOT files added, updated and removed in the store, if C(sot_dir) is specified
+    type: dict
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+
+import json
+import os
+import tempfile
+
+try:
+    from jinja2 import Environment, FileSystemLoader, StrictUndefined
+except Exception:
+    jinja2_found = False
+else:
+    jinja2_found = True
+
+DEFAULT_SECTIONS = ['system_start', 'loopback', 'eth_interface', 'ospf', 'bgp', 'acl', 'system_end']
+
+# Templates and variables shared by every device, set up before rendering any of them
+_worker = {}
+
+
+def run_module():
+    # define the available arguments/parameters that a user can pass to
+    # the module
+    module_args = dict(
+        dest_dir=dict(type='path', required=True),
+        hostnames=dict(type='list', required=True),
+        inputs_dir=dict(type='path', required=True),
+        sections=dict(type='list', required=False, default=DEFAULT_SECTIONS),
+        skip_empty_acls=dict(type='bool', required=False, default=False),
+        sot_dir=dict(type='path', required=False, default=None),
+        templates_dir=dict(type='path', required=True),
+        vars=dict(type='dict', required=False, default={}),
+        workers=dict(type='int', required=False, default=1)
+    )
+
+    # seed the result dict in the object
+    # we primarily care about changed and state
+    # change is if this module effectively modified the target
+    # state will include any data that you want your module to pass back
+    # for consumption, for example, in a subsequent task
+    result = dict(
+        acl_names=[],
+        changed=False,
+        changed_files=[],
+        configs={},
+        sot_changes={},
+    )
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    if not jinja2_found:
+        module.fail_json(msg='Python module jinja2 is required')
+
+    dest_dir = module.params['dest_dir']
+    hostnames = module.params['hostnames']
+
+    try:
+        templates = _load_templates(module.params['templates_dir'], module.params['sections'])
+    except Exception as e:
+        module.fail_json(msg='Failed to load templates: {}'.format(e), **result)
+
+    store_path = None
+    if module.params['sot_dir'] is not None:
+        from ansible.module_utils.sot_store import SotStore, store_path as sot_store_path
+        store_path = sot_store_path(module.params['inputs_dir'], module.params['sot_dir'])
+        try:
+            store = SotStore(module.params['inputs_dir'], store_path)
+            result['sot_changes'] = store.refresh()
+        except Exception as e:
+            module.fail_json(msg='Failed to refresh SOT store: {}'.format(e), **result)
+        # Each process opens its own connection, see _load_device
+        _worker.update(store=store, store_pid=os.getpid())
+
+    try:
+        if store_path is not None:
+            acl_vars = _worker['store'].document('acls.json')
+        else:
+            acl_vars = _load_json(os.path.join(module.params['inputs_dir'], 'acls.json'))
+    except Exception as e:
+        module.fail_json(msg='Failed to load ACL definitions: {}'.format(e), **result)
+
+    if not module.check_mode and not os.path.isdir(dest_dir):
+        try:
+            os.makedirs(dest_dir)
+        except Exception as e:
+            module.fail_json(msg='Failed to create config directory: {}'.format(e), **result)
+
+    old_umask = os.umask(0)
+    os.umask(old_umask)
+    _worker.update(acl_vars=acl_vars, check_mode=module.check_mode, dest_dir=dest_dir,
+                   inputs_dir=module.params['inputs_dir'], mode=0o666 & ~old_umask,
+                   skip_empty_acls=module.params['skip_empty_acls'], store_path=store_path,
+                   templates=templates, vars=module.params['vars'])
+
+    workers = module.params['workers']
+    if not workers:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(hostnames))
+    if workers > 1:
+        pool = _fork_pool(workers)
+        try:
+            devices = pool.map(_render_device, hostnames, max(1, len(hostnames) // (workers * 4)))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        devices = [_render_device(hostname) for hostname in hostnames]
+
+    for device in devices:
+        if device['error'] is not None:
+            module.fail_json(msg=device['error'], **result)
+        result['configs'][device['hostname']] = device['path']
+        if device['changed']:
+            result['changed_files'].append(device['path'])
+        for acl_name in device['acl_names']:
+            if acl_name not in result['acl_names']:
+                result['acl_names'].append(acl_name)
+
+    # manipulate or modify the state as needed (this is going to be the
+    # part where your module will do what it needs to do)
+    result['changed'] = bool(result['changed_files'])
+
+    module.exit_json(**result)
+
+
+def _load_templates(templates_dir, sections):
+    """
+    Load and compile the template of each section, returning a list of (section, template) tuples.
+    The environment matches the template module's defaults, so configs render identically.
+    """
+    env = Environment(loader=FileSystemLoader(templates_dir), trim_blocks=True,
+                      keep_trailing_newline=True, undefined=StrictUndefined)
+    return [(section, env.get_template('{}.j2'.format(section))) for section in sections]
+
+
+def render_config(templates, device_vars, skip_empty_acls=False):
+    """
+    Render each section template with device_vars and join the sections the way the assemble
+    module joins its fragments, adding a newline after any fragment that does not end with one.
+    """
+    fragments = []
+    for section, template in templates:
+        if section == 'acl' and skip_empty_acls and not device_vars.get('acls'):
+            continue
+        fragment = template.render(device_vars)
+        if fragments and not fragments[-1].endswith('\n'):
+            fragments.append('\n')
+        fragments.append(fragment)
+    return ''.join(fragments)
+
+
+def _fork_pool(processes):
+    """
+    Return a pool of forked worker processes, which inherit the templates and variables in _worker.
+    """
+    import multiprocessing
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork').Pool(processes)
+    return multiprocessing.Pool(processes)
+
+
+def _render_device(hostname):
+    """
+    Render the config of one device and write it if its contents changed, using the templates and
+    variables in _worker.  Returns a dictionary describing the device's config, with the error
+    message if it failed.
+    """
+    device = dict(acl_names=[], changed=False, error=None, hostname=hostname,
+                  path=os.path.join(_worker['dest_dir'], '{}.cfg'.format(hostname)))
+    try:
+        device_vars = dict(_worker['acl_vars'])
+        device_vars.update(_load_device(hostname))
+        device_vars.update(_worker['vars'])
+        config = render_config(_worker['templates'], device_vars, _worker['skip_empty_acls'])
+        device['acl_names'] = [acl['name'] for acl in device_vars.get('acls', [])]
+    except Exception as e:
+        device['error'] = "Failed to render config for '{}': {}".format(hostname, e)
+        return device
+
+    if _read_file(device['path']) == config:
+        return device
+    device['changed'] = True
+    if _worker['check_mode']:
+        return device
+    try:
+        _write_file(device['path'], config, _worker['mode'])
+    except Exception as e:
+        device['error'] = "Failed to write config for '{}': {}".format(hostname, e)
+    return device
+
+
+def _load_device(hostname):
+    """
+    Return the SOT of a device, from the store if there is one, or from its file.
+    """
+    if _worker['store_path'] is None:
+        return _load_json(os.path.join(_worker['inputs_dir'], '{}.json'.format(hostname)))
+    # SQLite connections must not be shared with forked workers, so each opens its own
+    if _worker.get('store_pid') != os.getpid():
+        from ansible.module_utils.sot_store import SotStore
+        _worker.update(store=SotStore(_worker['inputs_dir'], _worker['store_path']), store_pid=os.getpid())
+    return _worker['store'].device(hostname)
+
+
+def _load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _read_file(path):
+    """
+    Return the contents of a text file, or None if it does not exist.
+    """
+    try:
+        with open(path) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def _write_file(path, contents, mode):
+    """
+    Write contents to a temporary file next to path and rename it into place, keeping the
+    permissions of any existing file, or using mode for a new one.
+    """
+    if os.path.exists(path):
+        mode = os.stat(path).st_mode & 0o7777
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(contents)
+        os.chmod(tmp_path, mode)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
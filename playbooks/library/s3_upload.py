@@ -0,0 +1,183 @@
+#!/usr/bin/python
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: s3_upload
+
+short_description: Uploads a file to S3 in parallel parts and returns a URL to download it
+
+version_added: "2.7"
+
+description:
+    - "Uploads a file to S3, or an S3-compatible service, as a multipart upload whose parts are uploaded in parallel, and returns a presigned URL to download it, signed locally without another request.  The object is tagged with the SHA-256 digest of the file, so with C(dedup) an unchanged file is not uploaded again.  To upload a results log while it is written instead, use the S3 options of C(write_results)."
+
+options:
+    bucket:
+        description:
+            - S3 bucket to upload the file to.  Credentials are found by boto3 as usual, from the environment or an AWS profile.
+        required: true
+    dedup:
+        description:
+            - If C(yes), the file is not uploaded if the object already has the same contents, as tagged by this module or C(write_results).
+        required: false
+        default: yes
+    object:
+        description:
+            - Key of the uploaded object.  Defaults to the file name of C(src).
+        required: false
+    part_size:
+        description:
+            - Size in megabytes of each part uploaded, at least 5.
+        required: false
+        default: 8
+    region:
+        description:
+            - AWS region of C(bucket).  Found by boto3 as usual if not specified.
+        required: false
+    s3_url:
+        description:
+            - URL of an S3-compatible service to upload to instead of AWS, such as a local stand-in for tests.
+        required: false
+    src:
+        description:
+            - Path of the file to upload.
+        required: true
+    url_expiry:
+        description:
+            - Number of seconds the returned C(url) is valid for.
+        required: false
+        default: 600
+    workers:
+        description:
+            - Maximum number of parts to upload concurrently.
+        required: false
+        default: 4
+
+author:
+    - Spencer Fraint (`@sfraint <https://github.com/sfraint>`_)
+
+requirements:
+    - "boto3"
+'''
+
+EXAMPLES = '''
+- name: Upload a log file
+  s3_upload:
+    bucket: my-logs-bucket
+    src: /path/to/logs/bf-logs-candidate.jsonl.gz
+  register: upload
+
+- name: Upload a log file to a local S3 stand-in
+  s3_upload:
+    bucket: test-bucket
+    src: /path/to/logs/bf-logs-candidate.jsonl.gz
+    s3_url: http://localhost:5000
+'''
+
+RETURN = '''
+sha256:
+    description: SHA-256 digest of the file
+    type: str
+uploaded:
+    description: Whether the file was uploaded, rather than found in the bucket already
+    type: bool
+url:
+    description: Presigned URL to download the object, valid for C(url_expiry) seconds
+    type: str
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+
+import os
+
+try:
+    import boto3  # noqa: F401
+except Exception:
+    boto3_found = False
+else:
+    boto3_found = True
+
+
+def run_module():
+    # define the available arguments/parameters that a user can pass to
+    # the module
+    module_args = dict(
+        bucket=dict(type='str', required=True),
+        dedup=dict(type='bool', required=False, default=True),
+        object=dict(type='str', required=False, default=None),
+        part_size=dict(type='int', required=False, default=8),
+        region=dict(type='str', required=False, default=None),
+        s3_url=dict(type='str', required=False, default=None),
+        src=dict(type='path', required=True),
+        url_expiry=dict(type='int', required=False, default=600),
+        workers=dict(type='int', required=False, default=4)
+    )
+
+    # seed the result dict in the object
+    # we primarily care about changed and state
+    # change is if this module effectively modified the target
+    # state will include any data that you want your module to pass back
+    # for consumption, for example, in a subsequent task
+    result = dict(
+        changed=False,
+        sha256='',
+        uploaded=False,
+        url='',
+    )
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    if not boto3_found:
+        module.fail_json(msg='Python module boto3 is required')
+
+    if module.check_mode:
+        module.exit_json(**result)
+
+    from ansible.module_utils.multipart_upload import object_url, s3_client, upload_file
+
+    bucket = module.params['bucket']
+    key = module.params['object'] or os.path.basename(module.params['src'])
+    try:
+        client = s3_client(module.params['s3_url'], module.params['region'])
+        upload = upload_file(client, bucket, key, module.params['src'], module.params['part_size'] * 1024 * 1024,
+                             module.params['workers'], module.params['dedup'])
+        result['url'] = object_url(client, bucket, key, module.params['url_expiry'])
+    except Exception as e:
+        module.fail_json(msg='Failed to upload file: {}'.format(e), **result)
+    result['sha256'] = upload.sha256
+    result['uploaded'] = not upload.skipped
+    result['changed'] = result['uploaded']
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/python
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: write_results
+
+short_description: Writes validation results to a compact, compressed log file
+
+version_added: "2.7"
+
+description:
+    - "Writes the results of the Batfish modules as a compressed JSON lines file: the summary of the results on the first line, then the rows of each table in blocks stored by column.  Rows are written a block at a time, and the files in C(rows_files) are read a line at a time, so the whole log is never built in memory.  The file is written atomically.  Read it with C(python/read_results.py), or the ResultsReader class of module_utils/batfish_results.py."
+    - "If C(s3_bucket) is given, the file is also uploaded to S3 while it is written, in parts uploaded in parallel, so the upload finishes soon after the file does."
+
+options:
+    block_rows:
+        description:
+            - Number of rows stored in each block of the file.
+        required: false
+        default: 1000
+    compression:
+        description:
+            - Compression of the file.  C(zstd) needs the zstandard Python package.
+        required: false
+        default: gzip
+        choices: [ "gzip", "none", "zstd" ]
+    content:
+        description:
+            - Results to write.  Each list of rows found by following the dictionaries under C(result_verbose) is written as a table named by its keys, such as the policy and check names; everything else is the summary.
+        required: true
+    dedup:
+        description:
+            - If C(yes), an existing S3 object with the same contents, as tagged by this module or C(s3_upload), is not replaced.
+        required: false
+        default: yes
+    dest:
+        description:
+            - Path of the file to write.  Its directory is created if it does not exist.
+        required: true
+    part_size:
+        description:
+            - Size in megabytes of each part uploaded to S3, at least 5.
+        required: false
+        default: 8
+    region:
+        description:
+            - AWS region of C(s3_bucket).  Found by boto3 as usual if not specified.
+        required: false
+    rows_files:
+        description:
+            - Dictionary of table name to a JSON lines file of rows to write as a table, such as the C(rows_files) returned by the Batfish modules when C(rows_dir) is set, which hold all rows rather than at most C(max_rows).  The rows of a policy's file are written as one table per check, named by the policy and check.  Tables from these files replace the tables under the same name in C(content).
+        required: false
+    s3_bucket:
+        description:
+            - S3 bucket to upload the file to while it is written.  Needs the boto3 Python package.  Credentials are found by boto3 as usual, from the environment or an AWS profile.
+        required: false
+    s3_object:
+        description:
+            - Key of the uploaded object.  Defaults to the file name of C(dest).
+        required: false
+    s3_url:
+        description:
+            - URL of an S3-compatible service to upload to instead of AWS, such as a local stand-in for tests.
+        required: false
+    summary_dest:
+        description:
+            - Path of a JSON file to also write the summary and the number of rows of each table to, small enough to open without reading the log.
+        required: false
+    upload_workers:
+        description:
+            - Maximum number of parts to upload to S3 concurrently.
+        required: false
+        default: 4
+    url_expiry:
+        description:
+            - Number of seconds the returned C(url) of the uploaded object is valid for.
+        required: false
+        default: 600
+
+author:
+    - Spencer Fraint (`@sfraint <https://github.com/sfraint>`_)
+'''
+
+EXAMPLES = '''
+- name: Write results to a compressed log file
+  write_results:
+    content: "{{ results }}"
+    dest: /path/to/logs/bf-logs-candidate.jsonl.gz
+    rows_files: "{{ results.rows_files | default(omit) }}"
+    summary_dest: /path/to/logs/bf-logs-candidate.summary.json
+
+- name: Write results to a compressed log file, uploading it to S3 as it is written
+  write_results:
+    content: "{{ results }}"
+    dest: /path/to/logs/bf-logs-candidate.jsonl.gz
+    s3_bucket: my-logs-bucket
+  register: log
+'''
+
+RETURN = '''
+dest:
+    description: Path of the file written
+    type: str
+sha256:
+    description: SHA-256 digest of the file written, if it was uploaded to S3
+    type: str
+size:
+    description: Size of the file written in bytes
+    type: int
+tables:
+    description: Number of rows written for each table, keyed by table name, its keys joined with " / "
+    type: dict
+uploaded:
+    description: Whether the file was uploaded to S3, rather than found there already or not uploaded at all
+    type: bool
+url:
+    description: Presigned URL to download the uploaded object, valid for C(url_expiry) seconds
+    type: str
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.batfish_results import (COMPRESSIONS, ResultsWriter, result_tables, rows_file_tables,
+                                                  table_name)
+
+import json
+import os
+from itertools import chain
+
+
+def run_module():
+    # define the available arguments/parameters that a user can pass to
+    # the module
+    module_args = dict(
+        block_rows=dict(type='int', required=False, default=1000),
+        compression=dict(type='str', required=False, default='gzip', choices=COMPRESSIONS),
+        content=dict(type='dict', required=True),
+        dedup=dict(type='bool', required=False, default=True),
+        dest=dict(type='path', required=True),
+        part_size=dict(type='int', required=False, default=8),
+        region=dict(type='str', required=False, default=None),
+        rows_files=dict(type='dict', required=False, default={}),
+        s3_bucket=dict(type='str', required=False, default=None),
+        s3_object=dict(type='str', required=False, default=None),
+        s3_url=dict(type='str', required=False, default=None),
+        summary_dest=dict(type='path', required=False, default=None),
+        upload_workers=dict(type='int', required=False, default=4),
+        url_expiry=dict(type='int', required=False, default=600)
+    )
+
+    # seed the result dict in the object
+    # we primarily care about changed and state
+    # change is if this module effectively modified the target
+    # state will include any data that you want your module to pass back
+    # for consumption, for example, in a subsequent task
+    result = dict(
+        changed=False,
+        dest='',
+        sha256='',
+        size=0,
+        tables={},
+        uploaded=False,
+        url='',
+    )
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    if module.check_mode:
+        module.exit_json(**result)
+
+    if module.params['compression'] == 'zstd':
+        try:
+            import zstandard  # noqa: F401
+        except Exception:
+            module.fail_json(msg='Python module zstandard is required for zstd compression', **result)
+
+    dest = module.params['dest']
+    bucket = module.params['s3_bucket']
+    s3_object = module.params['s3_object'] or os.path.basename(dest)
+    upload = None
+    if bucket:
+        # Only uploads need boto3
+        try:
+            from ansible.module_utils.multipart_upload import MultipartUpload, s3_client
+            client = s3_client(module.params['s3_url'], module.params['region'])
+        except Exception as e:
+            module.fail_json(msg='Failed to connect to S3, boto3 is required: {}'.format(e), **result)
+        upload = MultipartUpload(client, bucket, s3_object, module.params['part_size'] * 1024 * 1024,
+                                 module.params['upload_workers'], module.params['dedup'],
+                                 'application/gzip' if module.params['compression'] == 'gzip' else
+                                 'application/octet-stream')
+
+    rows_files = module.params['rows_files']
+    summary, tables = result_tables(module.params['content'])
+    # Rows files hold all the rows of the tables that content only has at most max_rows of
+    tables = [(t, rows) for t, rows in tables if t[0] not in rows_files]
+
+    try:
+        with ResultsWriter(dest, summary, module.params['compression'], module.params['block_rows'],
+                           upload) as writer:
+            # Rows files are read as their tables are written, a line at a time
+            tables = chain(tables, *(rows_file_tables(k, rows_files[k]) for k in sorted(rows_files)))
+            for table, rows in tables:
+                name = table_name(table)
+                result['tables'][name] = result['tables'].get(name, 0) + writer.write_table(table, rows)
+    except Exception as e:
+        module.fail_json(msg='Failed to write results: {}'.format(e), **result)
+    result['dest'] = dest
+    result['size'] = os.path.getsize(dest)
+    result['changed'] = True
+    if upload is not None:
+        from ansible.module_utils.multipart_upload import object_url
+        try:
+            upload.close()
+        except Exception as e:
+            module.fail_json(msg='Failed to upload results: {}'.format(e), **result)
+        result['sha256'] = upload.sha256
+        result['uploaded'] = not upload.skipped
+        result['url'] = object_url(client, bucket, s3_object, module.params['url_expiry'])
+
+    if module.params['summary_dest'] is not None:
+        try:
+            with open(module.params['summary_dest'], 'w') as f:
+                json.dump(dict(summary=summary, tables=result['tables']), f, indent=2, sort_keys=True)
+        except Exception as e:
+            module.fail_json(msg='Failed to write summary: {}'.format(e), **result)
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
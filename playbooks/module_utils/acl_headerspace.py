@@ -0,0 +1,398 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Local model of IOS-style IP access lists, for checking ACL changes without the Batfish service.
+
+Packet headers are points in a space of five integer fields: source IP, destination IP, IP protocol,
+source port and destination port.  Sets of headers are lists of disjoint boxes, each a tuple of one
+inclusive (low, high) range per field.  An ACL is evaluated against a set of headers by splitting it
+into the headers each line matches first, so questions such as "does this ACL permit any of these
+headers?" or "do these two ACLs treat any of these headers differently?" are answered exactly.
+
+Only the subset of IOS syntax used by simple extended and standard ACLs is supported.  Lines that
+cannot be modelled exactly raise UnsupportedAclError, so callers can defer to Batfish instead.
+"""
+
+import re
+
+FIELDS = ['srcIp', 'dstIp', 'ipProtocol', 'srcPort', 'dstPort']
+
+IP_RANGE = (0, (1 << 32) - 1)
+PROTOCOL_RANGE = (0, 255)
+PORT_RANGE = (0, 65535)
+
+ALL_HEADERS = [(IP_RANGE, IP_RANGE, PROTOCOL_RANGE, PORT_RANGE, PORT_RANGE)]
+
+PROTOCOLS = {
+    'ahp': 51, 'eigrp': 88, 'esp': 50, 'gre': 47, 'icmp': 1, 'igmp': 2, 'ipinip': 4, 'nos': 94,
+    'ospf': 89, 'pcp': 108, 'pim': 103, 'sctp': 132, 'tcp': 6, 'udp': 17,
+}
+
+# Protocols whose headers have ports
+PORT_PROTOCOLS = frozenset([6, 17])
+
+PORTS = {
+    'bgp': 179, 'bootpc': 68, 'bootps': 67, 'domain': 53, 'ftp': 21, 'ftp-data': 20, 'http': 80,
+    'https': 443, 'isakmp': 500, 'ldap': 389, 'ntp': 123, 'pop3': 110, 'smtp': 25, 'snmp': 161,
+    'snmptrap': 162, 'ssh': 22, 'syslog': 514, 'tacacs': 49, 'telnet': 23, 'tftp': 69, 'www': 80,
+}
+
+# Trailing keywords that do not affect which headers a line matches
+IGNORED_KEYWORDS = frozenset(['log', 'log-input'])
+
+
+class UnsupportedAclError(Exception):
+    pass
+
+
+class Acl(object):
+    """
+    An access list: an ordered list of (action, headers) lines, with an implicit deny at the end.
+    """
+
+    def __init__(self, name, lines=None):
+        self.name = name
+        self.lines = lines or []
+
+    def partition(self, headers):
+        """
+        Split a set of headers into a tuple of (permitted, denied) sets of headers.
+        """
+        permitted, denied = [], []
+        remaining = list(headers)
+        for action, line_headers in self.lines:
+            if not remaining:
+                break
+            matched = intersect(remaining, line_headers)
+            if not matched:
+                continue
+            (permitted if action == 'permit' else denied).extend(matched)
+            remaining = subtract(remaining, line_headers)
+        denied.extend(remaining)
+        return permitted, denied
+
+
+def differences(acl, other, headers):
+    """
+    Return the headers, within a set of headers, that two ACLs treat differently.
+    Only headers matched by a line that is not common to both ACLs can be treated differently: any
+    other header is matched first by the same common line in both, or by no line in either.  So the
+    search is narrowed down to those lines, which keeps it fast for small changes to long ACLs.
+    """
+    import difflib
+    a = [(action, tuple(line_headers)) for action, line_headers in acl.lines]
+    b = [(action, tuple(line_headers)) for action, line_headers in other.lines]
+    common = set()
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for i, j, size in matcher.get_matching_blocks():
+        common.update(('a', i + k) for k in range(size))
+        common.update(('b', j + k) for k in range(size))
+    changed = [box for side, lines in (('a', a), ('b', b)) for i, (_, line_headers) in enumerate(lines)
+               if (side, i) not in common for box in line_headers]
+    space = intersect(headers, union(changed))
+    if not space:
+        return []
+    permitted, denied = acl.partition(space)
+    return other.partition(permitted)[1] + other.partition(denied)[0]
+
+
+def parse_config_acls(text):
+    """
+    Parse the IP access lists in an IOS-style device config.
+    Returns a dictionary of ACL name to Acl, or to the UnsupportedAclError raised while parsing it.
+    """
+    acls = {}
+    current = None
+    for line in text.splitlines():
+        words = line.split()
+        if not words or words[0].startswith('!'):
+            continue
+        if not line[0].isspace():
+            current = None
+            if words[:2] == ['ip', 'access-list'] and len(words) >= 4:
+                current = _add_acl(acls, words[3], words[2] == 'standard')
+            elif words[0] == 'access-list' and len(words) >= 3:
+                number = words[1]
+                standard = number.isdigit() and (1 <= int(number) <= 99 or 1300 <= int(number) <= 1999)
+                _add_line(acls, _add_acl(acls, number, standard, reuse=True), words[2:])
+        elif current is not None:
+            _add_line(acls, current, words)
+    return {name: acl for name, (acl, _) in acls.items()}
+
+
+def _add_acl(acls, name, standard, reuse=False):
+    if not (reuse and name in acls):
+        acls[name] = (Acl(name), standard)
+    return name
+
+
+def _add_line(acls, name, words):
+    acl, standard = acls[name]
+    if isinstance(acl, UnsupportedAclError):
+        return
+    try:
+        line = parse_line(words, standard)
+    except UnsupportedAclError as e:
+        acls[name] = (UnsupportedAclError("ACL '{}': {}".format(name, e)), standard)
+        return
+    if line is not None:
+        acl.lines.append(line)
+
+
+def parse_line(words, standard=False):
+    """
+    Parse the words of one ACL line, returning a tuple of (action, headers), or None for remarks.
+    """
+    if words and words[0].isdigit():
+        # Sequence number
+        words = words[1:]
+    if not words or words[0] == 'remark':
+        return None
+    action = words[0]
+    if action not in ('permit', 'deny'):
+        raise UnsupportedAclError('unsupported line: {}'.format(' '.join(words)))
+    words = list(words[1:])
+
+    if standard:
+        src = _parse_address(words)
+        _check_done(words)
+        return action, [(src, IP_RANGE, PROTOCOL_RANGE, PORT_RANGE, PORT_RANGE)]
+
+    protocols = _parse_protocol(words.pop(0) if words else None)
+    src = _parse_address(words)
+    src_ports = _parse_ports(words)
+    dst = _parse_address(words)
+    dst_ports = _parse_ports(words)
+    _check_done(words)
+    if (src_ports is not None or dst_ports is not None) and \
+            not (protocols[0] == protocols[1] and protocols[0] in PORT_PROTOCOLS):
+        raise UnsupportedAclError('ports are only supported for tcp and udp')
+    return action, [(src, dst, protocols, sp, dp)
+                    for sp in (src_ports or [PORT_RANGE]) for dp in (dst_ports or [PORT_RANGE])]
+
+
+def _parse_protocol(word):
+    if word == 'ip':
+        return PROTOCOL_RANGE
+    if word in PROTOCOLS:
+        return PROTOCOLS[word], PROTOCOLS[word]
+    if word is not None and word.isdigit() and int(word) <= 255:
+        return int(word), int(word)
+    raise UnsupportedAclError('unsupported protocol: {}'.format(word))
+
+
+def _parse_address(words):
+    if not words:
+        raise UnsupportedAclError('missing address')
+    word = words.pop(0)
+    if word == 'any':
+        return IP_RANGE
+    if word == 'host':
+        if not words:
+            raise UnsupportedAclError('missing host address')
+        ip = ip_to_int(words.pop(0))
+        return ip, ip
+    ip = ip_to_int(word)
+    wildcard = ip_to_int(words.pop(0)) if words and _is_ip(words[0]) else 0
+    if wildcard & (wildcard + 1):
+        raise UnsupportedAclError('non-contiguous wildcard: {}'.format(int_to_ip(wildcard)))
+    return ip & ~wildcard, ip | wildcard
+
+
+def _parse_ports(words):
+    """
+    Parse an optional port match, returning a list of port ranges, or None if there is none.
+    """
+    if not words or words[0] not in ('eq', 'neq', 'lt', 'gt', 'range'):
+        return None
+    op = words.pop(0)
+    if op == 'range':
+        low, high = _parse_port(words), _parse_port(words)
+        return [(low, high)]
+    if op == 'eq':
+        ports = [_parse_port(words)]
+        # IOS allows several ports after eq
+        while words and (words[0].isdigit() or words[0] in PORTS):
+            ports.append(_parse_port(words))
+        return [(p, p) for p in sorted(set(ports))]
+    port = _parse_port(words)
+    if op == 'lt':
+        return [(0, port - 1)] if port > 0 else []
+    if op == 'gt':
+        return [(port + 1, PORT_RANGE[1])] if port < PORT_RANGE[1] else []
+    return [r for r in ((0, port - 1), (port + 1, PORT_RANGE[1])) if r[0] <= r[1]]
+
+
+def _parse_port(words):
+    word = words.pop(0) if words else None
+    if word in PORTS:
+        return PORTS[word]
+    if word is not None and word.isdigit() and int(word) <= PORT_RANGE[1]:
+        return int(word)
+    raise UnsupportedAclError('unsupported port: {}'.format(word))
+
+
+def _check_done(words):
+    extra = [w for w in words if w not in IGNORED_KEYWORDS]
+    if extra:
+        raise UnsupportedAclError('unsupported keywords: {}'.format(' '.join(extra)))
+
+
+def header_space(src_ips=None, dst_ips=None, ip_protocols=None, src_ports=None, dst_ports=None):
+    """
+    Return the set of headers matching searchfilters-style header constraints: comma-separated
+    prefixes or addresses, a list of protocols, and comma-separated ports or port ranges (a-b).
+    If ports are constrained and protocols are not, only tcp and udp headers match.
+    """
+    src = _parse_prefixes(src_ips)
+    dst = _parse_prefixes(dst_ips)
+    sports = _parse_port_ranges(src_ports)
+    dports = _parse_port_ranges(dst_ports)
+    if ip_protocols:
+        protocols = [_parse_protocol(p.strip().lower()) for p in ip_protocols]
+    elif src_ports or dst_ports:
+        protocols = [(p, p) for p in sorted(PORT_PROTOCOLS)]
+    else:
+        protocols = [PROTOCOL_RANGE]
+
+    headers = []
+    for protocol in protocols:
+        # Headers without ports do not depend on the port constraints
+        has_ports = protocol[0] == protocol[1] and protocol[0] in PORT_PROTOCOLS
+        for s in src:
+            for d in dst:
+                for sp in (sports if has_ports else [PORT_RANGE]):
+                    for dp in (dports if has_ports else [PORT_RANGE]):
+                        headers.append((s, d, protocol, sp, dp))
+    return union(headers)
+
+
+def _parse_prefixes(value):
+    if not value:
+        return [IP_RANGE]
+    ranges = []
+    for item in value.split(','):
+        item = item.strip()
+        address, _, length = item.partition('/')
+        ip = ip_to_int(address)
+        length = int(length) if length else 32
+        if not 0 <= length <= 32:
+            raise UnsupportedAclError('invalid prefix: {}'.format(item))
+        wildcard = (1 << (32 - length)) - 1
+        ranges.append((ip & ~wildcard, ip | wildcard))
+    return ranges
+
+
+def _parse_port_ranges(value):
+    if not value:
+        return [PORT_RANGE]
+    ranges = []
+    for item in value.split(','):
+        low, _, high = item.strip().partition('-')
+        ranges.append((int(low), int(high or low)))
+    return ranges
+
+
+def complement(headers):
+    """
+    Return the set of all headers not in headers.
+    """
+    return subtract(ALL_HEADERS, headers)
+
+
+def union(headers):
+    """
+    Return the given, possibly overlapping, boxes as a set of disjoint boxes.
+    """
+    result = []
+    for box in headers:
+        result.extend(subtract([box], result))
+    return result
+
+
+def intersect(a, b):
+    """
+    Return the intersection of two sets of headers.
+    """
+    result = []
+    for x in a:
+        for y in b:
+            box = _intersect_box(x, y)
+            if box is not None:
+                result.append(box)
+    return result
+
+
+def subtract(a, b):
+    """
+    Return the headers in a that are not in b.
+    """
+    result = list(a)
+    for y in b:
+        result = [piece for x in result for piece in _subtract_box(x, y)]
+    return result
+
+
+def _intersect_box(x, y):
+    box = tuple((max(xl, yl), min(xh, yh)) for (xl, xh), (yl, yh) in zip(x, y))
+    if any(low > high for low, high in box):
+        return None
+    return box
+
+
+def _subtract_box(x, y):
+    """
+    Return x minus y as a list of disjoint boxes, splitting x along one field at a time.
+    """
+    if _intersect_box(x, y) is None:
+        return [x]
+    pieces = []
+    rest = list(x)
+    for i, ((low, high), (y_low, y_high)) in enumerate(zip(x, y)):
+        if low < y_low:
+            pieces.append(tuple(rest[:i] + [(low, y_low - 1)] + rest[i + 1:]))
+        if y_high < high:
+            pieces.append(tuple(rest[:i] + [(y_high + 1, high)] + rest[i + 1:]))
+        rest[i] = (max(low, y_low), min(high, y_high))
+    return pieces
+
+
+def example_flow(box):
+    """
+    Return an example header from a box, as a dictionary with the field names Batfish uses.
+    """
+    values = [low for low, _ in box]
+    flow = dict(zip(FIELDS, values))
+    flow['srcIp'] = int_to_ip(flow['srcIp'])
+    flow['dstIp'] = int_to_ip(flow['dstIp'])
+    return flow
+
+
+def _is_ip(word):
+    return re.match(r'^\d+\.\d+\.\d+\.\d+$', word) is not None
+
+
+def ip_to_int(address):
+    parts = address.split('.')
+    if len(parts) != 4 or not all(p.isdigit() and int(p) <= 255 for p in parts):
+        raise UnsupportedAclError('invalid address: {}'.format(address))
+    value = 0
+    for p in parts:
+        value = (value << 8) | int(p)
+    return value
+
+
+def int_to_ip(value):
+    return '.'.join(str((value >> shift) & 0xff) for shift in (24, 16, 8, 0))
@@ -0,0 +1,150 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Helpers for handling answer rows without building a list of all of them.
+
+Rows are parsed out of answer JSON one at a time and passed to a RowSink, which counts them, keeps a
+bounded sample for the module result, and optionally writes every row to a JSON lines file.  The
+answer text itself is still fetched whole, as Batfish has no way to return only some of its rows, so
+memory use is bounded by the size of the largest answer rather than by max_rows.
+"""
+
+import json
+import os
+import re
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+class RowSink(object):
+    """
+    Consumes answer rows: counts them, keeps the first max_rows of them (all if max_rows is None),
+    and writes all of them to the open file out, one JSON document per line.
+    If check is given, each line is a dictionary with the check name and the row.
+    """
+
+    def __init__(self, max_rows=None, out=None, check=None):
+        self.max_rows = max_rows
+        self.out = out
+        self.check = check
+        self.count = 0
+        self.rows = []
+
+    def add(self, row):
+        self.count += 1
+        if self.max_rows is None or len(self.rows) < self.max_rows:
+            self.rows.append(row)
+        if self.out is not None:
+            line = row if self.check is None else dict(check=self.check, row=row)
+            self.out.write(json.dumps(line, sort_keys=True) + '\n')
+
+
+def open_rows_file(path):
+    """
+    Open a JSON lines file for writing rows, creating its directory if needed.
+    """
+    rows_dir = os.path.dirname(path)
+    if rows_dir and not os.path.isdir(rows_dir):
+        os.makedirs(rows_dir)
+    return open(path, 'w')
+
+
+def rows_file_name(name):
+    """
+    Return a file name for the rows of the named policy or check.
+    """
+    return '{}.jsonl'.format(re.sub(r'[^A-Za-z0-9._-]+', '_', name))
+
+
+def parse_answer(text, on_row):
+    """
+    Parse a JSON answer, passing each row of its first answer element to on_row instead of adding it
+    to the returned dictionary, so no list of parsed rows is built.  text itself holds all of them.
+    """
+    def element_value(key, text, pos):
+        if key != 'rows':
+            return _decoder.raw_decode(text, pos)
+
+        def row(text, pos, index):
+            value, pos = _decoder.raw_decode(text, pos)
+            on_row(value)
+            return pos
+        return [], _parse_array(text, pos, row)
+
+    def answer_value(key, text, pos):
+        if key != 'answerElements':
+            return _decoder.raw_decode(text, pos)
+        elements = []
+
+        def element(text, pos, index):
+            if index == 0:
+                value, pos = _parse_object(text, pos, element_value)
+            else:
+                value, pos = _decoder.raw_decode(text, pos)
+            elements.append(value)
+            return pos
+        return elements, _parse_array(text, pos, element)
+
+    answer, _ = _parse_object(text, _skip(text, 0), answer_value)
+    return answer
+
+
+def _skip(text, pos):
+    return _whitespace.match(text, pos).end()
+
+
+def _expect(text, pos, char):
+    pos = _skip(text, pos)
+    if not text.startswith(char, pos):
+        raise ValueError('Expected {!r} at position {} of answer'.format(char, pos))
+    return pos + 1
+
+
+def _parse_array(text, pos, parse_item):
+    """
+    Parse the JSON array at pos, calling parse_item(text, pos, index) for each item, which must
+    return the position just after the item.  Returns the position just after the array.
+    """
+    pos = _skip(text, _expect(text, pos, '['))
+    if text.startswith(']', pos):
+        return pos + 1
+    index = 0
+    while True:
+        pos = _skip(text, parse_item(text, pos, index))
+        index += 1
+        if text.startswith(']', pos):
+            return pos + 1
+        pos = _skip(text, _expect(text, pos, ','))
+
+
+def _parse_object(text, pos, parse_value):
+    """
+    Parse the JSON object at pos, calling parse_value(key, text, pos) for each value, which must
+    return a tuple of (value, position just after the value).
+    Returns a tuple of (object, position just after the object).
+    """
+    obj = {}
+    pos = _skip(text, _expect(text, pos, '{'))
+    if text.startswith('}', pos):
+        return obj, pos + 1
+    while True:
+        key, pos = _decoder.raw_decode(text, pos)
+        pos = _skip(text, _expect(text, pos, ':'))
+        obj[key], pos = parse_value(key, text, pos)
+        pos = _skip(text, pos)
+        if text.startswith('}', pos):
+            return obj, pos + 1
+        pos = _skip(text, _expect(text, pos, ','))
@@ -0,0 +1,254 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Local on-disk cache of Batfish answers, shared by module runs and playbooks.
+
+An answer is cached under the identity of the snapshots it was asked of, so it is never reused once
+a snapshot's contents change.  A snapshot's identity comes from the local snapshot index written by
+batfish_init, or from hashing a local copy of its files; answers about snapshots with no known
+identity are not cached.  Entries are JSON files grouped by service, network and snapshot name, so
+batfish_init can drop the answers of a snapshot it overwrites, and the least recently used entries
+are removed once the cache grows past its size limit.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from ansible.module_utils.six import string_types
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Fraction of the size limit the cache is shrunk to when it grows past the limit, so that adding
+# entries to a full cache does not scan it every time
+LOW_WATER_MARK = 0.8
+
+
+class AnswerCache(object):
+    """
+    Answers cached under cache_dir for network on the Batfish service at host.
+    Snapshots are identified from the snapshot index, or from the local copies of their files in
+    paths, as for snapshot_identity.  Safe to use from several threads and processes.  An empty
+    cache_dir disables the cache.
+    """
+
+    def __init__(self, cache_dir, host, network, index=None, paths=None, max_bytes=DEFAULT_MAX_BYTES,
+                 timings=None):
+        self.enabled = bool(cache_dir)
+        self.network_dir = os.path.join(os.path.expanduser(cache_dir or ''), _digest([host, network]))
+        self.cache_dir = os.path.dirname(self.network_dir)
+        self.network = network
+        self.index = index or {}
+        self.paths = paths or {}
+        self.max_bytes = max_bytes
+        self.timings = timings
+        self._identities = {}
+        self._size = None
+        self._lock = threading.Lock()
+
+    def identity(self, name):
+        """
+        Return the identity of snapshot name, or None if its contents are not known.
+        """
+        with self._lock:
+            if name not in self._identities:
+                try:
+                    self._identities[name] = snapshot_identity(self.index, self.network, name, self.paths)
+                except (IOError, OSError):
+                    # Unreadable local copy of the snapshot's files
+                    self._identities[name] = None
+            return self._identities[name]
+
+    def get(self, question, name, snapshots, params):
+        """
+        Return the cached answer to question name about the named snapshots with params, or None if
+        there is none.  The first snapshot is the one asked about, any others are references.
+        Nothing is cached about snapshots whose identity is not known.
+        """
+        key = self._key(question, name, snapshots, params)
+        if key is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            if entry['key'] != key:
+                raise ValueError('Cache entry {} does not match its key'.format(path))
+            # The file's modification time orders entries for eviction
+            os.utime(path, None)
+        except (IOError, OSError, ValueError, KeyError):
+            self._count('answer_cache_misses')
+            return None
+        self._count('answer_cache_hits')
+        return entry['value']
+
+    def put(self, question, name, snapshots, params, value):
+        """
+        Cache value as the answer to question name about the named snapshots with params, as for get.
+        Failing to write the cache is not an error, since it is only an optimization.
+        """
+        key = self._key(question, name, snapshots, params)
+        if key is None:
+            return
+        path = self._path(key)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(dict(key=key, value=value), f)
+                size = os.path.getsize(tmp_path)
+                os.rename(tmp_path, path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+        except (IOError, OSError):
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = _dir_size(self.cache_dir)
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._size = evict(self.cache_dir, int(self.max_bytes * LOW_WATER_MARK))
+
+    def invalidate_snapshot(self, name):
+        """
+        Remove all answers cached about snapshot name, as when it is overwritten or deleted.
+        Returns the number of bytes freed.
+        """
+        if not self.enabled:
+            return 0
+        path = os.path.join(self.network_dir, _digest(name))
+        size = _dir_size(path)
+        _remove_tree(path)
+        return size
+
+    def _key(self, question, name, snapshots, params):
+        if not self.enabled:
+            return None
+        identities = [self.identity(s) for s in snapshots]
+        if None in identities:
+            return None
+        # Round-tripped, so it compares equal to the key read back from an entry
+        return json.loads(json.dumps(dict(question=question, name=name, params=params,
+                                          snapshots=[[s, i] for s, i in zip(snapshots, identities)])))
+
+    def _path(self, key):
+        return os.path.join(self.network_dir, _digest(key['snapshots'][0][0]), '{}.json'.format(_digest(key)))
+
+    def _count(self, name):
+        if self.timings is not None:
+            self.timings.count(name)
+
+
+def snapshot_identity(index, network, name, paths=None):
+    """
+    Return a string identifying the contents of snapshot name in network, or None if they are not known.
+    Snapshots in the snapshot index are identified by their index key, combined with the identity of
+    the snapshot they were forked from; others by hashing their files, if paths maps name to a local
+    copy of them.
+    """
+    from ansible.module_utils.batfish_snapshots import find_entry, hash_snapshot_dir, snapshot_key
+    key, entry = find_entry(index, network, name)
+    if key is not None:
+        if not entry.get('base_name'):
+            return key
+        base = snapshot_identity(index, network, entry['base_name'], paths)
+        return _digest([key, base]) if base is not None else None
+    if paths and paths.get(name) and os.path.isdir(paths[name]):
+        return snapshot_key(hash_snapshot_dir(paths[name])[0])
+    return None
+
+
+def policy_params(checks_path, max_rows=None):
+    """
+    Return the parameters a policy's answers are cached with, for its checks in checks_path.
+    The checks are part of the question, so answers are not reused once they change.
+    """
+    from ansible.module_utils.batfish_snapshots import hash_snapshot_dir
+    return dict(checks=hash_snapshot_dir(checks_path)[0], max_rows=max_rows)
+
+
+def normalize_list(value):
+    """
+    Return a comma-separated list, or a list of strings, as a sorted comma-separated string without
+    duplicates, so parameters that only differ in list order share cache entries.
+    """
+    if value is None:
+        return None
+    if isinstance(value, string_types):
+        value = value.split(',')
+    return ','.join(sorted(set('{}'.format(v).strip() for v in value)))
+
+
+def evict(cache_dir, max_bytes):
+    """
+    Remove the least recently used entries under cache_dir until it holds at most max_bytes.
+    Returns the number of bytes left.
+    """
+    entries = []
+    for dir_path, _, file_names in os.walk(cache_dir):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+    total = sum(e[1] for e in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # Already removed by a concurrent eviction or invalidation
+            pass
+        total -= size
+    return total
+
+
+def _digest(value):
+    if not isinstance(value, string_types):
+        value = json.dumps(value, sort_keys=True)
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def _dir_size(path):
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total += os.path.getsize(os.path.join(dir_path, file_name))
+            except OSError:
+                pass
+    return total
+
+
+def _remove_tree(path):
+    # Renamed first, so readers never see a partly removed directory
+    import shutil
+    if not os.path.isdir(path):
+        return
+    tmp_path = '{}.{}.removing'.format(path, os.getpid())
+    try:
+        os.rename(path, tmp_path)
+    except OSError:
+        return
+    shutil.rmtree(tmp_path, ignore_errors=True)
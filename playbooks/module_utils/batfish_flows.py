@@ -0,0 +1,113 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Helpers for testing many flows with few searchfilters questions.
+
+A flow is a dictionary of searchfilters header options, each a comma-separated list of values or
+None for any value.  Flows that differ in a single field are merged into one batch by taking the
+union of that field, so each batch's header space is exactly the union of its flows' header spaces
+and one question answers whether any of them violates its expected action.
+"""
+
+import csv
+import json
+from collections import OrderedDict
+
+FLOW_FIELDS = ['source_ips', 'destination_ips', 'ip_protocols', 'source_ports', 'destination_ports']
+
+# Fields that flows are merged on, in order.  Protocols are never merged, since ports only apply to
+# some of them.
+MERGE_FIELDS = ['destination_ips', 'source_ips', 'destination_ports', 'source_ports']
+
+FLOW_KEYS = FLOW_FIELDS + ['action', 'id']
+
+
+def load_flows(path):
+    """
+    Load flows from a JSON file holding a list of flow dictionaries, or from a CSV file with a header
+    row naming the columns.  Columns are FLOW_KEYS, and empty or missing values are returned as None.
+    """
+    with open(path) as f:
+        if path.lower().endswith('.json'):
+            flows = json.load(f)
+            if isinstance(flows, dict):
+                flows = flows.get('flows', [])
+        else:
+            flows = list(csv.DictReader(f))
+
+    result = []
+    for i, flow in enumerate(flows):
+        unknown = set(flow) - set(FLOW_KEYS)
+        if unknown:
+            raise ValueError('Unsupported flow fields in flow {}: {}'.format(i + 1, ', '.join(sorted(unknown))))
+        result.append({k: _value(flow.get(k)) for k in FLOW_KEYS})
+    return result
+
+
+def _value(value):
+    if isinstance(value, list):
+        value = ','.join('{}'.format(v) for v in value)
+    if value is None or '{}'.format(value).strip() == '':
+        return None
+    return '{}'.format(value).strip()
+
+
+def batch_flows(flows, indices, max_size):
+    """
+    Merge the flows at indices into batches of at most max_size flows.
+    Returns a list of batches, each a dictionary with the indices of its flows and its header options.
+    """
+    groups = [dict(indices=[i], values={f: _values(flows[i][f], f) for f in FLOW_FIELDS}) for i in indices]
+    for field in MERGE_FIELDS:
+        merged = OrderedDict()
+        for group in groups:
+            key = tuple(group['values'][f] for f in FLOW_FIELDS if f != field)
+            bucket = merged.setdefault(key, [])
+            if bucket and len(bucket[-1]['indices']) + len(group['indices']) <= max_size:
+                last = bucket[-1]
+                last['indices'] = last['indices'] + group['indices']
+                last['values'] = dict(last['values'], **{field: _union(last['values'][field],
+                                                                       group['values'][field])})
+            else:
+                bucket.append(group)
+        groups = [g for bucket in merged.values() for g in bucket]
+    return [dict(indices=g['indices'], headers={f: _headers(g['values'][f], f) for f in FLOW_FIELDS})
+            for g in groups]
+
+
+def _values(value, field):
+    """
+    Return the set of values of a flow field, or None for any value.
+    """
+    if value is None:
+        return None
+    values = [v.strip() for v in value.split(',') if v.strip()]
+    if field == 'ip_protocols':
+        values = [v.lower() for v in values]
+    return frozenset(values) or None
+
+
+def _union(a, b):
+    if a is None or b is None:
+        return None
+    return a | b
+
+
+def _headers(values, field):
+    if values is None:
+        return None
+    if field == 'ip_protocols':
+        return sorted(values)
+    return ','.join(sorted(values))
@@ -0,0 +1,361 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Session helper for the Batfish modules.
+
+LocalSession runs Batfish operations in the current process using Pybatfish.  The session helper
+started by batfish_session.connect serves a LocalSession over a Unix socket, so the network, the
+question templates and Pybatfish's HTTP connections are kept between module runs.
+
+The helper runs each request in its own thread, as the Batfish modules run policies and checks
+concurrently.  Pybatfish keeps its session in a process-global bf_session, so operations that change
+it run alone, see EXCLUSIVE_OPERATIONS.  The others name their network and snapshots explicitly and
+only send requests to the service, so they run concurrently.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from contextlib import contextmanager
+
+from ansible.module_utils.batfish_answers import RowSink, open_rows_file, parse_answer
+from ansible.module_utils.batfish_session import CACHE_FAILED, BatfishSessionError
+from ansible.module_utils.batfish_timings import Timings
+from ansible.module_utils.six import string_types
+from ansible.module_utils.six.moves import socketserver
+
+# Seconds without requests after which a session helper exits
+IDLE_TIMEOUT = 900
+
+
+class LocalSession(object):
+    """
+    Runs Batfish operations in this process, using Pybatfish.
+    """
+
+    def __init__(self, host, network, timings=None):
+        timings = timings or Timings(enabled=False)
+        try:
+            with timings.phase('import_pybatfish'):
+                from pybatfish.client.commands import bf_session, bf_set_network
+        except Exception:
+            raise BatfishSessionError('Python module Pybatfish is required')
+        bf_session.coordinatorHost = host
+        with timings.phase('bf_set_network'):
+            self.network = bf_set_network(network)
+        self._questions = None
+        self._questions_lock = threading.Lock()
+        self._lock = _SharedLock()
+
+    def call(self, op, **kwargs):
+        if op not in OPERATIONS:
+            raise BatfishSessionError('Unsupported operation: {}'.format(op))
+        with self._lock.exclusive() if op in EXCLUSIVE_OPERATIONS else self._lock.shared():
+            return getattr(self, op)(**kwargs)
+
+    def ping(self):
+        return self.network
+
+    def init_snapshot(self, path, name, overwrite=False):
+        from pybatfish.client.commands import bf_init_snapshot
+        return bf_init_snapshot(path, name, overwrite=overwrite)
+
+    def fork_snapshot(self, **kwargs):
+        from pybatfish.client.commands import bf_fork_snapshot
+        return bf_fork_snapshot(**kwargs)
+
+    def delete_snapshot(self, name):
+        from pybatfish.client.commands import bf_delete_snapshot
+        return bf_delete_snapshot(name)
+
+    def list_snapshots(self):
+        from pybatfish.client.commands import bf_list_snapshots
+        return bf_list_snapshots()
+
+    def init_analysis(self, name, path):
+        from pybatfish.client.commands import bf_init_analysis
+        return bf_init_analysis(name, path)
+
+    def delete_analysis(self, name):
+        from pybatfish.client.commands import bf_delete_analysis
+        return bf_delete_analysis(name)
+
+    def list_analyses(self):
+        from pybatfish.client.commands import bf_list_analyses
+        return bf_list_analyses()
+
+    def reference_book_groups(self, name):
+        """
+        Return the sorted names of the interface groups in reference book name.
+        """
+        from pybatfish.client.commands import bf_get_reference_book
+        return sorted(g.name for g in bf_get_reference_book(name).interfaceGroups)
+
+    def run_analysis(self, name, snapshot, max_rows=None, rows_file=None):
+        """
+        Run an analysis and return, for each check, its answer summary, its number of rows and at most
+        max_rows of its rows.  All rows are written to rows_file, if given, as JSON lines tagged with
+        their check.  The answers of all checks are fetched whole, as Batfish cannot return only some of
+        their rows; each is then parsed one row at a time and its text dropped once parsed.
+        """
+        from pybatfish.client.commands import bf_run_analysis
+        answers = bf_run_analysis(name=name, snapshot=snapshot)
+        results = {}
+        out = open_rows_file(rows_file) if rows_file else None
+        try:
+            for check in sorted(answers):
+                sink = RowSink(max_rows, out, check)
+                answer = parse_answer(answers.pop(check), sink.add)
+                results[check] = dict(summary=answer['summary'], row_count=sink.count, rows=sink.rows)
+        finally:
+            if out is not None:
+                out.close()
+        return results
+
+    def load_questions(self, cache_dir=None):
+        """
+        Load question templates, once per session.
+        Returns how the templates were loaded: 'hit' or 'miss' for the template cache, 'disabled'
+        if they were loaded straight from the service, or 'loaded' if they were already loaded.  If they
+        could not be cached, the reason why, prefixed with 'failed: ', is returned every time instead.
+        """
+        with self._questions_lock:
+            if self._questions is not None:
+                return self._questions if self._questions.startswith(CACHE_FAILED) else 'loaded'
+            self._questions = load_question_templates(cache_dir)
+            return self._questions
+
+    def searchfilters(self, snapshot, headers, filters, nodes, action, invert_search,
+                      reference_snapshot=None, cache_dir=None, max_rows=None, rows_file=None):
+        """
+        Answer a searchfilters question and return its number of rows and at most max_rows of its rows.
+        All rows are written to rows_file, if given, as JSON lines.
+        headers is a dictionary of keyword arguments for HeaderConstraints.
+        The whole answer is fetched and parsed by Pybatfish before its rows are counted.
+        """
+        from pybatfish.datamodel.flow import HeaderConstraints
+        from pybatfish.question import bfq
+        self.load_questions(cache_dir)
+        q = bfq.searchfilters(headers=HeaderConstraints(**headers),
+                              filters=filters,
+                              nodes=nodes,
+                              action=action,
+                              invertSearch=invert_search)
+        # The answer object is the answer dictionary, no need to fetch it again
+        answer_dict = q.answer(snapshot=snapshot,
+                               reference_snapshot=reference_snapshot)
+        answer_element = answer_dict["answerElements"][0]
+        out = open_rows_file(rows_file) if rows_file else None
+        try:
+            sink = RowSink(max_rows, out)
+            for row in answer_element.get("rows", []):
+                sink.add(row)
+        finally:
+            if out is not None:
+                out.close()
+        return dict(row_count=sink.count, rows=sink.rows)
+
+
+OPERATIONS = frozenset(['delete_analysis', 'delete_snapshot', 'fork_snapshot', 'init_analysis', 'init_snapshot',
+                        'list_analyses', 'list_snapshots', 'load_questions', 'ping', 'reference_book_groups',
+                        'run_analysis', 'searchfilters'])
+
+# Operations that set the current snapshot of Pybatfish's process-global bf_session, so they do not
+# run concurrently with any other
+EXCLUSIVE_OPERATIONS = frozenset(['fork_snapshot', 'init_snapshot'])
+
+
+class _SharedLock(object):
+    """
+    A lock held by any number of shared holders at once, or by a single exclusive holder.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+
+    @contextmanager
+    def shared(self):
+        with self._cond:
+            while self._exclusive:
+                self._cond.wait()
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._shared -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            while self._exclusive or self._shared:
+                self._cond.wait()
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+
+class _SessionHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        with self.server.active_lock:
+            self.server.active += 1
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            try:
+                response = dict(value=self.server.session.call(request['op'], **request.get('kwargs', {})))
+            except Exception as e:
+                response = dict(error='{}'.format(e))
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+        finally:
+            with self.server.active_lock:
+                self.server.active -= 1
+
+
+class _SessionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, session):
+        socketserver.UnixStreamServer.__init__(self, socket_path, _SessionHandler)
+        self.session = session
+        self.active = 0
+        self.active_lock = threading.Lock()
+        self.idle = False
+
+    def handle_timeout(self):
+        with self.active_lock:
+            self.idle = self.active == 0
+
+    def serve_until_idle(self, idle_timeout):
+        self.timeout = idle_timeout
+        while not self.idle:
+            self.handle_request()
+
+
+def bind_session(session, socket_path):
+    """
+    Return a server for session bound to socket_path, replacing any stale socket there.
+    The server accepts connections once bound; call its serve_until_idle method to handle them.
+    Anything with a call(op, **kwargs) method, like LocalSession, can be served.
+    """
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    old_umask = os.umask(0o077)
+    try:
+        return _SessionServer(socket_path, session)
+    finally:
+        os.umask(old_umask)
+
+
+def start_helper(session, socket_path):
+    """
+    Start a detached helper process serving session on socket_path.
+    The socket is bound before forking, so it accepts connections as soon as this returns.
+    """
+    server = bind_session(session, socket_path)
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.setsid()
+            if os.fork() == 0:
+                # Release the module's stdout/stderr, Ansible waits for them to close
+                os.chdir('/')
+                devnull = os.open(os.devnull, os.O_RDWR)
+                for fd in (0, 1, 2):
+                    os.dup2(devnull, fd)
+                server.serve_until_idle(IDLE_TIMEOUT)
+                server.server_close()
+                try:
+                    os.remove(socket_path)
+                except OSError:
+                    pass
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    server.server_close()
+
+
+def load_question_templates(cache_dir):
+    """
+    Load question templates, using templates cached under cache_dir if possible.
+    Templates are cached per Batfish service version, so a service upgrade picks up its new templates.
+    Returns 'hit' or 'miss' depending on whether the cache was already populated, 'disabled', or
+    'failed: ' followed by the reason the templates could not be cached.
+    Caching uses Pybatfish internals, as it has no public API to fetch the templates, so it fails with
+    Pybatfish versions other than the one the README pins.
+    """
+    from pybatfish.client.commands import bf_get_info
+    from pybatfish.question import load_questions
+
+    if not cache_dir:
+        load_questions()
+        return 'disabled'
+
+    info = json.dumps(bf_get_info(), sort_keys=True)
+    version_dir = os.path.join(os.path.expanduser(cache_dir), hashlib.sha1(info.encode('utf-8')).hexdigest())
+    if os.path.isdir(version_dir):
+        load_questions(question_dir=version_dir)
+        return 'hit'
+
+    try:
+        _cache_question_templates(version_dir)
+    except Exception as e:
+        # The cache is only an optimization, fall back to loading from the service
+        load_questions()
+        return '{}{}'.format(CACHE_FAILED, e)
+    load_questions(question_dir=version_dir)
+    return 'miss'
+
+
+def _cache_question_templates(version_dir):
+    """
+    Fetch all question templates from the Batfish service and save them into version_dir.
+    The directory is populated under a temporary name and renamed into place, so concurrent
+    module runs never load a partially written cache.
+    """
+    from pybatfish.client import resthelper, workhelper
+    from pybatfish.client.commands import bf_session
+    from pybatfish.client.consts import CoordConsts
+
+    json_data = workhelper.get_data_get_question_templates(bf_session)
+    response = resthelper.get_json_response(bf_session, CoordConsts.SVC_RSC_GET_QUESTION_TEMPLATES, json_data)
+    templates = json.loads(response[CoordConsts.SVC_KEY_QUESTION_LIST])
+
+    parent_dir = os.path.dirname(version_dir)
+    if not os.path.isdir(parent_dir):
+        os.makedirs(parent_dir)
+    tmp_dir = tempfile.mkdtemp(dir=parent_dir)
+    try:
+        for name, template in templates.items():
+            with open(os.path.join(tmp_dir, '{}.json'.format(name)), 'w') as f:
+                f.write(template if isinstance(template, string_types) else json.dumps(template))
+        os.rename(tmp_dir, version_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        # Another run may have won the race to populate the cache
+        if not os.path.isdir(version_dir):
+            raise
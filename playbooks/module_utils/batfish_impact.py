@@ -0,0 +1,228 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Helpers for deciding which checks a snapshot change can affect.
+
+Changes are described per node as the set of config section keys that differ between a base snapshot
+and a candidate forked from it (see batfish_snapshots.config_sections).  A check is affected if it
+depends on one of those kinds of configuration, judging by its tags, on a node in its scope.
+Reachability checks between all members of a reference book group can also be narrowed down to the
+flows from and to the changed nodes, plus a sample of the others as a regression check.
+"""
+
+import copy
+import json
+import os
+import random
+import re
+
+from ansible.module_utils.batfish_refbook import device_group
+from ansible.module_utils.batfish_snapshots import config_node, is_config
+
+# Change key for anything that cannot be narrowed down, which affects every check
+OTHER = 'other'
+
+DATA_PLANE_KINDS = frozenset(['acl', 'bgp', 'interface', 'ospf', 'routing'])
+
+# Kinds of configuration that checks with each (lowercased) tag depend on
+TAG_KINDS = {
+    'acl': frozenset(['acl', 'interface']),
+    'asn': frozenset(['bgp']),
+    'bgp': frozenset(['bgp', 'interface', 'routing']),
+    'dataplane': DATA_PLANE_KINDS,
+    'ospf': frozenset(['interface', 'ospf']),
+    'reachability': DATA_PLANE_KINDS,
+}
+
+# Tags of checks whose result for a node only depends on that node's own config
+LOCAL_TAGS = frozenset(['acl'])
+
+# Locations and addresses of the interfaces in a reference book group
+_GROUP_LOCATION = re.compile(r'^enter\(\[ref\.interfacegroup\(\s*([^,\s()]+)\s*,\s*([^,\s()]+)\s*\)\]\)$')
+_GROUP_LOCATION_FORMAT = 'enter([ref.interfacegroup({}, {})])'
+_GROUP_ADDRESSES_FORMAT = 'ofLocation({})'
+
+
+def snapshot_changes(base_manifest, base_sections, manifest, sections):
+    """
+    Return the changes from a base snapshot to a candidate, as a dictionary of node name to the set of
+    changed config section keys.  Changes to files that are not device configs are recorded under
+    node None.  Only files present in the candidate manifest are compared, as when forking.
+    """
+    changes = {}
+    for rel_path, digest in manifest.items():
+        if base_manifest.get(rel_path) == digest:
+            continue
+        if not is_config(rel_path):
+            changes.setdefault(None, set()).add(OTHER)
+            continue
+        old = base_sections.get(rel_path)
+        new = sections.get(rel_path)
+        if old is None or new is None:
+            # A new device, or one whose sections are unknown
+            keys = set([OTHER])
+        else:
+            keys = set(k for k in set(old) | set(new) if old.get(k) != new.get(k))
+        changes.setdefault(config_node(rel_path), set()).update(keys)
+    return changes
+
+
+def load_checks(path):
+    """
+    Load the checks in a policy directory, returning a dictionary of check name to check definition.
+    Checks are named by their instanceName, as Batfish names their answers, not by their file name.
+    """
+    checks = {}
+    for file_name in sorted(os.listdir(path)):
+        if file_name.endswith('.json'):
+            with open(os.path.join(path, file_name)) as f:
+                check = json.load(f)
+            checks[check['instance']['instanceName']] = check
+    return checks
+
+
+def check_affected(check, changes):
+    """
+    Return True if the result of check on a candidate snapshot may differ from its result on the base
+    snapshot, given the candidate's changes.
+    """
+    changed_kinds = set(_kind(k) for keys in changes.values() for k in keys)
+    if not changed_kinds:
+        return False
+    if OTHER in changed_kinds:
+        return True
+
+    tags = set(t.lower() for t in check.get('instance', {}).get('tags', []))
+    known_tags = tags & set(TAG_KINDS)
+    if not known_tags:
+        # Nothing to narrow the check down with
+        return True
+    kinds = frozenset().union(*(TAG_KINDS[t] for t in known_tags))
+    if not kinds & changed_kinds:
+        return False
+    if not known_tags <= LOCAL_TAGS:
+        return True
+
+    # The check only looks at each node's own config, so changes outside its scope do not matter
+    nodes = _variable(check, 'nodes')
+    filters = _variable(check, 'filters')
+    for node, keys in changes.items():
+        if node is not None and nodes is not None and not _matches(nodes, node):
+            continue
+        relevant = set(k for k in keys if _kind(k) in kinds)
+        acl_names = set(k.split(':', 1)[1] for k in relevant if _kind(k) == 'acl')
+        # Only ACL changes can be excluded by the filters scope
+        if filters is not None and relevant and relevant == set('acl:' + a for a in acl_names) \
+                and not any(_matches(filters, a) for a in acl_names):
+            continue
+        if relevant:
+            return True
+    return False
+
+
+def group_reachability(check):
+    """
+    Return a tuple of (group, book) if check is a reachability check from every interface of a
+    reference book group to the addresses of every interface of the same group, or None.
+    """
+    paths = _value(check, 'pathConstraints')
+    headers = _value(check, 'headers')
+    if not isinstance(paths, dict) or not isinstance(headers, dict):
+        return None
+    match = _GROUP_LOCATION.match(paths.get('startLocation') or '')
+    if match is None:
+        return None
+    location = _GROUP_LOCATION_FORMAT.format(*match.groups())
+    if headers.get('dstIps') != _GROUP_ADDRESSES_FORMAT.format(location):
+        return None
+    return match.groups()
+
+
+def scope_nodes(changes, group, groups, sample=0, seed=None):
+    """
+    Return the sorted nodes to narrow a check over group down to for changes: the changed nodes, and
+    up to sample other nodes picked at random from seed.  The book's groups must include a group per
+    node, as named by batfish_refbook.device_group.  Returns None if the check cannot be narrowed down,
+    because a change is not on a node with members in group, or if it would not be narrower.
+    """
+    prefix = device_group(group, '')
+    group_nodes = set(g[len(prefix):] for g in groups if g.startswith(prefix) and len(g) > len(prefix))
+    changed = set(changes)
+    if not changed or not changed <= group_nodes:
+        return None
+    others = sorted(group_nodes - changed)
+    nodes = changed | set(random.Random(seed).sample(others, min(max(sample, 0), len(others))))
+    if len(nodes) == len(group_nodes):
+        return None
+    return sorted(nodes)
+
+
+def scope_reachability(check, group, book, nodes):
+    """
+    Return a dictionary of name suffix to a copy of a group_reachability check narrowed down to the
+    flows from, or to, the members of group on each of nodes.  Together, they cover every flow of the
+    check from or to those nodes.  Each copy's instanceName is the check's followed by its suffix, so
+    Batfish answers them separately.
+    """
+    name = check['instance']['instanceName']
+    scoped = {}
+    for node in nodes:
+        location = _GROUP_LOCATION_FORMAT.format(device_group(group, node), book)
+        from_node = copy.deepcopy(check)
+        _value(from_node, 'pathConstraints')['startLocation'] = location
+        scoped['@from-{}'.format(node)] = from_node
+        to_node = copy.deepcopy(check)
+        _value(to_node, 'headers')['dstIps'] = _GROUP_ADDRESSES_FORMAT.format(location)
+        scoped['@to-{}'.format(node)] = to_node
+    for suffix, scoped_check in scoped.items():
+        scoped_check['instance']['instanceName'] = '{} {}'.format(name, suffix)
+    return scoped
+
+
+def _kind(key):
+    return key.split(':', 1)[0]
+
+
+def _variable(check, name):
+    """
+    Return the regex a check uses for variable name, or None if it applies to everything.
+    """
+    value = check.get(name)
+    if isinstance(value, dict) or value is None:
+        return None
+    if value.startswith('${'):
+        value = check.get('instance', {}).get('variables', {}).get(name, {}).get('value')
+    if not value or value == '.*':
+        return None
+    return value
+
+
+def _value(check, name):
+    """
+    Return the value of check parameter name, following it to the variable it refers to, if any.
+    """
+    value = check.get(name)
+    if isinstance(value, dict) or value is None or not value.startswith('${'):
+        return value
+    return check.get('instance', {}).get('variables', {}).get(name, {}).get('value')
+
+
+def _matches(regex, name):
+    try:
+        # As in Batfish, node and filter names are matched case-insensitively
+        return re.match('(?:{})$'.format(regex), name, re.IGNORECASE) is not None
+    except re.error:
+        # Batfish specifiers that are not plain regexes; assume they match
+        return True
@@ -0,0 +1,86 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Reference book contents derived from the source of truth (SOT), the device JSON files in inputs/.
+
+Host-facing interfaces are the active interfaces the SOT describes as "hosts", and host subnets are
+listed per device.  Besides a group of all of them, the book holds one group per device, named by
+device_group, so a check over a whole group can be narrowed to some devices (see batfish_impact).
+Only the standard library is needed, so demo-setup.py can build the book without Ansible.
+"""
+
+import json
+import os
+
+HOST_DESCRIPTION = 'hosts'
+
+HOST_INTERFACES_GROUP = 'host_interfaces'
+HOST_SUBNETS_GROUP = 'host_subnets'
+
+
+def load_devices(inputs_dir):
+    """
+    Load the SOT of every device in inputs_dir, returning a dictionary of hostname to device attributes.
+    Files that do not describe a device, such as acls.json, are skipped.
+    """
+    devices = {}
+    for file_name in sorted(os.listdir(inputs_dir)):
+        if not file_name.endswith('.json'):
+            continue
+        with open(os.path.join(inputs_dir, file_name)) as f:
+            device = json.load(f)
+        if isinstance(device, dict) and device.get('hostname'):
+            devices[device['hostname']] = device
+    return devices
+
+
+def host_interfaces(devices):
+    """
+    Return the sorted (hostname, interface) tuples of the active interfaces of devices facing hosts.
+    """
+    return sorted((hostname, i['name']) for hostname, device in devices.items()
+                  for i in device.get('active_interfaces', [])
+                  if i.get('description', '').strip().lower() == HOST_DESCRIPTION)
+
+
+def host_subnets(devices):
+    """
+    Return a dictionary of hostname to the sorted host subnets of the device, as prefixes.
+    """
+    return dict((hostname, sorted('{}/{}'.format(s['network'], _prefix_length(s['mask']))
+                                  for s in device.get('host_subnets', [])))
+                for hostname, device in devices.items() if device.get('host_subnets'))
+
+
+def device_group(group, hostname):
+    """
+    Return the name of the group holding the members of group on device hostname.
+    """
+    return '{}_{}'.format(group, hostname)
+
+
+def group_by_device(group, members):
+    """
+    Return a dictionary of group name to members for group and for each device's share of it, given
+    members as (hostname, member) tuples.
+    """
+    groups = {group: sorted(members)}
+    for hostname, member in members:
+        groups.setdefault(device_group(group, hostname), []).append((hostname, member))
+    return dict((k, sorted(v)) for k, v in groups.items())
+
+
+def _prefix_length(mask):
+    return sum(bin(int(octet)).count('1') for octet in mask.split('.'))
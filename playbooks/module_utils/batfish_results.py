@@ -0,0 +1,300 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Compact storage for validation results, written and read a block of rows at a time.
+
+A results file is a compressed JSON lines file.  Its first line holds the format version and the
+summary of the results: everything but their row tables.  Each following line holds a block of rows
+of one table, stored by column, so column names are not repeated for every row and similar values
+sit together, which compresses well.  A table is named by its path of keys in the results, such as
+(policy, check).  Rows that are not dictionaries are stored as a dictionary with a single "value" key,
+and keys missing from some rows of a block read back as None.
+
+Only the standard library is needed to write gzip or uncompressed files and to read them, so results
+can be analyzed without Ansible.  zstd compression needs the zstandard package.
+"""
+
+import gzip
+import io
+import json
+import os
+import tempfile
+from itertools import groupby
+
+FORMAT = 'batfish-results'
+VERSION = 1
+
+# Number of rows stored in each block
+BLOCK_ROWS = 1000
+
+COMPRESSIONS = ['gzip', 'none', 'zstd']
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class ResultsWriter(object):
+    """
+    Writes a results file at path: the summary first, then the rows of each table.
+    The file only appears at path once the writer is closed without error.
+    If upload is given, the file's bytes are also written to it as they are produced, and it is aborted
+    if writing fails, like a multipart_upload.MultipartUpload.  Closing it is left to the caller.
+    """
+
+    def __init__(self, path, summary, compression='gzip', block_rows=BLOCK_ROWS, upload=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError('Unsupported compression {}, expected one of: {}'.format(
+                compression, ', '.join(COMPRESSIONS)))
+        self.path = path
+        self.block_rows = max(block_rows, 1)
+        self.tables = []
+        dir_name = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+        fd, self._tmp_path = tempfile.mkstemp(dir=dir_name)
+        self._raw = os.fdopen(fd, 'wb')
+        self._upload = upload
+        try:
+            self._out = _compressed_writer(_Tee(self._raw, upload) if upload is not None else self._raw,
+                                           compression)
+            self._write_line(dict(format=FORMAT, version=VERSION, summary=summary))
+        except Exception:
+            self._discard()
+            raise
+
+    def write_table(self, table, rows):
+        """
+        Write the rows of table, a list of keys, from any iterable of rows.  Returns the number of rows.
+        """
+        count = 0
+        block = []
+        for row in rows:
+            block.append(row if isinstance(row, dict) else dict(value=row))
+            if len(block) == self.block_rows:
+                self._write_block(table, block)
+                count += len(block)
+                block = []
+        # Empty tables get an empty block, so readers still list them
+        if block or not count:
+            self._write_block(table, block)
+            count += len(block)
+        self.tables.append((list(table), count))
+        return count
+
+    def close(self):
+        try:
+            self._out.close()
+            self._raw.close()
+            os.chmod(self._tmp_path, 0o644)
+            os.rename(self._tmp_path, self.path)
+        except Exception:
+            self._discard()
+            raise
+
+    def _discard(self):
+        self._raw.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+        if self._upload is not None:
+            self._upload.abort()
+
+    def _write_block(self, table, block):
+        columns = sorted(set(k for row in block for k in row))
+        self._write_line(dict(table=list(table), rows=len(block), columns=columns,
+                              data=[[row.get(c) for row in block] for c in columns]))
+
+    def _write_line(self, value):
+        self._out.write(json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8') + b'\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._out = None
+            self._discard()
+
+
+class ResultsReader(object):
+    """
+    Reads a results file written by ResultsWriter, whatever its compression.
+    The summary is read on opening; rows are read from the file on demand, a block at a time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._open() as f:
+            header = json.loads(f.readline().decode('utf-8'))
+        if header.get('format') != FORMAT:
+            raise ValueError('{} is not a results file'.format(path))
+        if header.get('version', 0) > VERSION:
+            raise ValueError('{} has unsupported version {}'.format(path, header.get('version')))
+        self.summary = header['summary']
+
+    def tables(self):
+        """
+        Return a list of (table, number of rows) tuples, in file order.
+        """
+        counts = []
+        index = {}
+        for block in self._blocks():
+            key = tuple(block['table'])
+            if key not in index:
+                index[key] = len(counts)
+                counts.append([key, 0])
+            counts[index[key]][1] += block['rows']
+        return [tuple(c) for c in counts]
+
+    def rows(self, table=None):
+        """
+        Generate the rows of table, or (table, row) tuples of all tables if table is None.
+        """
+        for block in self._blocks(table):
+            columns = block['columns']
+            for i in range(block['rows']):
+                row = dict((c, values[i]) for c, values in zip(columns, block['data']))
+                yield row if table is not None else (tuple(block['table']), row)
+
+    def column_names(self, table):
+        """
+        Return the sorted names of the columns of table.
+        """
+        return sorted(set(c for block in self._blocks(table) for c in block['columns']))
+
+    def columns(self, table):
+        """
+        Return a dictionary of each column of table to the list of its values, one per row.
+        """
+        count = 0
+        result = {}
+        for block in self._blocks(table):
+            for column, values in zip(block['columns'], block['data']):
+                result.setdefault(column, [None] * count).extend(values)
+            count += block['rows']
+            for values in result.values():
+                values.extend([None] * (count - len(values)))
+        return result
+
+    def _blocks(self, table=None):
+        wanted = list(table) if table is not None else None
+        with self._open() as f:
+            f.readline()
+            for line in f:
+                block = json.loads(line.decode('utf-8'))
+                if wanted is None or block['table'] == wanted:
+                    yield block
+
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            magic = f.read(4)
+        if magic.startswith(_GZIP_MAGIC):
+            return gzip.open(self.path, 'rb')
+        if magic.startswith(_ZSTD_MAGIC):
+            import zstandard
+            raw = open(self.path, 'rb')
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True))
+        return open(self.path, 'rb')
+
+
+def result_tables(results, key='result_verbose'):
+    """
+    Split results into their summary, without results[key], and a list of (table, rows) tuples
+    for each list of rows under results[key], found by following nested dictionaries.
+    """
+    summary = dict((k, v) for k, v in results.items() if k != key)
+    tables = []
+
+    def walk(path, value):
+        if isinstance(value, dict):
+            for k in sorted(value):
+                walk(path + [k], value[k])
+        elif isinstance(value, list):
+            tables.append((path, value))
+        elif value not in (None, ''):
+            # Neither a table nor empty, keep it with the summary
+            summary.setdefault(key, {})['/'.join(path)] = value
+
+    walk([], results.get(key, {}))
+    return summary, tables
+
+
+def rows_file_tables(name, path):
+    """
+    Generate a (table, rows) tuple for each table in a JSON lines rows file, as written by the Batfish
+    modules' rows_dir option, read a line at a time.  The rows of a policy's file are tagged with the
+    name of their check, and make a table (name, check) for each check; other files make a table (name,).
+    Each table's rows must be read before moving to the next table.
+    """
+    def check(line):
+        return line['check'] if isinstance(line, dict) and sorted(line) == ['check', 'row'] else None
+
+    with open(path) as f:
+        lines = (json.loads(line) for line in f if line.strip())
+        for check_name, group in groupby(lines, check):
+            if check_name is None:
+                yield [name], group
+            else:
+                yield [name, check_name], (line['row'] for line in group)
+
+
+def table_name(table):
+    """
+    Return a display name for a table.
+    """
+    return ' / '.join('{}'.format(k) for k in table)
+
+
+def _compressed_writer(raw, compression):
+    if compression == 'gzip':
+        # No file name or time in the header, so the same results always compress to the same bytes
+        return gzip.GzipFile(filename='', fileobj=raw, mode='wb', mtime=0)
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor().stream_writer(raw)
+    return _Uncompressed(raw)
+
+
+class _Tee(object):
+    # Closing is left to the writer, which closes each output in turn
+
+    def __init__(self, *outputs):
+        self.outputs = outputs
+
+    def write(self, data):
+        for output in self.outputs:
+            output.write(data)
+        return len(data)
+
+    def flush(self):
+        for output in self.outputs:
+            output.flush()
+
+    def close(self):
+        pass
+
+
+class _Uncompressed(object):
+    # Closing is left to the writer, as for the compressed streams
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def write(self, data):
+        self.raw.write(data)
+
+    def close(self):
+        self.raw.flush()
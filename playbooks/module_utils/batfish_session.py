@@ -0,0 +1,159 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Session layer shared by the Batfish modules.
+
+Every module run is a new process, so by default the modules do not use Pybatfish directly.  They
+send each operation to a long-lived helper process over a Unix socket instead.  The helper keeps the
+network set, the question templates loaded and Pybatfish's HTTP connections open between module
+runs, and exits once it has been idle for a while.  One helper is started per Batfish host and
+network, the first time a module needs it, and per version of the helper's code, so modules never
+talk to a helper left running by older code, which would not know their newer operations.
+
+This module only holds the client side, which is all most module runs need.  The helper, and the
+in-process session it serves, are in batfish_helper, which is only imported to start a helper or
+when the session is not persistent.
+"""
+
+import hashlib
+import json
+import os
+import socket
+from contextlib import closing
+
+from ansible.module_utils.batfish_timings import Timings
+
+SESSION_DIR = '~/.batfish/sessions'
+
+# Operation arguments that are local paths, made absolute before being sent to a session helper
+PATH_ARGS = ['add_files', 'cache_dir', 'path', 'rows_file']
+
+# Sources of the code a session helper runs, whose digest is part of its socket path
+HELPER_SOURCES = ['batfish_answers.py', 'batfish_helper.py', 'batfish_session.py']
+
+# Prefix of the status of the load_questions operation when question templates could not be cached
+CACHE_FAILED = 'failed: '
+
+_helper_version = None
+
+
+class BatfishSessionError(Exception):
+    pass
+
+
+def connect(host, network, persistent=True, timings=None):
+    """
+    Return a session for network on the Batfish service running on host.
+    If persistent, the session is served by a helper process, which is started if it is not running.
+    If timings is given, a batfish_timings.Timings, the session records its phases and traffic in it.
+    """
+    if not persistent or not hasattr(socket, 'AF_UNIX'):
+        from ansible.module_utils.batfish_helper import LocalSession
+        return LocalSession(host, network, timings)
+
+    client = SessionClient(session_socket_path(host, network), timings)
+    if client.ping():
+        return client
+
+    import fcntl
+    from ansible.module_utils.batfish_helper import LocalSession, start_helper
+    session_dir = os.path.dirname(client.socket_path)
+    if not os.path.isdir(session_dir):
+        os.makedirs(session_dir, 0o700)
+    # Only one module run should start the helper
+    with open(os.path.splitext(client.socket_path)[0] + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not client.ping():
+            start_helper(LocalSession(host, network, timings), client.socket_path)
+            if not client.ping():
+                raise BatfishSessionError('Session helper did not start')
+    return client
+
+
+def session_socket_path(host, network):
+    """
+    Return the path of the Unix socket of the session helper for network on host, running the current
+    version of the helper's code.
+    """
+    key = hashlib.sha1('{}\0{}\0{}'.format(host, network, helper_version()).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(os.path.expanduser(SESSION_DIR), '{}.sock'.format(key))
+
+
+def helper_version():
+    """
+    Return a digest of the source of the session helper's code, computed once per process.
+    """
+    global _helper_version
+    if _helper_version is None:
+        digest = hashlib.sha1()
+        dir_name = os.path.dirname(os.path.abspath(__file__))
+        # Modules run by Ansible import this from a zip file, which only its loader can read
+        loader = globals().get('__loader__')
+        for name in HELPER_SOURCES:
+            file_path = os.path.join(dir_name, name)
+            try:
+                if hasattr(loader, 'get_data'):
+                    data = loader.get_data(file_path)
+                else:
+                    with open(file_path, 'rb') as f:
+                        data = f.read()
+            except (IOError, OSError):
+                data = b''
+            digest.update(name.encode('utf-8') + b'\0' + data)
+        _helper_version = digest.hexdigest()[:16]
+    return _helper_version
+
+
+class SessionClient(object):
+    """
+    Runs Batfish operations in a session helper process, over its Unix socket.
+    """
+
+    def __init__(self, socket_path, timings=None):
+        self.socket_path = socket_path
+        self.network = None
+        self.timings = timings or Timings(enabled=False)
+
+    def call(self, op, **kwargs):
+        # The helper runs in a different working directory
+        for k in PATH_ARGS:
+            if kwargs.get(k):
+                kwargs[k] = os.path.abspath(os.path.expanduser(kwargs[k]))
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            request = json.dumps(dict(op=op, kwargs=kwargs)).encode('utf-8') + b'\n'
+            sock.sendall(request)
+            with closing(sock.makefile('rb')) as f:
+                line = f.readline()
+            response = json.loads(line.decode('utf-8'))
+        finally:
+            sock.close()
+        self.timings.count('requests')
+        self.timings.count('bytes_sent', len(request))
+        self.timings.count('bytes_received', len(line))
+        if 'error' in response:
+            raise BatfishSessionError(response['error'])
+        return response['value']
+
+    def ping(self):
+        """
+        Return True if the session helper is up, recording the network it has set.
+        """
+        try:
+            self.network = self.call('ping')
+        except (socket.error, ValueError):
+            return False
+        return True
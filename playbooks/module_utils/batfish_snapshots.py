@@ -0,0 +1,295 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Helpers for identifying snapshot contents, shared by the Batfish modules.
+
+Snapshots are identified by a hash over the files in their directory, and a local index maps those
+hashes to the snapshots already uploaded to the Batfish service.  The index also records a hash of
+each section of every device config, so changes between snapshots can be narrowed down to the kind
+of configuration that changed.  Candidate snapshots are named after the time they were created, which
+their retention is based on.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+# Kind of configuration held by top-level config sections, by the start of the section's first line.
+# Sections not listed here are of kind 'other'.
+SECTION_KINDS = [
+    ('ip access-list ', 'acl'),
+    ('access-list ', 'acl'),
+    ('router bgp ', 'bgp'),
+    ('router ospf ', 'ospf'),
+    ('interface ', 'interface'),
+    ('ip route ', 'routing'),
+    ('ip prefix-list ', 'routing'),
+    ('ip community-list ', 'routing'),
+    ('ip as-path ', 'routing'),
+    ('ip vrf ', 'routing'),
+    ('route-map ', 'routing'),
+    ('router ', 'routing'),
+    ('aaa ', 'management'),
+    ('banner ', 'management'),
+    ('boot-', 'management'),
+    ('control-plane', 'management'),
+    ('ip domain ', 'management'),
+    ('ip http ', 'management'),
+    ('ip ssh ', 'management'),
+    ('line ', 'management'),
+    ('logging ', 'management'),
+    ('no ip domain ', 'management'),
+    ('no ip http ', 'management'),
+    ('ntp ', 'management'),
+    ('service ', 'management'),
+    ('snmp-server ', 'management'),
+    ('tacacs ', 'management'),
+    ('username ', 'management'),
+]
+
+# Format of the time in candidate snapshot names, <prefix>_<time>, as made by create_candidate_snapshot.yml
+SNAPSHOT_TIME_FORMAT = '%Y-%m-%d-%H-%M-%S'
+
+
+def hash_file(path):
+    """
+    Return the hex SHA-256 digest of the contents of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_snapshot_dir(path):
+    """
+    Hash every file under a snapshot directory (configs/, interface_blacklist, etc.).
+    Returns a tuple of (digest, manifest), where manifest maps each file's path relative to the
+    directory to its own digest.  The digest only depends on file names and contents.
+    """
+    manifest = {}
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in files:
+            full_path = os.path.join(root, name)
+            rel_path = os.path.relpath(full_path, path).replace(os.sep, '/')
+            manifest[rel_path] = hash_file(full_path)
+    digest = hashlib.sha256()
+    for rel_path in sorted(manifest):
+        digest.update('{}\0{}\n'.format(rel_path, manifest[rel_path]).encode('utf-8'))
+    return digest.hexdigest(), manifest
+
+
+def snapshot_key(content_hash, base_name=None, deactivate_missing=False):
+    """
+    Return the index key for a snapshot with the given content, optionally forked from base_name.
+    If deactivate_missing, the fork also deactivates the base snapshot's nodes missing from the content,
+    so it differs from a fork of the same content that keeps them.
+    """
+    if base_name is None:
+        return content_hash
+    key = '{}\0{}'.format(base_name, content_hash)
+    if deactivate_missing:
+        key += '\0deactivate_missing'
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def load_index(path):
+    """
+    Load the snapshot index at path, returning an empty index if it does not exist yet.
+    The index maps network name to a dictionary of snapshot key to snapshot entry.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_index(path, index):
+    """
+    Atomically replace the snapshot index at path.
+    """
+    index_dir = os.path.dirname(path)
+    if index_dir and not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=index_dir or '.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def find_snapshot(index, network, key):
+    """
+    Return the name of the snapshot in network whose contents match key, or None.
+    """
+    entry = index.get(network, {}).get(key)
+    return entry['name'] if entry else None
+
+
+def forget_snapshot(index, network, name):
+    """
+    Drop index entries for snapshot name, and for any snapshot forked from it, since their
+    recorded contents no longer match once name is overwritten or deleted.
+    """
+    entries = index.get(network, {})
+    for key in [k for k, v in entries.items() if name in (v['name'], v.get('base_name'))]:
+        del entries[key]
+
+
+def find_entry(index, network, name):
+    """
+    Return a tuple of (key, entry) for snapshot name in network, or (None, None) if it is not indexed.
+    """
+    return next(((k, v) for k, v in index.get(network, {}).items() if v['name'] == name), (None, None))
+
+
+def record_snapshot(index, network, key, name, base_name=None, manifest=None, sections=None,
+                    deactivated_nodes=None):
+    """
+    Record that snapshot name in network was created with contents matching key, and with
+    deactivated_nodes of its base snapshot deactivated if forked.
+    """
+    forget_snapshot(index, network, name)
+    index.setdefault(network, {})[key] = dict(name=name, base_name=base_name, manifest=manifest or {},
+                                              sections=sections or {}, deactivated_nodes=deactivated_nodes or [])
+
+
+def snapshot_bases(index, network=None):
+    """
+    Return the set of names of the snapshots in network that indexed snapshots were forked from, or in
+    any network if network is None, so a network that could not be resolved errs on keeping snapshots.
+    """
+    networks = [index.get(network, {})] if network is not None else index.values()
+    return set(v['base_name'] for entries in networks for v in entries.values() if v.get('base_name'))
+
+
+def snapshot_time(name, prefix):
+    """
+    Return the time in the name of a snapshot named <prefix>_<time>, as a datetime, or None if the
+    snapshot is not named that way.
+    """
+    if not name.startswith(prefix + '_'):
+        return None
+    try:
+        return datetime.strptime(name[len(prefix) + 1:], SNAPSHOT_TIME_FORMAT)
+    except ValueError:
+        return None
+
+
+def expired_snapshots(names, prefixes, keep_last=None, max_age=None, pinned=(), now=None):
+    """
+    Return the sorted names of the snapshots whose retention has expired, out of names.  For each
+    prefix, the snapshots named after it expire unless they are among the keep_last most recent, and
+    once their name is more than max_age seconds older than now, if given.  Pinned snapshots and
+    snapshots not named after a prefix never expire, and pinned snapshots do not count in keep_last.
+    """
+    now = now or datetime.now()
+    expired = set()
+    for prefix in prefixes:
+        timed = [(snapshot_time(n, prefix), n) for n in names if n not in pinned]
+        for i, (t, n) in enumerate(sorted(((t, n) for t, n in timed if t is not None), reverse=True)):
+            if keep_last is not None and i >= keep_last:
+                expired.add(n)
+            elif max_age is not None and now - t > timedelta(seconds=max_age):
+                expired.add(n)
+    return sorted(expired)
+
+
+def snapshot_manifest(index, network, name, field='manifest'):
+    """
+    Return the manifest of all files in snapshot name, or None if its contents are not known.
+    A forked snapshot's manifest is its base snapshot's manifest overlaid with the files added to it.
+    With field='sections', returns the config section hashes of all files in the same way.
+    """
+    _, entry = find_entry(index, network, name)
+    if entry is None:
+        return None
+    manifest = {}
+    if entry.get('base_name') is not None:
+        manifest = snapshot_manifest(index, network, entry['base_name'], field)
+        if manifest is None:
+            return None
+    manifest.update(entry.get(field, {}))
+    return manifest
+
+
+def diff_manifests(base, candidate):
+    """
+    Compare a candidate manifest against a base manifest.
+    Returns a tuple of (changed, missing): files in candidate that are new or differ from base, and
+    files in base that are not in candidate, both sorted.
+    """
+    changed = sorted(k for k, v in candidate.items() if base.get(k) != v)
+    missing = sorted(k for k in base if k not in candidate)
+    return changed, missing
+
+
+def config_sections(path):
+    """
+    Hash the top-level sections of an IOS-style device config, grouped by the kind of configuration
+    they hold.  Returns a dictionary of section key to hash, where the key is the kind from
+    SECTION_KINDS, or 'acl:<name>' for ACLs so that changed ACLs can be identified by name.
+    """
+    digests = {}
+    key = None
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('!') or line == 'end':
+                continue
+            if not line[0].isspace():
+                key = _section_key(line)
+            digests.setdefault(key, hashlib.sha256()).update((line + '\n').encode('utf-8'))
+    return {k: v.hexdigest() for k, v in digests.items()}
+
+
+def snapshot_sections(path, manifest):
+    """
+    Return the config section hashes of each device config in manifest, relative to path.
+    """
+    return {k: config_sections(os.path.join(path, k)) for k in manifest if is_config(k)}
+
+
+def is_config(rel_path):
+    """
+    Return True if the snapshot file at rel_path is a device config.
+    """
+    return rel_path.startswith('configs/')
+
+
+def config_node(rel_path):
+    """
+    Return the node name for a device config, assuming the file is named after its node
+    (e.g. configs/lhr-leaf-01.cfg).
+    """
+    return os.path.splitext(os.path.basename(rel_path))[0]
+
+
+def _section_key(line):
+    kind = next((k for prefix, k in SECTION_KINDS if line.startswith(prefix)), 'other')
+    if kind == 'acl':
+        words = line.split()
+        # ip access-list [extended|standard] NAME, or access-list NUMBER ...
+        name = words[1] if words[0] == 'access-list' else words[-1]
+        return 'acl:{}'.format(name)
+    return kind
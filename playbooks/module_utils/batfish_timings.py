@@ -0,0 +1,165 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Opt-in instrumentation for the Batfish modules.
+
+A Timings object records the seconds spent in each phase of a module run, and counters such as the
+bytes exchanged with the session helper or the number of answer rows, into the dictionary a module
+returns as its timings result.  The run can also be profiled with cProfile, and the timings written
+as an OpenMetrics text file for a local scraper, such as the node exporter's textfile collector.
+"""
+
+import atexit
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from ansible.module_utils.six import string_types
+
+# Not affected by changes to the system clock, where available
+_clock = getattr(time, 'monotonic', time.time)
+
+METRIC_PREFIX = 'batfish_module'
+
+
+class Timings(object):
+    """
+    Records phase timings and counters into values, if enabled.  Safe to use from several threads.
+    """
+
+    def __init__(self, values=None, enabled=True):
+        self.values = values if values is not None else {}
+        self.enabled = enabled
+        self.counters = set()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time the enclosed block as phase name.  The time of phases run more than once is summed.
+        """
+        start = _clock()
+        try:
+            yield
+        finally:
+            self._add(name, _clock() - start)
+
+    def count(self, name, value=1):
+        """
+        Add value to counter name.
+        """
+        with self._lock:
+            self.counters.add(name)
+        self._add(name, value)
+
+    def set(self, name, value):
+        if self.enabled:
+            with self._lock:
+                self.values[name] = value
+
+    def _add(self, name, value):
+        if self.enabled:
+            with self._lock:
+                self.values[name] = self.values.get(name, 0) + value
+
+
+def instrument(timings, module_name, labels=None, profile_path=None, metrics_path=None):
+    """
+    Profile the rest of the module run into profile_path, and write the timings as OpenMetrics text to
+    metrics_path, once the module exits.  Either path may be None.  Only the calling thread is profiled.
+    """
+    profiler = None
+    if profile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def finish():
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.expanduser(profile_path))
+        if metrics_path:
+            write_metrics(os.path.expanduser(metrics_path), format_metrics(timings, module_name, labels))
+
+    # Modules exit through exit_json or fail_json, after their result has been written
+    atexit.register(finish)
+
+
+def format_metrics(timings, module_name, labels=None):
+    """
+    Return the timings as OpenMetrics text: one gauge for phase seconds and one for counters.
+    String values, such as whether a cache was hit, become labels of an info gauge.
+    """
+    labels = dict(labels or {}, module=module_name)
+    values = dict(timings.values)
+    phases = sorted(k for k, v in values.items() if k not in timings.counters and not isinstance(v, string_types))
+    counters = sorted(k for k in values if k in timings.counters)
+    info = sorted(k for k, v in values.items() if isinstance(v, string_types))
+
+    lines = [
+        '# HELP {}_phase_seconds Seconds spent in each phase of the last module run.'.format(METRIC_PREFIX),
+        '# TYPE {}_phase_seconds gauge'.format(METRIC_PREFIX),
+    ]
+    lines.extend('{}_phase_seconds{} {}'.format(METRIC_PREFIX, _labels(labels, phase=k), _number(values[k]))
+                 for k in phases)
+    lines.extend([
+        '# HELP {}_count Bytes, rows and other quantities handled by the last module run.'.format(METRIC_PREFIX),
+        '# TYPE {}_count gauge'.format(METRIC_PREFIX),
+    ])
+    lines.extend('{}_count{} {}'.format(METRIC_PREFIX, _labels(labels, name=k), _number(values[k]))
+                 for k in counters)
+    lines.extend([
+        '# HELP {}_last_run_info String values of the last module run, as labels.'.format(METRIC_PREFIX),
+        '# TYPE {}_last_run_info gauge'.format(METRIC_PREFIX),
+        '{}_last_run_info{} 1'.format(METRIC_PREFIX, _labels(labels, **{k: values[k] for k in info})),
+        '# HELP {}_last_run_timestamp_seconds Time the last module run finished.'.format(METRIC_PREFIX),
+        '# TYPE {}_last_run_timestamp_seconds gauge'.format(METRIC_PREFIX),
+        '{}_last_run_timestamp_seconds{} {}'.format(METRIC_PREFIX, _labels(labels), _number(time.time())),
+        '# EOF',
+    ])
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(labels, **extra):
+    items = sorted(dict(labels, **extra).items())
+    return '{' + ','.join('{}="{}"'.format(k, _escape(v)) for k, v in items) + '}'
+
+
+def _escape(value):
+    return '{}'.format(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else '{}'.format(value)
+
+
+def write_metrics(path, text):
+    """
+    Replace the file at path with text atomically, so a scraper never reads a partial file.
+    """
+    dir_name = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(dir_name):
+        os.makedirs(dir_name)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
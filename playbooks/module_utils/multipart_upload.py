@@ -0,0 +1,231 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Uploads to S3, or any S3-compatible service, as the data is produced.
+
+A MultipartUpload is written to like a file.  Each part is uploaded by a pool of threads as soon as it
+is full, so uploading overlaps producing the data, and only a few parts are held in memory at once.
+Uploaded objects are tagged with the SHA-256 digest of their contents, so an upload whose contents
+are already in the bucket can be skipped: before it starts when uploading a file, or by aborting it
+when streaming.  Needs boto3.
+"""
+
+import hashlib
+import threading
+
+from ansible.module_utils.six.moves import queue
+
+# S3 rejects parts smaller than 5MiB, other than the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+DIGEST_TAG = 'sha256'
+
+
+def s3_client(s3_url=None, region=None):
+    """
+    Return a boto3 S3 client, for the S3-compatible service at s3_url if given, such as a local
+    stand-in for tests.  Credentials are found by boto3 as usual, from the environment or profile.
+    """
+    import boto3
+    return boto3.client('s3', endpoint_url=s3_url or None, region_name=region or None)
+
+
+class MultipartUpload(object):
+    """
+    Uploads the bytes written to it to key in bucket, using up to workers threads.
+    Data smaller than one part is uploaded with a single request when the upload is closed.
+    If dedup is set and the object already holds the same contents, nothing is replaced.
+    After close, skipped tells whether the upload was skipped and sha256 is the digest of the contents.
+    """
+
+    def __init__(self, client, bucket, key, part_size=DEFAULT_PART_SIZE, workers=4, dedup=False,
+                 content_type='application/octet-stream'):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.workers = max(workers, 1)
+        self.dedup = dedup
+        self.content_type = content_type
+        self.skipped = False
+        self.sha256 = None
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._buffer = []
+        self._buffered = 0
+        self._upload_id = None
+        self._part_count = 0
+        self._parts = {}
+        self._errors = []
+        self._queue = None
+        self._threads = []
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        self._buffer.append(data)
+        self._buffered += len(data)
+        while self._buffered >= self.part_size:
+            data = b''.join(self._buffer)
+            self._buffer = [data[self.part_size:]]
+            self._buffered = len(self._buffer[0])
+            self._send(data[:self.part_size])
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """
+        Upload the remaining data and complete the upload.  On failure, the upload is aborted.
+        """
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self.sha256 = self._digest.hexdigest()
+        try:
+            if self._upload_id is None:
+                self._close_small(data)
+                return
+            if data:
+                self._send(data)
+            self._wait()
+            if self.dedup and object_digest(self.client, self.bucket, self.key) == self.sha256:
+                self.skipped = True
+                self.abort()
+                return
+            parts = [dict(PartNumber=n, ETag=self._parts[n]) for n in sorted(self._parts)]
+            self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                                  MultipartUpload=dict(Parts=parts))
+            self.client.put_object_tagging(Bucket=self.bucket, Key=self.key, Tagging=_tagging(self.sha256))
+        except Exception:
+            self.abort()
+            raise
+
+    def abort(self):
+        """
+        Abort the upload, leaving any existing object in place.
+        """
+        self._stop()
+        if self._upload_id is not None:
+            upload_id, self._upload_id = self._upload_id, None
+            try:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=upload_id)
+            except Exception:
+                # Incomplete uploads are also removed by the bucket's lifecycle rules, if any
+                pass
+
+    def _close_small(self, data):
+        if self.dedup and object_digest(self.client, self.bucket, self.key) == self.sha256:
+            self.skipped = True
+            return
+        self.client.put_object(Bucket=self.bucket, Key=self.key, Body=data, ContentType=self.content_type,
+                               Tagging='{}={}'.format(DIGEST_TAG, self.sha256))
+
+    def _send(self, data):
+        if self._upload_id is None:
+            response = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                           ContentType=self.content_type)
+            self._upload_id = response['UploadId']
+            # Bounded, so writing blocks rather than buffering parts faster than they are uploaded
+            self._queue = queue.Queue(self.workers)
+            for _ in range(self.workers):
+                t = threading.Thread(target=self._upload_parts)
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+        if self._errors:
+            raise self._errors[0]
+        self._part_count += 1
+        self._queue.put((self._part_count, data))
+
+    def _upload_parts(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            number, data = item
+            try:
+                # Once a part failed the upload is aborted, the remaining parts are dropped
+                if not self._errors:
+                    response = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                                       PartNumber=number, Body=data)
+                    self._parts[number] = response['ETag']
+            except Exception as e:
+                self._errors.append(e)
+
+    def _wait(self):
+        self._stop()
+        if self._errors:
+            raise self._errors[0]
+
+    def _stop(self):
+        if self._queue is not None:
+            for _ in self._threads:
+                self._queue.put(None)
+            for t in self._threads:
+                t.join()
+            self._threads = []
+            self._queue = None
+
+
+def object_digest(client, bucket, key):
+    """
+    Return the SHA-256 digest an object was tagged with when uploaded, or None if it does not exist
+    or was not tagged.
+    """
+    try:
+        tags = client.get_object_tagging(Bucket=bucket, Key=key)['TagSet']
+    except Exception:
+        return None
+    return next((t['Value'] for t in tags if t['Key'] == DIGEST_TAG), None)
+
+
+def upload_file(client, bucket, key, path, part_size=DEFAULT_PART_SIZE, workers=4, dedup=False,
+                content_type='application/octet-stream'):
+    """
+    Upload the file at path to key in bucket, in parts uploaded in parallel.  If dedup is set, the
+    file is hashed first and not uploaded at all if the object already holds the same contents.
+    Returns the MultipartUpload, closed.
+    """
+    upload = MultipartUpload(client, bucket, key, part_size, workers, content_type=content_type)
+    if dedup:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        if object_digest(client, bucket, key) == digest.hexdigest():
+            upload.skipped = True
+            upload.sha256 = digest.hexdigest()
+            return upload
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                upload.write(chunk)
+    except Exception:
+        upload.abort()
+        raise
+    upload.close()
+    return upload
+
+
+def object_url(client, bucket, key, expiry=600):
+    """
+    Return a presigned URL to download an object for expiry seconds.  Signed locally, no request is made.
+    """
+    return client.generate_presigned_url('get_object', Params=dict(Bucket=bucket, Key=key), ExpiresIn=expiry)
+
+
+def _tagging(digest):
+    return dict(TagSet=[dict(Key=DIGEST_TAG, Value=digest)])
@@ -0,0 +1,260 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+An indexed local store of the source of truth (SOT), the JSON files in inputs/.
+
+The files of an inputs directory are compiled into a SQLite database, so a device is found by hostname
+without opening its file, and cross-device questions (which devices have BGP AS X, which device owns
+address Y, which devices peer with device Z, which interfaces use ACL W) are answered from indexes
+instead of by reading every file.  Each file is stored whole, so reading a device returns exactly its
+JSON, and the indexed tables are derived from it.  refresh() only reloads the files whose modification
+time or size changed since the last refresh, and drops those that were removed.
+
+Only the standard library is needed, so scripts can query the store without Ansible.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+DEFAULT_STORE_DIR = '~/.batfish/sot'
+
+# Bumped whenever the schema changes, so older stores are rebuilt rather than misread
+SCHEMA_VERSION = 1
+
+_SCHEMA = [
+    'CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE files (name TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, data TEXT)',
+    'CREATE TABLE devices (hostname TEXT PRIMARY KEY, file TEXT, bgp_as TEXT)',
+    'CREATE INDEX devices_bgp_as ON devices (bgp_as)',
+    'CREATE INDEX devices_file ON devices (file)',
+    'CREATE TABLE interfaces (hostname TEXT, name TEXT, ip_addr TEXT, description TEXT, active INTEGER)',
+    'CREATE INDEX interfaces_hostname ON interfaces (hostname)',
+    'CREATE INDEX interfaces_ip_addr ON interfaces (ip_addr)',
+    'CREATE TABLE bgp_peers (hostname TEXT, role TEXT, ip_addr TEXT, bgp_as TEXT)',
+    'CREATE INDEX bgp_peers_hostname ON bgp_peers (hostname)',
+    'CREATE INDEX bgp_peers_ip_addr ON bgp_peers (ip_addr)',
+    'CREATE INDEX bgp_peers_bgp_as ON bgp_peers (bgp_as)',
+    'CREATE TABLE acl_uses (acl_name TEXT, hostname TEXT, interface TEXT, direction TEXT)',
+    'CREATE INDEX acl_uses_acl_name ON acl_uses (acl_name)',
+    'CREATE INDEX acl_uses_hostname ON acl_uses (hostname)',
+    'CREATE TABLE acls (name TEXT PRIMARY KEY, file TEXT)',
+    'CREATE INDEX acls_file ON acls (file)',
+]
+
+# Device keys listing BGP peers, stored as the role of the peer
+_PEER_ROLES = ['borders', 'leaves', 'spines']
+
+# Interface keys of ACLs applied to the interface, stored as the direction of the ACL
+_ACL_DIRECTIONS = dict(acl_in='in', acl_out='out')
+
+
+def store_path(inputs_dir, store_dir=DEFAULT_STORE_DIR):
+    """
+    Return the path of the store of inputs_dir in store_dir, one store per inputs directory.
+    """
+    inputs_dir = os.path.realpath(os.path.expanduser(inputs_dir))
+    key = hashlib.sha256(inputs_dir.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(os.path.expanduser(store_dir), '{}-{}.db'.format(os.path.basename(inputs_dir), key))
+
+
+class SotStore(object):
+    """
+    The store of the SOT in inputs_dir, kept at path.  Call refresh() to bring it up to date with the
+    files before querying it; a store that was never refreshed is empty.
+    Connections are not shared across processes, so forked workers should each open their own store.
+    """
+
+    def __init__(self, inputs_dir, path=None):
+        self.inputs_dir = inputs_dir
+        self.path = path or store_path(inputs_dir)
+        dir_name = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+        # Concurrent runs refreshing the same store wait for each other rather than failing
+        self._db = sqlite3.connect(self.path, timeout=60)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._create()
+
+    def close(self):
+        self._db.close()
+
+    def refresh(self):
+        """
+        Reload the files of inputs_dir that changed since the last refresh, and drop the ones removed.
+        Returns a dictionary of the names of the files added, updated and removed.
+        """
+        stats = {}
+        for file_name in os.listdir(self.inputs_dir):
+            if file_name.endswith('.json'):
+                st = os.stat(os.path.join(self.inputs_dir, file_name))
+                stats[file_name] = (_mtime_ns(st), st.st_size)
+        changes = dict(added=[], removed=[], updated=[])
+        with self._db:
+            stored = dict((name, (mtime_ns, size)) for name, mtime_ns, size in
+                          self._db.execute('SELECT name, mtime_ns, size FROM files'))
+            for file_name in sorted(set(stored) - set(stats)):
+                self._remove_file(file_name)
+                changes['removed'].append(file_name)
+            for file_name in sorted(stats):
+                if stored.get(file_name) == stats[file_name]:
+                    continue
+                self._remove_file(file_name)
+                self._add_file(file_name, stats[file_name])
+                changes['updated' if file_name in stored else 'added'].append(file_name)
+        return changes
+
+    def hostnames(self):
+        """
+        Return the sorted hostnames of all devices.
+        """
+        return [r[0] for r in self._db.execute('SELECT hostname FROM devices ORDER BY hostname')]
+
+    def device(self, hostname):
+        """
+        Return the SOT of device hostname, as in its JSON file.  Raises KeyError if there is none.
+        """
+        row = self._db.execute('SELECT files.data FROM devices JOIN files ON devices.file = files.name '
+                               'WHERE devices.hostname = ?', (hostname,)).fetchone()
+        if row is None:
+            raise KeyError("No SOT for device '{}'".format(hostname))
+        return json.loads(row[0])
+
+    def devices(self):
+        """
+        Return a dictionary of hostname to the SOT of every device.
+        """
+        return dict((hostname, json.loads(data)) for hostname, data in
+                    self._db.execute('SELECT devices.hostname, files.data FROM devices '
+                                     'JOIN files ON devices.file = files.name'))
+
+    def document(self, file_name):
+        """
+        Return the contents of any SOT file, such as acls.json.  Raises KeyError if there is none.
+        """
+        row = self._db.execute('SELECT data FROM files WHERE name = ?', (file_name,)).fetchone()
+        if row is None:
+            raise KeyError("No SOT file '{}'".format(file_name))
+        return json.loads(row[0])
+
+    def acl_definition(self, name):
+        """
+        Return the definition of ACL name.  Raises KeyError if there is none.
+        """
+        row = self._db.execute('SELECT file FROM acls WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError("No definition of ACL '{}'".format(name))
+        return next(a for a in self.document(row[0])['acls_def'] if a.get('name') == name)
+
+    def hostnames_by_as(self, bgp_as):
+        """
+        Return the sorted hostnames of the devices with BGP AS bgp_as.
+        """
+        return [r[0] for r in self._db.execute('SELECT hostname FROM devices WHERE bgp_as = ? ORDER BY hostname',
+                                               ('{}'.format(bgp_as),))]
+
+    def interface_by_ip(self, ip_addr):
+        """
+        Return the (hostname, interface) tuple of the interface with address ip_addr, or None.
+        """
+        row = self._db.execute('SELECT hostname, name FROM interfaces WHERE ip_addr = ? ORDER BY active DESC',
+                               (ip_addr,)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def bgp_peers(self, hostname):
+        """
+        Return the sorted (hostname, role, address) tuples of the devices peering with an address of device
+        hostname, where role is the key listing the peer in their SOT, such as "spines".
+        """
+        return [tuple(r) for r in self._db.execute(
+            'SELECT DISTINCT bgp_peers.hostname, bgp_peers.role, bgp_peers.ip_addr FROM interfaces '
+            'JOIN bgp_peers ON bgp_peers.ip_addr = interfaces.ip_addr WHERE interfaces.hostname = ? '
+            'ORDER BY bgp_peers.hostname, bgp_peers.ip_addr', (hostname,))]
+
+    def hostnames_peering_with_as(self, bgp_as):
+        """
+        Return the sorted hostnames of the devices with a BGP peer in AS bgp_as.
+        """
+        return [r[0] for r in self._db.execute('SELECT DISTINCT hostname FROM bgp_peers WHERE bgp_as = ? '
+                                               'ORDER BY hostname', ('{}'.format(bgp_as),))]
+
+    def acl_uses(self, acl_name):
+        """
+        Return the sorted (hostname, interface, direction) tuples of the uses of ACL acl_name.  Devices
+        listing the ACL without applying it to an interface have interface and direction None.
+        """
+        return sorted((tuple(r) for r in self._db.execute(
+            'SELECT hostname, interface, direction FROM acl_uses WHERE acl_name = ?', (acl_name,))),
+            key=lambda r: tuple('' if v is None else v for v in r))
+
+    def _create(self):
+        with self._db:
+            tables = set(r[0] for r in self._db.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+            if 'meta' in tables:
+                row = self._db.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+                if row is not None and row[0] == '{}'.format(SCHEMA_VERSION):
+                    return
+            for table in tables:
+                self._db.execute('DROP TABLE {}'.format(table))
+            for statement in _SCHEMA:
+                self._db.execute(statement)
+            self._db.execute("INSERT INTO meta VALUES ('schema_version', ?)", ('{}'.format(SCHEMA_VERSION),))
+
+    def _remove_file(self, file_name):
+        for (hostname,) in self._db.execute('SELECT hostname FROM devices WHERE file = ?', (file_name,)).fetchall():
+            for table in ['interfaces', 'bgp_peers', 'acl_uses']:
+                self._db.execute('DELETE FROM {} WHERE hostname = ?'.format(table), (hostname,))
+        self._db.execute('DELETE FROM devices WHERE file = ?', (file_name,))
+        self._db.execute('DELETE FROM acls WHERE file = ?', (file_name,))
+        self._db.execute('DELETE FROM files WHERE name = ?', (file_name,))
+
+    def _add_file(self, file_name, stat):
+        with open(os.path.join(self.inputs_dir, file_name)) as f:
+            data = f.read()
+        value = json.loads(data)
+        self._db.execute('INSERT INTO files VALUES (?, ?, ?, ?)', (file_name, stat[0], stat[1], data))
+        if not isinstance(value, dict):
+            return
+        for acl in value.get('acls_def', []):
+            self._db.execute('INSERT OR REPLACE INTO acls VALUES (?, ?)', (acl['name'], file_name))
+        hostname = value.get('hostname')
+        if not hostname:
+            return
+        bgp_as = value.get('bgp_as')
+        self._db.execute('INSERT OR REPLACE INTO devices VALUES (?, ?, ?)',
+                         (hostname, file_name, '{}'.format(bgp_as) if bgp_as is not None else None))
+        for key, active in [('active_interfaces', 1), ('shut_interfaces', 0)]:
+            for i in value.get(key, []):
+                self._db.execute('INSERT INTO interfaces VALUES (?, ?, ?, ?, ?)',
+                                 (hostname, i['name'], i.get('ip_addr'), i.get('description'), active))
+                for acl_key, direction in sorted(_ACL_DIRECTIONS.items()):
+                    if i.get(acl_key):
+                        self._db.execute('INSERT INTO acl_uses VALUES (?, ?, ?, ?)',
+                                         (i[acl_key], hostname, i['name'], direction))
+        for role in _PEER_ROLES:
+            for peer in value.get(role, []):
+                self._db.execute('INSERT INTO bgp_peers VALUES (?, ?, ?, ?)',
+                                 (hostname, role, peer.get('ip_addr'), '{}'.format(peer.get('bgp_as'))))
+        applied = set(r[0] for r in self._db.execute('SELECT acl_name FROM acl_uses WHERE hostname = ?',
+                                                     (hostname,)))
+        for acl in value.get('acls', []):
+            if acl.get('name') and acl['name'] not in applied:
+                self._db.execute('INSERT INTO acl_uses VALUES (?, ?, NULL, NULL)', (acl['name'], hostname))
+
+
+def _mtime_ns(st):
+    # st_mtime_ns is Python 3 only
+    return getattr(st, 'st_mtime_ns', None) or int(st.st_mtime * 1e9)
@@ -0,0 +1,444 @@
+#   Copyright 2018 Intentionet
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Benchmarks the demo pipeline on a synthetic network.
+
+Generates a network with synthetic_network.py, then runs the same modules as the playbooks, each in
+its own process as Ansible would: rendering configs, initializing the base snapshot and policies,
+changing the firewall ACL, pre-checking it, forking the candidate snapshot, running the policies
+and validating the ACL change.  By default the modules talk to a mock coordinator, served on the
+session helper socket they already use, which models snapshots and answers searchfilters with the
+local ACL model; pass --host to run against a real Batfish service instead.
+
+Results are written as JSON: wall time, per-phase latency and peak RSS of each module run, latency
+and payload bytes of each operation sent to the coordinator, and the peak RSS of this process.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from os import path
+
+from synthetic_network import ACL_NAME, generate_network, split_devices
+
+REPO_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+LIBRARY_DIR = path.join(REPO_DIR, 'playbooks', 'library')
+MODULE_UTILS_DIR = path.join(REPO_DIR, 'playbooks', 'module_utils')
+TEMPLATES_DIR = path.join(REPO_DIR, 'templates')
+POLICIES = {
+    'DC Base Policy': path.join(REPO_DIR, 'checks', 'base'),
+    'DC Fabric Policy': path.join(REPO_DIR, 'checks', 'fabric'),
+}
+
+# Runs a module file the way Ansible does, with the repo's module_utils importable
+BOOTSTRAP = ('import runpy, sys; import ansible.module_utils as m; m.__path__.append(sys.argv[1]); '
+             'sys.argv = sys.argv[2:]; runpy.run_path(sys.argv[0], run_name="__main__")')
+
+# Modules that do not talk to the coordinator
+LOCAL_MODULES = ['acl_precheck', 'render_config']
+
+# Change made to the firewall ACL, and the header space it is intended to permit
+NEW_ACL_LINE = 'permit tcp any 10.1.0.0 0.0.0.255 eq 80'
+NEW_TRAFFIC = dict(source_ips='0.0.0.0/0', destination_ips='10.1.0.0/24', ip_protocols='tcp',
+                   destination_ports='80')
+
+
+def _module_utils():
+    """
+    Import the repo's module_utils the way modules see them, as ansible.module_utils.
+    """
+    import ansible.module_utils
+    if MODULE_UTILS_DIR not in ansible.module_utils.__path__:
+        ansible.module_utils.__path__.append(MODULE_UTILS_DIR)
+    from ansible.module_utils import acl_headerspace, batfish_answers, batfish_helper, batfish_session
+    return acl_headerspace, batfish_answers, batfish_helper, batfish_session
+
+
+class MockCoordinator(object):
+    """
+    Stands in for the Batfish service behind a session helper, recording the latency and payload
+    size of every operation.  Snapshots are modelled by the ACLs of their nodes, analyses by the
+    names of their checks.  Every check answers answer_rows passing rows.
+    """
+
+    def __init__(self, network, answer_rows):
+        self.acls, self.answers, _, _ = _module_utils()
+        self.network = network
+        self.answer_rows = answer_rows
+        self.snapshots = {}
+        self.analyses = {}
+        self.operations = {}
+        self.payload_bytes = dict(session=0, upload=0, answers=0)
+        self.lock = threading.Lock()
+
+    def call(self, op, **kwargs):
+        handler = getattr(self, '_' + op, None)
+        if handler is None:
+            raise ValueError('Unsupported operation: {}'.format(op))
+        start = time.time()
+        value = handler(**kwargs)
+        elapsed = time.time() - start
+        with self.lock:
+            stats = self.operations.setdefault(op, dict(count=0, seconds=0.0, max_seconds=0.0,
+                                                        request_bytes=0, response_bytes=0))
+            stats['count'] += 1
+            stats['seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+            request_bytes = len(json.dumps(dict(op=op, kwargs=kwargs)))
+            response_bytes = len(json.dumps(dict(value=value)))
+            stats['request_bytes'] += request_bytes
+            stats['response_bytes'] += response_bytes
+            self.payload_bytes['session'] += request_bytes + response_bytes
+        return value
+
+    def _ping(self):
+        return self.network
+
+    def _init_snapshot(self, path, name, overwrite=False):
+        self.snapshots[name] = self._upload(path)
+        return name
+
+    def _fork_snapshot(self, base_name, name, add_files=None, overwrite=False, deactivate_nodes=None, **kwargs):
+        nodes = dict(self.snapshots[base_name])
+        if add_files:
+            nodes.update(self._upload(add_files))
+        for node in deactivate_nodes or []:
+            nodes.pop(node, None)
+        self.snapshots[name] = nodes
+        return name
+
+    def _upload(self, snapshot_dir):
+        """
+        Zip a snapshot directory, as Pybatfish does to upload it, and return the ACLs of its nodes.
+        """
+        buf = io.BytesIO()
+        nodes = {}
+        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+            for root, _, files in os.walk(snapshot_dir):
+                for file_name in files:
+                    file_path = path.join(root, file_name)
+                    z.write(file_path, path.relpath(file_path, snapshot_dir))
+                    if path.basename(root) == 'configs':
+                        with open(file_path) as f:
+                            nodes[path.splitext(file_name)[0]] = self.acls.parse_config_acls(f.read())
+        with self.lock:
+            self.payload_bytes['upload'] += len(buf.getvalue())
+        return nodes
+
+    def _list_snapshots(self):
+        return sorted(self.snapshots)
+
+    def _init_analysis(self, name, path):
+        # Batfish names the answers of an analysis by each check's instanceName, not by its file name
+        names = []
+        for file_name in os.listdir(path):
+            if file_name.endswith('.json'):
+                with open(os.path.join(path, file_name)) as f:
+                    names.append(json.load(f)['instance']['instanceName'])
+        self.analyses[name] = sorted(set(names))
+
+    def _delete_analysis(self, name):
+        self.analyses.pop(name, None)
+
+    def _list_analyses(self):
+        return sorted(self.analyses)
+
+    def _load_questions(self, cache_dir=None):
+        return 'loaded'
+
+    def _run_analysis(self, name, snapshot, max_rows=None, rows_file=None):
+        nodes = sorted(self.snapshots[snapshot])
+        results = {}
+        out = self.answers.open_rows_file(rows_file) if rows_file else None
+        try:
+            for check in self.analyses[name]:
+                rows = [dict(Node=nodes[i % len(nodes)], Check=check, Result='PASS')
+                        for i in range(self.answer_rows)]
+                text = json.dumps(dict(answerElements=[dict(rows=rows)],
+                                       summary=dict(numFailed=0, numPassed=len(rows), numResults=len(rows))))
+                with self.lock:
+                    self.payload_bytes['answers'] += len(text)
+                sink = self.answers.RowSink(max_rows, out, check)
+                answer = self.answers.parse_answer(text, sink.add)
+                results[check] = dict(summary=answer['summary'], row_count=sink.count, rows=sink.rows)
+        finally:
+            if out is not None:
+                out.close()
+        return results
+
+    def _searchfilters(self, snapshot, headers, filters, nodes, action, invert_search,
+                       reference_snapshot=None, cache_dir=None, max_rows=None, rows_file=None):
+        acls = self.acls
+        space = acls.header_space(headers.get('srcIps'), headers.get('dstIps'), headers.get('ipProtocols'),
+                                  headers.get('srcPorts'), headers.get('dstPorts'))
+        if invert_search:
+            space = acls.complement(space)
+        reference = self.snapshots[reference_snapshot] if reference_snapshot else None
+        rows = []
+        for node, node_acls in sorted(self.snapshots[snapshot].items()):
+            if not _matches(nodes, node):
+                continue
+            for acl_name, acl in sorted(node_acls.items()):
+                other = reference.get(node, {}).get(acl_name) if reference is not None else None
+                if not _matches(filters, acl_name) or isinstance(acl, acls.UnsupportedAclError) \
+                        or (reference is not None and not isinstance(other, acls.Acl)):
+                    continue
+                if other is None:
+                    permitted, denied = acl.partition(space)
+                    found = permitted if action == 'permit' else denied
+                else:
+                    found = acls.differences(acl, other, space)
+                if found:
+                    rows.append(dict(Node=node, Filter_Name=acl_name, Flow=acls.example_flow(found[0])))
+        with self.lock:
+            self.payload_bytes['answers'] += len(json.dumps(rows))
+        out = self.answers.open_rows_file(rows_file) if rows_file else None
+        try:
+            sink = self.answers.RowSink(max_rows, out)
+            for row in rows:
+                sink.add(row)
+        finally:
+            if out is not None:
+                out.close()
+        return dict(row_count=sink.count, rows=sink.rows)
+
+
+def _matches(regex, name):
+    # As in Batfish, node and filter names are matched case-insensitively
+    return re.match('(?:{})$'.format(regex or '.*'), name, re.IGNORECASE) is not None
+
+
+def run_module(module, args, work_dir):
+    """
+    Run a module from the repo in its own process, as Ansible would.
+    Returns a dictionary with its result, wall time, CPU time and peak RSS.
+    """
+    fd, args_file = tempfile.mkstemp(dir=work_dir, suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(dict(ANSIBLE_MODULE_ARGS=args), f)
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        start = time.time()
+        proc = subprocess.Popen([sys.executable, '-c', BOOTSTRAP, MODULE_UTILS_DIR,
+                                 path.join(LIBRARY_DIR, '{}.py'.format(module)), args_file],
+                                stdout=out, stderr=err, cwd=work_dir)
+        # wait4 gives the resource usage of this module run alone
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall_time = time.time() - start
+        proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+        out.seek(0)
+        err.seek(0)
+        stdout = out.read().decode('utf-8', 'replace')
+        stderr = err.read().decode('utf-8', 'replace')
+    os.remove(args_file)
+
+    try:
+        module_result = json.loads(stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        module_result = dict(failed=True, msg=stderr.strip() or stdout.strip())
+    return dict(module=module,
+                ok=proc.returncode == 0 and not module_result.get('failed'),
+                msg=module_result.get('msg'),
+                result=module_result,
+                wall_time=wall_time,
+                cpu_time=usage.ru_utime + usage.ru_stime,
+                peak_rss_kb=usage.ru_maxrss)
+
+
+def run_benchmark(args, work_dir):
+    network = args.network or 'benchmark-{}'.format(int(time.time()))
+    host = args.host or 'mock-coordinator'
+    phases = []
+
+    def phase(name, module=None, module_args=None, func=None):
+        if module is not None:
+            if module not in LOCAL_MODULES:
+                module_args = dict(module_args, host=host, network=network, timings=True)
+            record = run_module(module, module_args, work_dir)
+        else:
+            start = time.time()
+            func()
+            record = dict(ok=True, wall_time=time.time() - start)
+        record['name'] = name
+        timings = record.pop('result', {}).get('timings')
+        if timings:
+            record['module_timings'] = timings
+        phases.append(record)
+        logging.info('{:<24} {:>9.3f}s {}'.format(name, record['wall_time'], 'ok' if record['ok'] else
+                                                   'FAILED: {}'.format(record.get('msg'))))
+        return record
+
+    spines, leaves, firewalls = split_devices(args.devices)
+    inputs_dir = path.join(work_dir, 'inputs')
+    candidate_inputs_dir = path.join(work_dir, 'candidate_inputs')
+    base_dir = path.join(work_dir, 'snapshots', 'base')
+    candidate_dir = path.join(work_dir, 'snapshots', 'candidate')
+    hostnames = {}
+
+    def generate():
+        hostnames.update(generate_network(inputs_dir, spines, leaves, firewalls, args.acl_lines, args.seed))
+
+    def change_acl():
+        shutil.copytree(inputs_dir, candidate_inputs_dir)
+        acls_file = path.join(candidate_inputs_dir, 'acls.json')
+        with open(acls_file) as f:
+            acls = json.load(f)
+        lines = acls['acls_def'][0]['lines']
+        lines.insert(len(lines) - 1, NEW_ACL_LINE)
+        with open(acls_file, 'w') as f:
+            json.dump(acls, f, indent=2)
+
+    all_hostnames = lambda: hostnames['spine'] + hostnames['leaf'] + hostnames['firewall']
+    acl_checks = [
+        dict(description='Intended traffic is not already permitted', name='base', action='permit'),
+        dict(description='Intended traffic is permitted after change', action='deny'),
+        dict(description='No collateral damage caused by change', name='base', reference_snapshot='candidate',
+             invert_search=True),
+    ]
+
+    phase('generate', func=generate)
+    phase('render_base', 'render_config', dict(hostnames=all_hostnames(), inputs_dir=inputs_dir,
+                                               templates_dir=TEMPLATES_DIR,
+                                               dest_dir=path.join(base_dir, 'configs'), workers=0))
+    phase('init_base', 'batfish_init', dict(name='base', path=base_dir))
+    for policy, checks_dir in sorted(POLICIES.items()):
+        phase('init_policy:{}'.format(policy), 'batfish_policy',
+              dict(name='base', new=True, policy_name=policy, path=checks_dir, max_rows=args.max_rows))
+    phase('change_acl', func=change_acl)
+    phase('render_candidate', 'render_config', dict(hostnames=hostnames['firewall'],
+                                                    inputs_dir=candidate_inputs_dir,
+                                                    templates_dir=TEMPLATES_DIR,
+                                                    dest_dir=path.join(candidate_dir, 'configs'), workers=0))
+    phase('acl_precheck', 'acl_precheck',
+          dict(NEW_TRAFFIC, base_path=base_dir, path=candidate_dir, filters=ACL_NAME, nodes='fw-.*',
+               # The same checks, with snapshots named by role rather than by name
+               checks=[dict({k: v for k, v in c.items() if k != 'name'}, snapshot=c.get('name', 'candidate'))
+                       for c in acl_checks]))
+    phase('init_candidate', 'batfish_init', dict(base_name='base', name='candidate', path=candidate_dir,
+                                                 delta=True, base_path=base_dir))
+    phase('policy', 'batfish_policy', dict(name='candidate', incremental=True, base_name='base',
+                                           base_path=base_dir, policy_paths=POLICIES, workers=4,
+                                           max_rows=args.max_rows))
+    phase('acl_validation', 'batfish_searchfilters',
+          dict(NEW_TRAFFIC, name='candidate', filters=ACL_NAME, nodes='fw-.*', max_rows=args.max_rows,
+               checks=acl_checks))
+
+    return dict(config=dict(devices=spines + leaves + firewalls, spines=spines, leaves=leaves,
+                            firewalls=firewalls, acl_lines=args.acl_lines, answer_rows=args.answer_rows,
+                            seed=args.seed, coordinator=args.host or 'mock'),
+                phases=phases)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the demo pipeline on a synthetic network.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-d', '--devices',
+                        help='Total number of devices in the synthetic network.',
+                        type=int,
+                        default=10)
+    parser.add_argument('-a', '--acl-lines',
+                        help='Number of lines in the firewall ACL.',
+                        type=int,
+                        default=10)
+    parser.add_argument('-r', '--answer-rows',
+                        help='Number of rows the mock coordinator answers each policy check with.',
+                        type=int,
+                        default=100)
+    parser.add_argument('--max-rows',
+                        help='Maximum number of rows the modules keep in their results.',
+                        type=int,
+                        default=10)
+    parser.add_argument('--host',
+                        help='Host running a real Batfish service to benchmark against, instead of the mock coordinator.',
+                        default=None)
+    parser.add_argument('-n', '--network',
+                        help='Name of the network to create.  Defaults to a new name per run.',
+                        default=None)
+    parser.add_argument('--seed',
+                        help='Seed for the synthetic network.',
+                        type=int,
+                        default=0)
+    parser.add_argument('-o', '--output',
+                        help='File to write the JSON results to, instead of standard output.',
+                        default=None)
+    parser.add_argument('-w', '--work-dir',
+                        help='Directory to generate the network in, kept after the run.  Defaults to a temporary directory.',
+                        default=None)
+    parser.add_argument('-l', '--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Determines what level of logs to display')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s %(message)s', level=logging.getLevelName(args.log_level))
+
+    work_dir = path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix='bf-bench-')
+    if not path.isdir(work_dir):
+        os.makedirs(work_dir)
+    # Keep the modules' snapshot index, caches and session sockets out of the real home directory
+    os.environ['HOME'] = path.join(work_dir, 'home')
+
+    coordinator = server = None
+    if args.host is None:
+        _, _, batfish_helper, batfish_session = _module_utils()
+        network = args.network or 'benchmark'
+        args.network = network
+        coordinator = MockCoordinator(network, args.answer_rows)
+        socket_path = batfish_session.session_socket_path('mock-coordinator', network)
+        os.makedirs(path.dirname(socket_path), 0o700)
+        server = batfish_helper.bind_session(coordinator, socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    start = time.time()
+    try:
+        report = run_benchmark(args, work_dir)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    report['wall_time'] = time.time() - start
+    report['peak_rss_kb'] = dict(harness=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                 modules=max([p.get('peak_rss_kb', 0) for p in report['phases']] or [0]))
+    report['environment'] = dict(python=platform.python_version(), platform=platform.platform(),
+                                 cpus=os.cpu_count() if hasattr(os, 'cpu_count') else None)
+    if coordinator is not None:
+        report['operations'] = coordinator.operations
+        report['payload_bytes'] = coordinator.payload_bytes
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    sys.exit(0 if all(p['ok'] for p in report['phases']) else 1)
+
+
+if __name__ == '__main__':
+    main()
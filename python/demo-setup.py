@@ -13,16 +13,150 @@
 #   limitations under the License.
 
 import logging
-from pybatfish.client.commands import *
-from pybatfish.datamodel.flow import HeaderConstraints
-# noinspection PyUnresolvedReferences
-from pybatfish.question import bfq, list_questions, load_questions  # noqa F401
-from pybatfish.datamodel.referencelibrary import *
-from pybatfish.datamodel.primitives import *
-
-from os import makedirs, path
+from pybatfish.client.commands import (bf_add_reference_book, bf_delete_analysis, bf_generate_dataplane,
+                                       bf_init_analysis, bf_init_snapshot, bf_list_analyses, bf_list_snapshots,
+                                       bf_session, bf_set_network)
+from pybatfish.datamodel.referencelibrary import AddressGroup, InterfaceGroup, ReferenceBook
+from pybatfish.datamodel.primitives import Interface
+
 import argparse
+import hashlib
+import json
+import os
+import threading
+
+MODULE_UTILS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'playbooks',
+                                'module_utils')
+
+
+def import_module_utils():
+    """
+    Make the Batfish modules' helpers importable the way they see them, as ansible.module_utils.
+    """
+    import ansible.module_utils
+    if MODULE_UTILS_DIR not in ansible.module_utils.__path__:
+        ansible.module_utils.__path__.append(MODULE_UTILS_DIR)
+
+
+def setup_snapshot(network, name, snapshot_path, index_path, cache_dir, reconcile=False):
+    """
+    Initialize snapshot name from the files at snapshot_path and record its contents in the snapshot
+    index, as batfish_init does.  If reconcile is set, a snapshot the service still has whose indexed
+    contents match the files is kept instead.  Returns whether the snapshot was initialized.
+    """
+    from ansible.module_utils.batfish_cache import AnswerCache
+    from ansible.module_utils.batfish_snapshots import (find_entry, forget_snapshot, hash_snapshot_dir, load_index,
+                                                        record_snapshot, save_index, snapshot_key, snapshot_sections)
+    index_path = os.path.expanduser(index_path)
+    index = load_index(index_path)
+    content_hash, manifest = hash_snapshot_dir(snapshot_path)
+    key = snapshot_key(content_hash)
+    # The service may have lost the snapshot since it was indexed
+    if reconcile and find_entry(index, network, name)[0] == key and name in bf_list_snapshots():
+        logging.info('Snapshot "{}" is unchanged'.format(name))
+        return False
+
+    # Answers about the snapshot's previous contents can never be used again
+    AnswerCache(cache_dir, bf_session.coordinatorHost, network).invalidate_snapshot(name)
+    try:
+        bf_init_snapshot(snapshot_path, name, overwrite=True)
+    except Exception:
+        forget_snapshot(index, network, name)
+        save_index(index_path, index)
+        raise
+    record_snapshot(index, network, key, name, manifest=manifest, sections=snapshot_sections(snapshot_path, manifest))
+    save_index(index_path, index)
+    return True
+
+
+def load_state(path):
+    """
+    Load the hashes of the analyses and reference books set up by previous runs, by service and network.
+    """
+    try:
+        with open(os.path.expanduser(path)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_state(path, state):
+    from ansible.module_utils.batfish_snapshots import save_index
+    # Written atomically, like the snapshot index
+    save_index(os.path.expanduser(path), state)
+
+
+def sot_groups(inputs_dir, default_interfaces):
+    """
+    Return dictionaries of interface group name to (hostname, interface) tuples, and of address group
+    name to addresses, for the host interfaces and host subnets in the SOT in inputs_dir, in all and
+    per device.  Devices with no SOT keep their host interfaces in default_interfaces.
+    """
+    from ansible.module_utils import batfish_refbook
+    devices = batfish_refbook.load_devices(inputs_dir)
+    interfaces = set(batfish_refbook.host_interfaces(devices))
+    interfaces.update(i for i in default_interfaces if i[0] not in devices)
+    subnets = batfish_refbook.host_subnets(devices)
+    address_groups = batfish_refbook.group_by_device(batfish_refbook.HOST_SUBNETS_GROUP,
+                                                     [(h, p) for h in subnets for p in subnets[h]])
+    return (batfish_refbook.group_by_device(batfish_refbook.HOST_INTERFACES_GROUP, sorted(interfaces)),
+            dict((g, [p for _, p in members]) for g, members in address_groups.items()))
+
 
+def book_hash(book_name, interface_groups, address_groups):
+    return hashlib.sha256(json.dumps([book_name, interface_groups, address_groups],
+                                     sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def reference_book_exists(name):
+    try:
+        from pybatfish.client.commands import bf_get_reference_book
+        bf_get_reference_book(name)
+    except Exception:
+        return False
+    return True
+
+
+def warm_up(network, snapshot_name, analyses, cache_dir, index_path, max_rows=None):
+    """
+    Compute the data plane of the base snapshot and run each analysis on it in parallel, caching the
+    answers where batfish_policy finds the base snapshot's results.  Incremental runs on candidate
+    snapshots then only run the checks their changes affect, reusing these answers for the rest.
+    Analyses whose answers are already cached are not run again.
+    """
+    from ansible.module_utils.batfish_cache import AnswerCache, policy_params
+    from ansible.module_utils.batfish_helper import LocalSession
+    from ansible.module_utils.batfish_snapshots import load_index
+
+    session = LocalSession(bf_session.coordinatorHost, network)
+    cache = AnswerCache(cache_dir, bf_session.coordinatorHost, session.network,
+                        load_index(os.path.expanduser(index_path)))
+    params = dict((name, policy_params(checks_path, max_rows)) for name, checks_path in analyses)
+    pending = [name for name, _ in analyses if cache.get('run_analysis', name, [snapshot_name], params[name]) is None]
+    if not pending:
+        logging.info('Answers of all analyses on snapshot "{}" are already cached'.format(snapshot_name))
+        return
+
+    logging.info('Computing data plane of snapshot "{}"'.format(snapshot_name))
+    bf_generate_dataplane(snapshot_name)
+
+    errors = {}
+
+    def run(name):
+        try:
+            results = session.run_analysis(name, snapshot_name, max_rows)
+            cache.put('run_analysis', name, [snapshot_name], params[name], results)
+            logging.info('Cached answers of analysis "{}" on snapshot "{}"'.format(name, snapshot_name))
+        except Exception as e:
+            errors[name] = e
+
+    threads = [threading.Thread(target=run, args=(name,)) for name in pending]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for name in sorted(errors):
+        logging.warning('Could not warm up analysis "{}": {}'.format(name, errors[name]))
 
 
 parser = argparse.ArgumentParser(description='Setup for Ansible-Batfish demo.',
@@ -41,6 +175,36 @@ parser.add_argument('-p', '--snapshot-path',
 parser.add_argument('-s', '--snapshot-name',
                     help='Name of the base snapshot.',
                     default='base_snapshot')
+parser.add_argument('-r', '--reconcile',
+                    help='Only set up what changed since the last run, or what the service no longer has, '
+                         'rather than recreating the snapshot, reference book and analyses.',
+                    action='store_true')
+parser.add_argument('-w', '--warm-up',
+                    help='Compute the data plane of the base snapshot and cache the answers of each analysis on it, '
+                         'so validation runs only compute the candidate snapshot\'s answers.',
+                    action='store_true')
+parser.add_argument('--answer-cache-dir',
+                    help='Directory of the answer cache used by the Batfish modules, in which answers about the '
+                         'base snapshot are cached when warming up.',
+                    default='~/.batfish/answers')
+parser.add_argument('--index-path',
+                    help='Path of the local snapshot index used by the Batfish modules, in which the base '
+                         'snapshot\'s contents are recorded.',
+                    default='~/.batfish/snapshot_index.json')
+parser.add_argument('--max-rows',
+                    help='Maximum number of rows kept for each check when warming up, as the bf_max_rows '
+                         'passed to validate.yml.',
+                    default=None,
+                    type=int)
+parser.add_argument('--state-path',
+                    help='Path of the file in which the hashes of the analyses and reference books set up are '
+                         'recorded, to reconcile them.',
+                    default='~/.batfish/setup_state.json')
+parser.add_argument('-i', '--inputs-dir',
+                    help='Path to the SOT of the devices, such as inputs/, to build the reference book from: the '
+                         'interfaces described as hosts and the host subnets, in all and per device.  Devices with '
+                         'no SOT keep the default host interfaces.',
+                    default=None)
 parser.add_argument('-l', '--log-level', default='INFO',
                     choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                     help='Determines what level of logs to display')
@@ -49,35 +213,79 @@ args = parser.parse_args()
 log_level = logging.getLevelName(args.log_level)
 logging.basicConfig(format='%(levelname)s %(message)s', level=log_level)
 
+import_module_utils()
 bf_set_network(args.network_name)
-bf_init_snapshot(args.snapshot_path, args.snapshot_name, overwrite=True)
+setup_snapshot(args.network_name, args.snapshot_name, args.snapshot_path, args.index_path, args.answer_cache_dir,
+               args.reconcile)
 
 analyses = args.analysis
 
+# Hashes of what was set up are recorded by every run, so reconciling never trusts an outdated hash
+state = load_state(args.state_path)
+network_state = state.setdefault(bf_session.coordinatorHost, {}).setdefault(args.network_name, {})
+book_hashes = network_state.setdefault('reference_books', {})
+analysis_hashes = network_state.setdefault('analyses', {})
+
 ### short term hack to make Fabric playbook work correctly
 host_interfaces = [
-    Interface(hostname="lhr-leaf-01", interface="Ethernet1/6"),
-    Interface(hostname="lhr-leaf-01", interface="Ethernet1/7"),
-    Interface(hostname="lhr-leaf-02", interface="Ethernet1/6"),
-    Interface(hostname="lhr-leaf-02", interface="Ethernet1/7"),
-    Interface(hostname="lhr-leaf-03", interface="Ethernet1/6"),
-    Interface(hostname="lhr-leaf-03", interface="Ethernet1/7"),
+    ("lhr-leaf-01", "Ethernet1/6"),
+    ("lhr-leaf-01", "Ethernet1/7"),
+    ("lhr-leaf-02", "Ethernet1/6"),
+    ("lhr-leaf-02", "Ethernet1/7"),
+    ("lhr-leaf-03", "Ethernet1/6"),
+    ("lhr-leaf-03", "Ethernet1/7"),
 ]
 
-refbook = ReferenceBook(name="mybook", interfaceGroups=[InterfaceGroup(name="host_interfaces", interfaces=host_interfaces)])
-try:
-    bf_add_reference_book(refbook)
-except Exception as e:
-    logging.warning('Could not add reference book: {}'.format(e))
+if args.inputs_dir is not None:
+    # Per-device groups let batfish_policy narrow reachability checks down to the changed devices
+    interface_groups, address_groups = sot_groups(args.inputs_dir, host_interfaces)
+else:
+    interface_groups, address_groups = {"host_interfaces": host_interfaces}, {}
+
+book_name = "mybook"
+refbook = ReferenceBook(
+    name=book_name,
+    addressGroups=[AddressGroup(name=g, addresses=address_groups[g]) for g in sorted(address_groups)],
+    interfaceGroups=[InterfaceGroup(name=g, interfaces=[Interface(hostname=h, interface=i)
+                                                        for h, i in interface_groups[g]])
+                     for g in sorted(interface_groups)])
+refbook_hash = book_hash(book_name, interface_groups, address_groups)
+book_exists = args.reconcile and reference_book_exists(book_name)
+if book_exists and book_hashes.get(book_name) == refbook_hash:
+    logging.info('Reference book "{}" is unchanged'.format(book_name))
+else:
+    try:
+        if book_exists:
+            # Adding a book fails if it exists, so a changed book is replaced
+            from pybatfish.client.commands import bf_put_reference_book
+            bf_put_reference_book(refbook)
+        else:
+            bf_add_reference_book(refbook)
+        book_hashes[book_name] = refbook_hash
+    except Exception as e:
+        book_hashes.pop(book_name, None)
+        logging.warning('Could not add reference book: {}'.format(e))
 ## end hack
 
 if analyses is not None:
+    from ansible.module_utils.batfish_snapshots import hash_snapshot_dir
+    existing = bf_list_analyses() if args.reconcile else []
     for name, path in analyses:
+        checks_hash = hash_snapshot_dir(path)[0]
+        if name in existing and analysis_hashes.get(name) == checks_hash:
+            logging.info('Analysis "{}" is unchanged'.format(name))
+            continue
         logging.info('Setting up analysis "{}" with checks at "{}"'.format(name, path))
+        if analysis_hashes.pop(name, None) is not None:
+            # Forgotten before changing it, so it is set up again if this fails halfway
+            save_state(args.state_path, state)
         try:
             bf_init_analysis(name, path)
         except:
             bf_delete_analysis(name)
             bf_init_analysis(name, path)
+        analysis_hashes[name] = checks_hash
+save_state(args.state_path, state)
 
-
+if args.warm_up and analyses is not None:
+    warm_up(args.network_name, args.snapshot_name, analyses, args.answer_cache_dir, args.index_path, args.max_rows)
@@ -0,0 +1,74 @@
+#   Copyright 2018 Intentionet
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Answers questions about the source of truth (SOT) in inputs/ from its indexed store, the one the
+render_config module keeps when given sot_dir.
+
+The store is refreshed from the files that changed first, then each option given prints its answer as
+JSON: the SOT of a device, the devices with a BGP AS, the owner of an address, the devices peering
+with a device or with an AS, or the uses of an ACL.
+"""
+
+import argparse
+import json
+import sys
+from os import path
+
+# The store only needs the standard library, so it is imported without Ansible
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), 'playbooks', 'module_utils'))
+from sot_store import DEFAULT_STORE_DIR, SotStore, store_path  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the indexed store of the SOT.')
+    parser.add_argument('-i', '--inputs-dir', help='Directory containing the SOT files.', default='inputs')
+    parser.add_argument('-s', '--sot-dir', help='Directory of the SOT stores.', default=DEFAULT_STORE_DIR)
+    parser.add_argument('--device', help='Print the SOT of this device.', default=None)
+    parser.add_argument('--bgp-as', help='Print the devices with this BGP AS.', default=None)
+    parser.add_argument('--ip', help='Print the device and interface with this address.', default=None)
+    parser.add_argument('--peers-of', help='Print the devices peering with an address of this device.',
+                        default=None)
+    parser.add_argument('--peers-of-as', help='Print the devices with a BGP peer in this AS.', default=None)
+    parser.add_argument('--acl', help='Print the devices and interfaces using this ACL.', default=None)
+    args = parser.parse_args()
+
+    store = SotStore(args.inputs_dir, store_path(args.inputs_dir, args.sot_dir))
+    try:
+        store.refresh()
+        answers = {}
+        if args.device is not None:
+            try:
+                answers['device'] = store.device(args.device)
+            except KeyError as e:
+                sys.exit(e.args[0])
+        if args.bgp_as is not None:
+            answers['bgp_as'] = store.hostnames_by_as(args.bgp_as)
+        if args.ip is not None:
+            answers['ip'] = store.interface_by_ip(args.ip)
+        if args.peers_of is not None:
+            answers['peers_of'] = [dict(hostname=h, role=r, ip_addr=ip) for h, r, ip in store.bgp_peers(args.peers_of)]
+        if args.peers_of_as is not None:
+            answers['peers_of_as'] = store.hostnames_peering_with_as(args.peers_of_as)
+        if args.acl is not None:
+            answers['acl'] = [dict(hostname=h, interface=i, direction=d) for h, i, d in store.acl_uses(args.acl)]
+        if not answers:
+            answers['hostnames'] = store.hostnames()
+    finally:
+        store.close()
+    print(json.dumps(answers, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#   Copyright 2018 Intentionet
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Reads a results log written by the write_results module, such as s3_logs/bf-logs-<snapshot>.jsonl.gz.
+
+Without --table, prints the summary of the results and the number of rows of each table.  With
+--table, prints the rows of that table, named by its keys joined with " / " as listed, as JSON lines
+or CSV.  Rows are read a block at a time, so large logs can be filtered through other tools.
+"""
+
+import argparse
+import csv
+import json
+import sys
+from os import path
+
+# The results format only needs the standard library, so it is imported without Ansible
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), 'playbooks', 'module_utils'))
+from batfish_results import ResultsReader, table_name  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Read a results log written by the write_results module.')
+    parser.add_argument('results_file', help='Path of the results log.')
+    parser.add_argument('-t', '--table',
+                        help='Name of a table to print the rows of, as listed without this option.',
+                        default=None)
+    parser.add_argument('-c', '--csv',
+                        help='Print rows as CSV rather than JSON lines, with nested values as JSON.',
+                        action='store_true')
+    args = parser.parse_args()
+
+    reader = ResultsReader(args.results_file)
+    if args.table is None:
+        print(json.dumps(dict(summary=reader.summary,
+                              tables={table_name(t): count for t, count in reader.tables()}),
+                         indent=2, sort_keys=True))
+        return
+
+    tables = [t for t, _ in reader.tables() if table_name(t) == args.table]
+    if not tables:
+        sys.exit("No table named '{}' in {}".format(args.table, args.results_file))
+    rows = reader.rows(tables[0])
+    if not args.csv:
+        for row in rows:
+            print(json.dumps(row, sort_keys=True))
+        return
+
+    columns = reader.column_names(tables[0])
+    writer = csv.writer(sys.stdout)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([v if isinstance(v, (str, int, float)) or v is None else json.dumps(v, sort_keys=True)
+                         for v in (row.get(c) for c in columns)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+#   Copyright 2018 Intentionet
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Measures the import time of the modules in playbooks/library, to catch startup regressions.
+
+Each module is imported with python -X importtime in a fresh process, with module_utils imported
+from a zip of their sources like Ansible ships them, so they are compiled on every run as they are
+in production.  A module's startup cost is the time spent importing everything a bare import of
+ansible.module_utils.basic does not, which every module pays anyway.
+
+Results are written as JSON.  Given the results of an earlier run with --baseline, the run fails if
+any module got slower by more than the tolerance, or imports a module listed with --forbid, such as
+pybatfish, at startup.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipfile
+from os import path
+
+REPO_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+LIBRARY_DIR = path.join(REPO_DIR, 'playbooks', 'library')
+MODULE_UTILS_DIR = path.join(REPO_DIR, 'playbooks', 'module_utils')
+
+# Imports a module file without running it, with the repo's module_utils importable from a zip
+BOOTSTRAP = ('import runpy, sys; import ansible.module_utils.basic; import ansible.module_utils as m; '
+             'm.__path__.append(sys.argv[1]); runpy.run_path(sys.argv[2], run_name="startup")')
+
+IMPORT_TIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)')
+
+
+def zip_module_utils(zip_path):
+    """
+    Zip the sources of the repo's module_utils, without bytecode, and return the path to import them from.
+    """
+    with zipfile.ZipFile(zip_path, 'w') as z:
+        for file_name in sorted(os.listdir(MODULE_UTILS_DIR)):
+            if file_name.endswith('.py'):
+                z.write(path.join(MODULE_UTILS_DIR, file_name), path.join('module_utils', file_name))
+    return path.join(zip_path, 'module_utils')
+
+
+def import_times(module_path, module_utils_path):
+    """
+    Import a module file in a new process and return a dictionary of each module it imported, in
+    import order, to its self time in microseconds.
+    """
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', BOOTSTRAP, module_utils_path, module_path],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=path.dirname(module_path))
+    _, stderr = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError('Failed to import {}: {}'.format(module_path, stderr.decode('utf-8', 'replace')))
+    times = {}
+    for line in stderr.decode('utf-8', 'replace').splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(1))
+    return times
+
+
+def measure(module_path, module_utils_path, baseline_modules, repeat):
+    """
+    Return the startup cost of a module: the median total and the imports it adds to the baseline.
+    """
+    runs = []
+    for _ in range(repeat):
+        times = import_times(module_path, module_utils_path)
+        runs.append({k: v for k, v in times.items() if k not in baseline_modules})
+    totals = sorted(sum(run.values()) for run in runs)
+    median_run = min(runs, key=lambda run: abs(sum(run.values()) - totals[len(totals) // 2]))
+    imports = sorted(median_run.items(), key=lambda item: -item[1])
+    return dict(import_ms=totals[len(totals) // 2] / 1000.0,
+                min_import_ms=totals[0] / 1000.0,
+                imports=sorted(median_run),
+                slowest=[dict(module=k, self_ms=v / 1000.0) for k, v in imports[:10]])
+
+
+def check_regressions(results, baseline, tolerance, slack_ms, forbid):
+    """
+    Return a list of messages describing modules that got slower than in baseline or import a
+    forbidden module.
+    """
+    problems = []
+    for name, result in sorted(results['modules'].items()):
+        for imported in result['imports']:
+            if any(imported == f or imported.startswith(f + '.') for f in forbid):
+                problems.append('{} imports {} at startup'.format(name, imported))
+        old = baseline.get('modules', {}).get(name)
+        if old is None:
+            continue
+        limit = old['min_import_ms'] * (1 + tolerance) + slack_ms
+        if result['min_import_ms'] > limit:
+            problems.append('{} imports in {:.1f}ms, more than {:.1f}ms allowed by the baseline'.format(
+                name, result['min_import_ms'], limit))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the import time of the Ansible modules.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-b', '--baseline',
+                        help='JSON results of an earlier run to compare against.  Slower modules fail the run.',
+                        default=None)
+    parser.add_argument('-f', '--forbid',
+                        help='Module that must not be imported at startup.  Can be given more than once.',
+                        action='append',
+                        default=None)
+    parser.add_argument('-m', '--module',
+                        help='Name of a module to measure, all modules if not given.  Can be given more than once.',
+                        action='append',
+                        default=None)
+    parser.add_argument('-o', '--output',
+                        help='File to write the JSON results to, instead of standard output.',
+                        default=None)
+    parser.add_argument('-r', '--repeat',
+                        help='Number of times to import each module.  The median is reported.',
+                        type=int,
+                        default=5)
+    parser.add_argument('--slack-ms',
+                        help='Milliseconds a module may get slower than the baseline, on top of the tolerance.',
+                        type=float,
+                        default=3.0)
+    parser.add_argument('-t', '--tolerance',
+                        help='Fraction a module may get slower than the baseline.',
+                        type=float,
+                        default=0.2)
+    parser.add_argument('-l', '--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Determines what level of logs to display')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s %(message)s', level=logging.getLevelName(args.log_level))
+    forbid = args.forbid if args.forbid is not None else ['pybatfish']
+    names = args.module or sorted(path.splitext(f)[0] for f in os.listdir(LIBRARY_DIR) if f.endswith('.py'))
+
+    tmp_dir = tempfile.mkdtemp(prefix='bf-startup-')
+    try:
+        module_utils_path = zip_module_utils(path.join(tmp_dir, 'module_utils.zip'))
+        empty_module = path.join(tmp_dir, 'empty.py')
+        with open(empty_module, 'w'):
+            pass
+        baseline_runs = [import_times(empty_module, module_utils_path) for _ in range(args.repeat)]
+        baseline_modules = set(k for run in baseline_runs for k in run)
+        basic_ms = sorted(sum(run.values()) for run in baseline_runs)[args.repeat // 2] / 1000.0
+
+        results = dict(python=sys.version.split()[0], repeat=args.repeat, basic_import_ms=basic_ms, modules={})
+        for name in names:
+            result = measure(path.join(LIBRARY_DIR, '{}.py'.format(name)), module_utils_path, baseline_modules,
+                             args.repeat)
+            results['modules'][name] = result
+            logging.info('{:<24} {:>7.1f}ms on top of {:.1f}ms for ansible.module_utils.basic'.format(
+                name, result['import_ms'], basic_ms))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    problems = check_regressions(results, baseline, args.tolerance, args.slack_ms, forbid)
+    for problem in problems:
+        logging.error(problem)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#   Copyright 2018 Intentionet
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Generates the source of truth for a synthetic spine/leaf/firewall network of any size.
+
+Devices are described in the same format as inputs/*.json, so their configs are rendered from the
+repo's templates by the render_config module.  Every leaf and firewall has an uplink to every
+spine, spines peer with leaves and firewalls through the templates' BORDER peer group, and every
+firewall applies one ACL of the requested length to its first uplink.
+"""
+
+import argparse
+import json
+import logging
+import random
+from os import makedirs, path
+
+ACL_NAME = 'PROTECT_SERVICES_FROM_OUTSIDE'
+
+
+def split_devices(devices):
+    """
+    Split a total number of devices into numbers of (spines, leaves, firewalls).
+    """
+    spines = min(16, max(2, devices // 50))
+    firewalls = max(2, devices // 10)
+    leaves = max(1, devices - spines - firewalls)
+    return spines, leaves, firewalls
+
+
+def generate_network(out_dir, spines, leaves, firewalls, acl_lines, seed=0):
+    """
+    Write one JSON file per device and acls.json into out_dir.
+    Returns a dictionary of role ('spine', 'leaf' or 'firewall') to the hostnames of that role.
+    """
+    rng = random.Random(seed)
+    hostnames = dict(spine=['spine-{:02d}'.format(i + 1) for i in range(spines)],
+                     leaf=['leaf-{:04d}'.format(i + 1) for i in range(leaves)],
+                     firewall=['fw-{:04d}'.format(i + 1) for i in range(firewalls)])
+    devices = {}
+    for i, hostname in enumerate(hostnames['spine'] + hostnames['leaf'] + hostnames['firewall']):
+        devices[hostname] = dict(hostname=hostname,
+                                 loop_ip=_ip((10 << 24) | (255 << 16) | (i + 1)),
+                                 mgmt_ip=_ip((192 << 24) | (168 << 16) | ((i // 250) << 8) | (i % 250 + 2)),
+                                 active_interfaces=[], shut_interfaces=[], bgp_as='', spines=[], borders=[],
+                                 host_subnets=[], acls=[])
+
+    for i, hostname in enumerate(hostnames['spine']):
+        devices[hostname]['bgp_as'] = '{}'.format(65100 + i + 1)
+    for i, hostname in enumerate(hostnames['leaf']):
+        devices[hostname]['bgp_as'] = '{}'.format(4200000000 + i + 1)
+        subnet = (10 << 24) | ((1 + i // 256) << 16) | ((i % 256) << 8)
+        devices[hostname]['host_subnets'].append(dict(network=_ip(subnet), mask='255.255.255.0'))
+        devices[hostname]['active_interfaces'].append(
+            dict(name='Ethernet0/1', description='hosts', ip_addr=_ip(subnet | 1), mask='255.255.255.0'))
+    for i, hostname in enumerate(hostnames['firewall']):
+        devices[hostname]['bgp_as'] = '{}'.format(4210000000 + i + 1)
+        devices[hostname]['acls'].append(dict(name=ACL_NAME))
+
+    # One /30 per uplink, from 172.16.0.0/12
+    link = 0
+    for hostname in hostnames['leaf'] + hostnames['firewall']:
+        device = devices[hostname]
+        for spine_name in hostnames['spine']:
+            spine = devices[spine_name]
+            network = (172 << 24) | (16 << 16) | (link << 2)
+            link += 1
+            spine_port = len(spine['active_interfaces'])
+            device_port = len(device['active_interfaces'])
+            spine['active_interfaces'].append(dict(name=_interface(spine_port), description='{} uplink'.format(hostname),
+                                                   ip_addr=_ip(network | 1), mask='255.255.255.252'))
+            uplink = dict(name=_interface(device_port + 1), description='{} downlink'.format(spine_name),
+                          ip_addr=_ip(network | 2), mask='255.255.255.252')
+            if device['acls'] and not device['spines']:
+                uplink['acl_in'] = ACL_NAME
+            device['active_interfaces'].append(uplink)
+            device['spines'].append(dict(ip_addr=_ip(network | 1), bgp_as=spine['bgp_as']))
+            spine['borders'].append(dict(ip_addr=_ip(network | 2), bgp_as=device['bgp_as']))
+
+    if not path.isdir(out_dir):
+        makedirs(out_dir)
+    for hostname, device in devices.items():
+        with open(path.join(out_dir, '{}.json'.format(hostname)), 'w') as f:
+            json.dump(device, f, indent=2, sort_keys=True)
+    with open(path.join(out_dir, 'acls.json'), 'w') as f:
+        json.dump(dict(acls_def=[dict(name=ACL_NAME, lines=generate_acl_lines(rng, acl_lines))]), f, indent=2)
+    return hostnames
+
+
+def generate_acl_lines(rng, count):
+    """
+    Return count ACL lines: random permits of /24 source and destination subnets and a final deny.
+    """
+    lines = []
+    for _ in range(max(0, count - 1)):
+        src = (10 << 24) | (rng.randint(100, 199) << 16) | (rng.randint(0, 255) << 8)
+        dst = (10 << 24) | (rng.randint(1, 99) << 16) | (rng.randint(0, 255) << 8)
+        lines.append('permit {} {} 0.0.0.255 {} 0.0.0.255 eq {}'.format(
+            rng.choice(['tcp', 'udp']), _ip(src), _ip(dst), rng.choice([22, 53, 80, 443, 3306, 8080])))
+    lines.append('deny ip any any')
+    return lines
+
+
+def _interface(port):
+    return 'Ethernet{}/{}'.format(1 + port // 8, port % 8)
+
+
+def _ip(value):
+    return '.'.join(str((value >> shift) & 0xff) for shift in (24, 16, 8, 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the source of truth for a synthetic network.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-o', '--output-dir',
+                        help='Directory to write device JSON files and acls.json into.',
+                        required=True)
+    parser.add_argument('-d', '--devices',
+                        help='Total number of devices, split into spines, leaves and firewalls.',
+                        type=int,
+                        default=10)
+    parser.add_argument('-a', '--acl-lines',
+                        help='Number of lines in the firewall ACL.',
+                        type=int,
+                        default=10)
+    parser.add_argument('--seed',
+                        help='Seed for the random ACL lines.',
+                        type=int,
+                        default=0)
+    parser.add_argument('-l', '--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Determines what level of logs to display')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s %(message)s', level=logging.getLevelName(args.log_level))
+    spines, leaves, firewalls = split_devices(args.devices)
+    generate_network(args.output_dir, spines, leaves, firewalls, args.acl_lines, args.seed)
+    logging.info('Generated {} spines, {} leaves and {} firewalls in "{}"'.format(
+        spines, leaves, firewalls, args.output_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Tests of incremental policy runs, against a fake session that names answers by the checks'
+instanceName, as Batfish does.
+"""
+
+import json
+import os
+import runpy
+import shutil
+import tempfile
+import unittest
+
+import ansible.module_utils
+
+PLAYBOOKS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'playbooks')
+ansible.module_utils.__path__.append(os.path.join(PLAYBOOKS_DIR, 'module_utils'))
+
+from ansible.module_utils.batfish_impact import OTHER, check_affected, load_checks  # noqa: E402
+from ansible.module_utils.batfish_snapshots import record_snapshot  # noqa: E402
+
+batfish_policy = runpy.run_path(os.path.join(PLAYBOOKS_DIR, 'library', 'batfish_policy.py'))
+
+
+def check(instance_name, tags):
+    return dict(instance=dict(instanceName=instance_name, tags=tags, variables={}))
+
+
+# File names differ from instance names, as for every check in checks/
+CHECKS = {
+    'bgp_unique_asn_check.json': check('All Leaf routers use unique BGP ASN', ['asn']),
+    'ntp_server.json': check('NTP Server settings check', ['ntp']),
+    'filter_reachability.json': check('Unreachable filter lines', ['acl']),
+}
+
+
+class FakeSession(object):
+    """
+    Answers each check of an analysis under its instanceName, recording the snapshots each check
+    is run on.
+    """
+
+    def __init__(self, checks_path, groups=()):
+        self.analyses = {'policy': [c['instance']['instanceName'] for c in load_checks(checks_path).values()]}
+        self.groups = list(groups)
+        self.runs = []
+
+    def call(self, op, **kwargs):
+        if op == 'init_analysis':
+            names = []
+            for file_name in os.listdir(kwargs['path']):
+                with open(os.path.join(kwargs['path'], file_name)) as f:
+                    names.append(json.load(f)['instance']['instanceName'])
+            self.analyses[kwargs['name']] = names
+        elif op == 'run_analysis':
+            names = self.analyses[kwargs['name']]
+            self.runs.extend((n, kwargs['snapshot']) for n in names)
+            return dict((n, dict(summary=dict(numFailed=0), row_count=0, rows=[kwargs['snapshot']]))
+                        for n in names)
+        elif op == 'reference_book_groups':
+            return self.groups
+        elif op != 'delete_analysis':
+            raise ValueError(op)
+
+
+class IncrementalPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.checks_path = tempfile.mkdtemp()
+        for file_name, c in CHECKS.items():
+            with open(os.path.join(self.checks_path, file_name), 'w') as f:
+                json.dump(c, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.checks_path)
+
+    def test_load_checks_by_instance_name(self):
+        self.assertEqual(sorted(load_checks(self.checks_path)),
+                         sorted(c['instance']['instanceName'] for c in CHECKS.values()))
+
+    def test_affected_checks_are_rerun(self):
+        changes = {'lhr-leaf-03': set(['bgp'])}
+        checks = load_checks(self.checks_path)
+        self.assertEqual([k for k in sorted(checks) if check_affected(checks[k], changes)],
+                         ['All Leaf routers use unique BGP ASN', 'NTP Server settings check'])
+
+        session = FakeSession(self.checks_path)
+        results, skipped, scoped = batfish_policy['_run_policy_incremental'](
+            session, 'policy', 'candidate', self.checks_path, changes, 'base')
+        self.assertEqual(skipped, ['Unreachable filter lines'])
+        self.assertEqual(scoped, {})
+        self.assertEqual(dict((k, v['rows']) for k, v in results.items()), {
+            'All Leaf routers use unique BGP ASN': ['candidate'],
+            'NTP Server settings check': ['candidate'],
+            'Unreachable filter lines': ['base'],
+        })
+
+    def test_scoped_reachability_checks_are_answered_separately(self):
+        location = 'enter([ref.interfacegroup(host_interfaces, mybook)])'
+        reach = check('All Leaf to All Leaf reachability', ['reachability'])
+        reach['instance']['variables'] = dict(
+            pathConstraints=dict(value=dict(startLocation=location)),
+            headers=dict(value=dict(dstIps='ofLocation({})'.format(location))))
+        reach.update(pathConstraints='${pathConstraints}', headers='${headers}')
+        with open(os.path.join(self.checks_path, 'all_leaf_reach_check.json'), 'w') as f:
+            json.dump(reach, f)
+        groups = ['host_interfaces'] + ['host_interfaces_lhr-leaf-0{}'.format(i) for i in range(1, 6)]
+        session = FakeSession(self.checks_path, groups)
+
+        results, _, scoped = batfish_policy['_run_policy_incremental'](
+            session, 'policy', 'candidate', self.checks_path, {'lhr-leaf-03': set(['interface'])}, 'base',
+            scope_sample=1)
+        self.assertEqual(sorted(scoped), ['All Leaf to All Leaf reachability'])
+        self.assertIn('lhr-leaf-03', scoped['All Leaf to All Leaf reachability'])
+        self.assertEqual(len(scoped['All Leaf to All Leaf reachability']), 2)
+        # A run from and a run to each of the two nodes, under their own names
+        scoped_runs = [n for n, _ in session.runs if n.startswith('All Leaf to All Leaf reachability ')]
+        self.assertEqual(len(set(scoped_runs)), 4)
+        self.assertIn('All Leaf to All Leaf reachability', results)
+        self.assertFalse([k for k in results if k.startswith('All Leaf to All Leaf reachability ')])
+
+    def test_deactivated_nodes_are_changes(self):
+        manifest = {'configs/lhr-leaf-01.cfg': 'a', 'configs/lhr-leaf-02.cfg': 'b'}
+        sections = dict((k, {'bgp': v}) for k, v in manifest.items())
+        index = {}
+        record_snapshot(index, 'network', 'base-key', 'base', manifest=manifest, sections=sections)
+        # Forked with all files but lhr-leaf-02's, which was deactivated
+        record_snapshot(index, 'network', 'candidate-key', 'candidate', 'base',
+                        {'configs/lhr-leaf-01.cfg': 'a'}, {'configs/lhr-leaf-01.cfg': {'bgp': 'a'}},
+                        ['lhr-leaf-02'])
+
+        changes = batfish_policy['_snapshot_changes'](index, 'network', 'base', 'candidate', None)
+        self.assertEqual(changes, {'lhr-leaf-02': set([OTHER])})
+        checks = load_checks(self.checks_path)
+        self.assertTrue(all(check_affected(c, changes) for c in checks.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
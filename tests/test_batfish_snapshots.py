@@ -0,0 +1,64 @@
+#   Copyright 2018 The Batfish Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Tests of snapshot retention: which candidate snapshots batfish_retention may delete.
+"""
+
+import os
+import unittest
+from datetime import datetime
+
+import ansible.module_utils
+
+ansible.module_utils.__path__.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                  'playbooks', 'module_utils'))
+
+from ansible.module_utils.batfish_snapshots import (expired_snapshots, record_snapshot,  # noqa: E402
+                                                    snapshot_bases)
+
+NOW = datetime(2018, 9, 26, 12, 0, 0)
+
+# Oldest first, a day apart
+CANDIDATES = ['candidate_2018-09-2{}-12-00-00'.format(i) for i in range(1, 6)]
+
+
+class RetentionTest(unittest.TestCase):
+
+    def setUp(self):
+        # The oldest candidate is the base of a newer one, which is forked from it
+        self.index = {}
+        record_snapshot(self.index, 'network', 'key0', CANDIDATES[0])
+        record_snapshot(self.index, 'network', 'key4', CANDIDATES[4], base_name=CANDIDATES[0])
+
+    def test_fork_base_never_expires(self):
+        for network in ['network', None]:
+            pinned = snapshot_bases(self.index, network)
+            self.assertEqual(pinned, set([CANDIDATES[0]]))
+            for keep_last, max_age in [(0, None), (1, None), (None, 3600), (0, 0)]:
+                expired = expired_snapshots(CANDIDATES, ['candidate'], keep_last, max_age, pinned, NOW)
+                self.assertNotIn(CANDIDATES[0], expired)
+
+    def test_unpinned_candidates_expire(self):
+        pinned = snapshot_bases(self.index, 'network')
+        self.assertEqual(expired_snapshots(CANDIDATES, ['candidate'], 2, None, pinned, NOW), CANDIDATES[1:3])
+        self.assertEqual(expired_snapshots(CANDIDATES, ['candidate'], None, 3.5 * 86400, pinned, NOW),
+                         CANDIDATES[1:2])
+
+    def test_bases_of_other_networks_are_not_pinned(self):
+        self.assertEqual(snapshot_bases(self.index, 'other'), set())
+
+
+if __name__ == '__main__':
+    unittest.main()